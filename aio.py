@@ -0,0 +1,192 @@
+"""
+asyncio 接口
+
+在事件循环里直接调用 MTEF.OpenBytes(...).Translate() 会阻塞整个循环，大公式拖慢所有请求。
+AsyncTranslator 把翻译交给 executor（线程池或进程池），信号量限制同时提交的数量，
+每次调用可以设置超时，等待方被取消时尚未开始的任务一并取消：
+
+    from mtef.aio import AsyncTranslator
+
+    translator = AsyncTranslator(concurrency=8, timeout=2.0)
+    result = await translator.translate(bts)          # batch.Result
+    results = await translator.translateMany(objects)  # 与输入顺序一致
+
+也可以直接使用模块级的 translateAsync / translateManyAsync（默认线程池、并发数为 CPU 核数）。
+同一个 AsyncTranslator 可以在多个事件循环中使用（如多次 asyncio.run），并发数按循环分别计算。
+
+线程中的任务无法中途停止：超时后调用方立即得到 FailureKind.TIMEOUT，任务在后台跑完，
+期间继续占用一个并发名额，避免超时的请求越积越多。传入 cache（cache.TranslationCache）时，
+超时会上报给它的负缓存并被隔离，之后相同输入直接返回失败。
+
+很小的公式不值得切换线程时，translateCooperative 在事件循环中直接翻译：渲染按
+MTEF.TranslateIter 分片，片与片之间 await，节点很多的公式退化为许多短片，不会长时间独占循环。
+record 解析不分片，耗时与数据长度成正比，超过 maxInlineBytes 的公式仍交给 executor。
+"""
+import asyncio
+import os
+import weakref
+from io import BytesIO
+from .batch import Result, translateOne
+from .cache import FailureKind, bodyDigest
+from .minify import OutputProfile
+
+
+class AsyncTranslator:
+    def __init__(self, executor=None, concurrency=None, timeout=None, processes=False, cache=None):
+        # executor Executor //为空时按 processes 创建线程池或进程池
+        self.executor = executor
+        self.owned = executor is None
+        # processes bool //自动创建时使用进程池
+        self.processes = processes
+        # concurrency int //同时提交给 executor 的任务数上限
+        self.concurrency = concurrency or os.cpu_count() or 1
+        # timeout float //默认超时（秒），None 表示不限
+        self.timeout = timeout
+        # cache *TranslationCache //可选，检查并上报失败
+        self.cache = cache
+        # semaphores map[loop]asyncio.Semaphore //asyncio.Semaphore 只能在一个事件循环中使用，每个循环第一次调用时各建一个
+        self.semaphores = weakref.WeakKeyDictionary()
+
+        self.timeouts = 0
+        self.cancelled = 0
+
+    def getExecutor(self):
+        if self.executor is None:
+            if self.processes:
+                from concurrent.futures import ProcessPoolExecutor
+                self.executor = ProcessPoolExecutor(max_workers=self.concurrency)
+            else:
+                from concurrent.futures import ThreadPoolExecutor
+                self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='mtef')
+        return self.executor
+
+    def getSemaphore(self, loop):
+        semaphore = self.semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self.semaphores[loop] = asyncio.Semaphore(self.concurrency)
+        return semaphore
+
+    async def translate(self, bts, profile=OutputProfile.DEFAULT, timeout=None):
+        """
+        翻译一个 OLE 公式对象，返回 Result；timeout 为空时使用默认超时
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if self.cache is not None:
+            failure = self.cache.failures.get(bodyDigest(bts))
+            if failure is not None:
+                return Result('', failure.kind, failure.message)
+        loop = asyncio.get_running_loop()
+        semaphore = self.getSemaphore(loop)
+
+        try:
+            await semaphore.acquire()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        try:
+            task = self.getExecutor().submit(translateOne, bts, profile)
+        except BaseException:
+            semaphore.release()
+            raise
+        # 名额跟随 executor 中的任务：跑完或在排队时被取消才归还，超时后仍在运行的任务继续占用
+        task.add_done_callback(lambda _: releaseSoon(loop, semaphore))
+        future = asyncio.wrap_future(task, loop=loop)
+
+        try:
+            latex, kind, error = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            # 只能取消仍在排队的任务，已开始的任务跑完后归还名额
+            task.cancel()
+            message = '%gs' % timeout
+            if self.cache is not None:
+                self.cache.recordFailure(bts, FailureKind.TIMEOUT, message)
+            return Result('', FailureKind.TIMEOUT, message)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            task.cancel()
+            raise
+        return Result(latex, kind, error)
+
+    async def translateMany(self, items, profile=OutputProfile.DEFAULT, timeout=None):
+        """
+        并发翻译，返回与输入顺序一致的 [Result]；timeout 作用于每一项
+        """
+        return await asyncio.gather(*[self.translate(bts, profile, timeout) for bts in items])
+
+    def close(self, wait=True):
+        if self.owned and self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'timeouts': self.timeouts,
+            'cancelled': self.cancelled,
+        }
+
+
+def releaseSoon(loop, semaphore):
+    """
+    executor 中的任务结束时调用：在 semaphore 所属的循环中归还名额；循环已关闭时名额随信号量一起丢弃
+    """
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:
+        pass
+
+
+async def translateCooperative(bts, profile=OutputProfile.DEFAULT, sliceNodes=256, sliceMicros=1000,
+                               maxInlineBytes=4096, translator=None):
+    """
+    在当前事件循环中翻译，每片渲染后让出一次，返回 Result；
+    MTEF 数据超过 maxInlineBytes 时交给 translator（默认为模块级的 AsyncTranslator）
+    """
+    from .mtef import MTEF
+
+    try:
+        body, err = MTEF.ReadEquationNative(BytesIO(bts))
+        if body is None:
+            return Result('', FailureKind.INVALID, err or 'MTEF.Open: Equation Native not found')
+        if maxInlineBytes is not None and len(body) > maxInlineBytes:
+            return await (translator or getDefaultTranslator()).translate(bts, profile)
+        eqn, err = MTEF.OpenBody(body)
+        if err is not None:
+            return Result('', FailureKind.ERROR, err)
+        if not eqn.Valid:
+            return Result('', FailureKind.UNSUPPORTED if eqn.InvalidReason else FailureKind.INVALID,
+                          eqn.InvalidReason)
+        await asyncio.sleep(0)
+
+        slices = eqn.TranslateIter(profile, sliceNodes, sliceMicros)
+        while True:
+            try:
+                next(slices)
+            except StopIteration as stop:
+                return Result(stop.value)
+            await asyncio.sleep(0)
+    except (RecursionError, MemoryError) as exc:
+        return Result('', FailureKind.BLOWUP, type(exc).__name__)
+    except Exception as exc:
+        return Result('', FailureKind.ERROR, '%s: %s' % (type(exc).__name__, exc))
+
+
+# defaultTranslator *AsyncTranslator //模块级函数使用，第一次调用时创建
+defaultTranslator = None
+
+
+def getDefaultTranslator():
+    global defaultTranslator
+    if defaultTranslator is None:
+        defaultTranslator = AsyncTranslator()
+    return defaultTranslator
+
+
+async def translateAsync(bts, profile=OutputProfile.DEFAULT, timeout=None):
+    return await getDefaultTranslator().translate(bts, profile, timeout)
+
+
+async def translateManyAsync(items, profile=OutputProfile.DEFAULT, timeout=None):
+    return await getDefaultTranslator().translateMany(items, profile, timeout)
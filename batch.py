@@ -0,0 +1,158 @@
+"""
+批量翻译
+
+逐个调用 MTEF.OpenBytes(bts).Translate() 只能用到一个核，失败时也只有日志和空字符串。
+translateMany 把输入按条数与字节数分块后交给进程池，结果保持输入顺序，每项为 Result：
+
+    from mtef.batch import translateMany
+
+    for result in translateMany(objects, workers=32):
+        if result.ok:
+            use(result.latex)
+        else:
+            report(result.kind, result.error)   # kind 为 cache.FailureKind
+
+小公式按块发送，每块一次 IPC；同时在途的块数有上限，输入可以是生成器，不会一次读入内存。
+iterTranslate 按顺序逐项产出，适合流式处理。workers <= 1 时在当前进程中翻译。
+
+threads=True 时使用线程池：解析过程没有跨实例共享的可变状态，输入不需要 pickle；
+在 free-threaded 构建（python3.13t）上随线程数扩展，有 GIL 时没有加速。
+"""
+import os
+from collections import deque
+from io import BytesIO
+from .cache import FailureKind
+from .minify import OutputProfile
+
+
+class Result:
+    __slots__ = ('latex', 'kind', 'error')
+
+    def __init__(self, latex='', kind=None, error=''):
+        # latex string
+        self.latex = latex
+        # kind string //FailureKind，成功时为 None
+        self.kind = kind
+        # error string
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.kind is None
+
+    def __repr__(self):
+        if self.ok:
+            return 'Result(%r)' % self.latex
+        return 'Result(kind=%r, error=%r)' % (self.kind, self.error)
+
+
+def translateOne(bts, profile=OutputProfile.DEFAULT):
+    """
+    翻译一个 OLE 公式对象，返回 (latex, kind, error)
+    """
+    from .mtef import MTEF
+
+    try:
+        body, err = MTEF.ReadEquationNative(BytesIO(bts))
+    except (RecursionError, MemoryError) as exc:
+        return '', FailureKind.BLOWUP, type(exc).__name__
+    except Exception as exc:
+        return '', FailureKind.ERROR, '%s: %s' % (type(exc).__name__, exc)
+    if body is None:
+        return '', FailureKind.INVALID, err or 'MTEF.Open: Equation Native not found'
+    return translateBody(body, profile)
+
+
+def translateBody(body, profile=OutputProfile.DEFAULT):
+    """
+    翻译 MTEF 数据（ReadEquationNative 的结果），返回 (latex, kind, error)
+    """
+    from .mtef import MTEF
+
+    try:
+        eqn, err = MTEF.OpenBody(body)
+        if err is not None:
+            return '', FailureKind.ERROR, err
+        if not eqn.Valid:
+            kind = FailureKind.UNSUPPORTED if eqn.InvalidReason else FailureKind.INVALID
+            return '', kind, eqn.InvalidReason
+        return eqn.Translate(profile), None, ''
+    except (RecursionError, MemoryError) as exc:
+        return '', FailureKind.BLOWUP, type(exc).__name__
+    except Exception as exc:
+        return '', FailureKind.ERROR, '%s: %s' % (type(exc).__name__, exc)
+
+
+def translateChunk(chunk, profile=OutputProfile.DEFAULT):
+    """
+    worker 中执行：翻译一块输入，返回 [(latex, kind, error)]
+    """
+    return [translateOne(bts, profile) for bts in chunk]
+
+
+def chunked(items, chunksize, chunkBytes):
+    """
+    按条数与字节数上限分块
+    """
+    chunk = []
+    size = 0
+    for bts in items:
+        chunk.append(bts)
+        size += len(bts)
+        if len(chunk) >= chunksize or size >= chunkBytes:
+            yield chunk
+            chunk = []
+            size = 0
+    if chunk:
+        yield chunk
+
+
+def iterTranslate(items, workers=None, chunksize=64, chunkBytes=1 << 20,
+                  profile=OutputProfile.DEFAULT, executor=None, threads=False):
+    """
+    按输入顺序逐项产出 Result
+
+    workers 默认为 CPU 核数；传入 executor（如长期使用的 ProcessPoolExecutor）时忽略 workers 与 threads
+    """
+    if profile not in (OutputProfile.DEFAULT, OutputProfile.COMPACT):
+        raise ValueError('unknown output profile: %r' % (profile,))
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if executor is None and workers <= 1:
+        for bts in items:
+            yield Result(*translateOne(bts, profile))
+        return
+
+    owned = executor is None
+    if owned and threads:
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=workers)
+    elif owned:
+        from concurrent.futures import ProcessPoolExecutor
+        executor = ProcessPoolExecutor(max_workers=workers)
+    # pending deque[Future] //在途的块，按提交顺序
+    pending = deque()
+    maxPending = 2 * (getattr(executor, '_max_workers', None) or workers)
+    try:
+        for chunk in chunked(items, chunksize, chunkBytes):
+            pending.append(executor.submit(translateChunk, chunk, profile))
+            if len(pending) >= maxPending:
+                for item in pending.popleft().result():
+                    yield Result(*item)
+        while pending:
+            for item in pending.popleft().result():
+                yield Result(*item)
+    finally:
+        for future in pending:
+            future.cancel()
+        if owned:
+            executor.shutdown(wait=True)
+
+
+def translateMany(items, workers=None, chunksize=64, chunkBytes=1 << 20,
+                  profile=OutputProfile.DEFAULT, executor=None, threads=False):
+    """
+    批量翻译，返回与输入顺序一致的 [Result]
+    """
+    return list(iterTranslate(items, workers, chunksize, chunkBytes, profile, executor, threads))
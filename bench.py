@@ -0,0 +1,755 @@
+"""
+性能基准
+
+    python -m mtef.bench importtime [--budget MS] [--repeat N]
+    python -m mtef.bench compact [--corpus DIR] [--count N]
+    python -m mtef.bench memory [--corpus DIR] [--count N] [--flat]
+    python -m mtef.bench render [--corpus DIR] [--count N] [--repeat N]
+    python -m mtef.bench memo [--corpus DIR] [--count N] [--entries N]
+    python -m mtef.bench batch [--corpus DIR] [--count N] [--workers 1,2,4,...] [--chunksize N] [--threads]
+
+--corpus 指向存放 OLE 公式对象（.bin/.ole）的目录；不指定时用固定种子合成 v5/v3 公式。
+"""
+import argparse
+import os
+import random
+import re
+import struct
+import subprocess
+import sys
+
+PACKAGE = __package__ or 'mtef'
+
+
+def importTime(module):
+    """
+    用 -X importtime 在子进程中导入 module，返回 [(self_us, cumulative_us, name)]
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    # 按已缓存的字节码计时，与线上进程一致
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module],
+                          env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr)
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        selfUs, cumulativeUs, name = line[len('import time:'):].split('|')
+        rows.append((int(selfUs), int(cumulativeUs), name.strip()))
+    return rows
+
+
+def benchImportTime(args):
+    module = '%s.mtef' % PACKAGE
+    best = None
+    for _ in range(args.repeat):
+        rows = importTime(module)
+        total = next(cumulative for _, cumulative, name in rows if name == module)
+        if best is None or total < best[0]:
+            best = (total, rows)
+
+    total, rows = best
+    print('import %s: %.1f ms (best of %d, budget %.1f ms)' % (module, total / 1000, args.repeat, args.budget))
+    for selfUs, _, name in sorted(rows, reverse=True)[:args.top]:
+        print('  %8.1f ms  %s' % (selfUs / 1000, name))
+
+    if total / 1000 > args.budget:
+        print('over budget')
+        return 1
+    return 0
+
+
+def packOle(body):
+    """
+    把 MTEF 数据包装成只含 "Equation Native" 流的最小 OLE 文件（全部使用常规扇区）
+    """
+    stream = struct.pack('<HIHI', 28, 0x00020000, 0xC1C6, len(body)) + b'\0' * 16 + body
+    size = len(stream)
+    sectors = (size + 511) // 512 or 1
+    stream = stream.ljust(sectors * 512, b'\0')
+    # 扇区 0 为 FAT，1 为目录，2 起为数据流
+    fat = [0xFFFFFFFD, 0xFFFFFFFE] + [3 + i if i < sectors - 1 else 0xFFFFFFFE for i in range(sectors)]
+    fat += [0xFFFFFFFF] * (128 - len(fat))
+
+    header = struct.pack('<II', 0xE011CFD0, 0xE11AB1A1) + b'\0' * 16 + struct.pack('<HHHHH', 0x3e, 3, 0xFFFE, 9, 6)
+    header += b'\0' * 10 + struct.pack('<II', 1, 1) + b'\0' * 4
+    header += struct.pack('<IIIII', 0, 0xFFFFFFFE, 0, 0xFFFFFFFE, 0)
+    header += struct.pack('<I', 0) + struct.pack('<I', 0xFFFFFFFF) * 108
+
+    def entry(name, typ, start, size):
+        name = name.encode('utf-16-le') + b'\0\0'
+        return name.ljust(64, b'\0') + struct.pack('<HBB', len(name), typ, 1) \
+            + struct.pack('<III', 0xFFFFFFFF, 0xFFFFFFFF, 0xFFFFFFFF) + b'\0' * 36 + struct.pack('<III', start, size, 0)
+
+    entries = entry('Root Entry', 5, 0xFFFFFFFE, 0) + entry('Equation Native', 2, 2, size) + b'\0' * 256
+    return header + b''.join(struct.pack('<I', sector) for sector in fat) + entries + stream
+
+
+# 合成公式使用的 selector、字体与字符
+SynthSelectors = [0, 1, 2, 3, 4, 5, 6, 7, 9, 10, 11, 12, 13, 14, 15, 16, 17, 21, 23, 27, 28, 29, 31, 32, 33, 34, 37]
+SynthSelectorsV3 = [0, 1, 2, 3, 13, 14, 15, 17, 21, 29, 31, 44]
+SynthTypefaces = [129, 130, 131, 132, 133, 134, 136, 139, 152]
+SynthCodes = list(range(0x41, 0x5b)) + list(range(0x61, 0x7b)) + list(range(0x30, 0x3a)) \
+    + [0x2b, 0x2d, 0x3d, 0x28, 0x29, 0x3b1, 0x3b2, 0x2211, 0x222b, 0x2264, 0x221e, 0x2192, 0x20]
+
+
+def synthV5(rng):
+    out = bytearray(b'\x05\x01\x00\x06\x09DSMT4\x00\x00')
+
+    def line(depth):
+        out.extend(b'\x01\x00')
+        for _ in range(rng.randint(1, 6)):
+            r = rng.random()
+            if r < 0.25 and depth < 3:
+                out.extend(bytes([3, 0, rng.choice(SynthSelectors), rng.choice([0, 1, 2, 3]), 0]))
+                for _ in range(rng.randint(2, 4)):
+                    line(depth + 1)
+                out.append(0)
+            elif r < 0.3 and depth < 3:
+                out.extend(b'\x04\x00\x01\x01')
+                for _ in range(rng.randint(1, 3)):
+                    line(depth + 1)
+                out.append(0)
+            else:
+                out.extend(bytes([2, 0, rng.choice(SynthTypefaces)]) + struct.pack('<H', rng.choice(SynthCodes)))
+        out.append(0)
+
+    line(0)
+    out.append(0)
+    return bytes(out)
+
+
+def synthV3(rng):
+    out = bytearray(b'\x03\x01\x00\x03\x00')
+
+    def line(depth):
+        out.append(1)
+        for _ in range(rng.randint(1, 6)):
+            if rng.random() < 0.3 and depth < 3:
+                out.extend(bytes([3, rng.choice(SynthSelectorsV3), rng.choice([0, 1, 2]), 0]))
+                for _ in range(rng.randint(1, 3)):
+                    line(depth + 1)
+                out.append(0)
+            else:
+                out.extend(bytes([2, rng.choice(SynthTypefaces)]) + struct.pack('<H', rng.choice(SynthCodes)))
+        out.append(0)
+
+    line(0)
+    out.append(0)
+    return bytes(out)
+
+
+def synthMatrixV3(rng):
+    """
+    矩阵为主的 v3 公式，单元格取自一小组常见片段（1/2、x_i、\\sqrt{2} 等）
+    """
+    def char(code, typeface=131):
+        return bytes([2, typeface]) + struct.pack('<H', code)
+
+    def line(*items):
+        return b'\x01' + b''.join(items) + b'\x00'
+
+    def tmpl(selector, variation, *lines):
+        return bytes([3, selector, variation, 0]) + b''.join(lines) + b'\x00'
+
+    cells = [
+        line(char(0x30)),
+        line(char(0x31)),
+        line(char(0x78)),
+        line(tmpl(14, 0, line(char(0x31)), line(char(0x32)))),
+        line(char(0x78), tmpl(15, 1, line(char(0x69)))),
+        line(char(0x61), tmpl(15, 0, line(char(0x32)))),
+        line(tmpl(13, 0, line(char(0x32)))),
+        line(char(0x2d), tmpl(14, 0, line(char(0x3c0, 134)), line(char(0x34)))),
+    ]
+
+    out = bytearray(b'\x03\x01\x00\x03\x00\x01')
+    for _ in range(rng.randint(1, 3)):
+        rows, cols = rng.randint(2, 4), rng.randint(2, 4)
+        out.extend(char(0x41 + rng.randrange(26)) + char(0x3d))
+        out.extend(bytes([5, 0, 1, 1, rows, cols]) + b'\0' * ((rows + 4) // 4) + b'\0' * ((cols + 4) // 4))
+        out.extend(b''.join(rng.choice(cells) for _ in range(rows * cols)) + b'\x00')
+    out.extend(b'\x00\x00')
+    return bytes(out)
+
+
+def loadCorpus(path=None, count=400, seed=1):
+    """
+    读取目录下的 OLE 公式对象；path 为空时按种子合成 count 个（v5、v3 各半）
+    """
+    if path:
+        names = sorted(name for name in os.listdir(path) if name.endswith(('.bin', '.ole')))
+        corpus = []
+        for name in names[:count]:
+            with open(os.path.join(path, name), 'rb') as f:
+                corpus.append(f.read())
+        return corpus
+
+    rng = random.Random(seed)
+    return [packOle(synthV5(rng) if i % 2 else synthV3(rng)) for i in range(count)]
+
+
+def translateCorpus(corpus, profile):
+    """
+    翻译语料，跳过无法解析的对象
+    """
+    from .mtef import MTEF
+
+    results = []
+    for bts in corpus:
+        try:
+            eqn, err = MTEF.OpenBytes(bts)
+            if err is not None or eqn is None:
+                continue
+            results.append(eqn.Translate(profile))
+        except Exception:
+            continue
+    return results
+
+
+# 粗略的 token 估计：控制词、连续字母、单个数字、其余单个可见字符各算一个
+tokenEstimatePattern = re.compile(r'\\[A-Za-z]+|[A-Za-z]+|\d|\S')
+
+
+def benchCompact(args):
+    from .logger import setLoggerFactory
+    from .minify import OutputProfile
+    import logging
+
+    # 合成语料中有大量不支持的模板，不输出告警
+    setLoggerFactory(lambda name: logging.getLogger('%s.bench' % PACKAGE))
+    logging.getLogger('%s.bench' % PACKAGE).disabled = True
+
+    corpus = loadCorpus(args.corpus, args.count, args.seed)
+    default = translateCorpus(corpus, OutputProfile.DEFAULT)
+    compact = translateCorpus(corpus, OutputProfile.COMPACT)
+
+    print('equations: %d (translated %d)' % (len(corpus), len(default)))
+    print('%-8s %12s %12s' % ('', 'bytes', 'tokens~'))
+    rows = []
+    for name, outputs in (('default', default), ('compact', compact)):
+        size = sum(len(latex.encode('utf-8')) for latex in outputs)
+        tokens = sum(len(tokenEstimatePattern.findall(latex)) for latex in outputs)
+        rows.append((size, tokens))
+        print('%-8s %12d %12d' % (name, size, tokens))
+    (size, tokens), (compactSize, compactTokens) = rows
+    print('saved    %11.1f%% %11.1f%%' % (100 - 100.0 * compactSize / max(size, 1),
+                                         100 - 100.0 * compactTokens / max(tokens, 1)))
+    return 0
+
+
+def parseCorpus(corpus, flat=False):
+    """
+    解析语料并保留全部 MTEF 对象（flat 为 True 时只保留 FlatAST），跳过无法解析的对象
+    """
+    from .mtef import MTEF
+
+    equations = []
+    for bts in corpus:
+        try:
+            eqn, err = MTEF.OpenBytes(bts)
+        except Exception:
+            continue
+        if err is None and eqn is not None:
+            equations.append(eqn.flatten() if flat else eqn)
+    return equations
+
+
+def benchMemory(args):
+    import gc
+    import tracemalloc
+    from .chartable import loadCharTables
+
+    corpus = loadCorpus(args.corpus, args.count, args.seed)
+    # 字符表等一次性开销不计入
+    loadCharTables()
+    parseCorpus(corpus[:1], args.flat)
+    gc.collect()
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    equations = parseCorpus(corpus, args.flat)
+    gc.collect()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    count = max(len(equations), 1)
+    print('equations: %d (parsed %d, %s)' % (len(corpus), len(equations), 'FlatAST' if args.flat else 'MtAST'))
+    print('retained: %d bytes/equation' % ((after - before) // count))
+    print('peak:     %d bytes/equation' % ((peak - before) // count))
+    return 0
+
+
+def benchRender(args):
+    import time
+    from .logger import setLoggerFactory
+    import logging
+
+    setLoggerFactory(lambda name: logging.getLogger('%s.bench' % PACKAGE))
+    logging.getLogger('%s.bench' % PACKAGE).disabled = True
+
+    equations = parseCorpus(loadCorpus(args.corpus, args.count, args.seed))
+    count = max(len(equations), 1)
+    nodes = sum(len(eqn.flatten()) for eqn in equations)
+
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        for eqn in equations:
+            eqn.Translate()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print('equations: %d' % len(equations))
+    print('nodes:     %.1f/equation' % (nodes / count))
+    print('translate: %.1f us/equation (best of %d)' % (best * 1e6 / count, args.repeat))
+    return 0
+
+
+def benchMemo(args):
+    import time
+    from . import memo
+    from .logger import setLoggerFactory
+    import logging
+
+    setLoggerFactory(lambda name: logging.getLogger('%s.bench' % PACKAGE))
+    logging.getLogger('%s.bench' % PACKAGE).disabled = True
+
+    if args.corpus:
+        corpus = loadCorpus(args.corpus, args.count)
+    else:
+        rng = random.Random(args.seed)
+        corpus = [packOle(synthMatrixV3(rng)) for _ in range(args.count)]
+
+    def parse(enabled):
+        if enabled:
+            memo.enableRenderMemo(args.entries)
+        else:
+            memo.disableRenderMemo()
+        start = time.perf_counter()
+        equations = parseCorpus(corpus)
+        return time.perf_counter() - start, equations
+
+    def render(equations):
+        start = time.perf_counter()
+        outputs = [eqn.Translate() for eqn in equations]
+        return time.perf_counter() - start, outputs
+
+    try:
+        parseTime, equations = parse(False)
+        renderTime, expected = render(equations)
+
+        memoParseTime, equations = parse(True)
+        renderMemo = memo.renderMemo
+        memoRenderTime, outputs = render(equations)
+        stats = renderMemo.stats()
+        # 记忆表已热（同一批公式再渲染一次，如再输出 compact 或重新渲染）
+        warmRenderTime, _ = render(equations)
+    finally:
+        memo.disableRenderMemo()
+
+    count = max(len(equations), 1)
+    print('equations: %d%s' % (len(equations), '' if outputs == expected else ' (OUTPUT MISMATCH)'))
+    print('memo:      hit rate %.1f%% (%d hits, %d misses, %d evictions)' % (
+        stats['hitRate'] * 100, stats['hits'], stats['misses'], stats['evictions']))
+    print('parse:     %.1f -> %.1f us/equation (with subtree keys)' % (
+        parseTime * 1e6 / count, memoParseTime * 1e6 / count))
+    print('render:    %.1f -> %.1f us/equation (warm memo: %.1f)' % (
+        renderTime * 1e6 / count, memoRenderTime * 1e6 / count, warmRenderTime * 1e6 / count))
+    saved = renderTime - memoRenderTime
+    print('saved:     %.1f us/equation (%.1f%% of render)' % (saved * 1e6 / count, 100.0 * saved / max(renderTime, 1e-9)))
+    return 0 if outputs == expected else 1
+
+
+def benchBatch(args):
+    """
+    translateMany 在不同 worker 数下的吞吐量，进程池启动不计入
+    """
+    import time
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+    from .logger import setLoggerFactory
+    from .batch import translateMany
+    import logging
+
+    # fork 出的 worker 继承关闭的告警
+    setLoggerFactory(lambda name: logging.getLogger('%s.bench' % PACKAGE))
+    logging.getLogger('%s.bench' % PACKAGE).disabled = True
+    corpus = loadCorpus(args.corpus, args.count, args.seed) * args.repeat
+    if args.workers:
+        counts = [int(n) for n in args.workers.split(',')]
+    else:
+        cpus = os.cpu_count() or 1
+        counts = sorted(set([1, 2, 4, 8, 16, 32, cpus]) & set(range(1, cpus + 1)))
+
+    pool = ThreadPoolExecutor if args.threads else ProcessPoolExecutor
+    gil = getattr(sys, '_is_gil_enabled', lambda: True)()
+    print('%d equations, %d cpus, %s pool, GIL %s' % (
+        len(corpus), os.cpu_count() or 1, 'thread' if args.threads else 'process', 'enabled' if gil else 'disabled'))
+    baseline = None
+    expected = None
+    for workers in counts:
+        with pool(max_workers=workers) as executor:
+            # 预热：启动全部 worker 并完成导入
+            translateMany(corpus[:workers], chunksize=1, executor=executor)
+            start = time.perf_counter()
+            results = translateMany(corpus, chunksize=args.chunksize, executor=executor)
+            elapsed = time.perf_counter() - start
+        outputs = [result.latex for result in results]
+        if expected is None:
+            expected = outputs
+        elif outputs != expected:
+            print('output mismatch with %d workers' % workers)
+            return 1
+        baseline = baseline or elapsed
+        print('workers %3d: %8.0f eq/s  speedup %.2fx' % (workers, len(corpus) / elapsed, baseline / elapsed))
+    return 0
+
+
+def benchMicrobatch(args):
+    """
+    clients 个并发调用方逐个提交单个公式：每个请求一次 run_in_executor 与经 MicroBatcher 攒批的吞吐量和延迟
+    """
+    import asyncio
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    from .microbatch import MicroBatcher, Lane
+    from .serve import translateInputs, warmWorker, ping
+    from .logger import setLoggerFactory
+    import logging
+
+    setLoggerFactory(lambda name: logging.getLogger('%s.bench' % PACKAGE))
+    logging.getLogger('%s.bench' % PACKAGE).disabled = True
+    corpus = loadCorpus(args.corpus, args.count, args.seed)
+    items = [('ole', bts) for bts in corpus]
+
+    async def drive(submit):
+        latencies = []
+
+        async def client(offset):
+            for i in range(offset, len(items) * args.repeat, args.clients):
+                start = time.perf_counter()
+                await submit(items[i % len(items)])
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[client(offset) for offset in range(args.clients)])
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return len(latencies) / elapsed, latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=warmWorker) as executor:
+            await asyncio.gather(*[loop.run_in_executor(executor, ping) for _ in range(args.workers)])
+            semaphore = asyncio.Semaphore(2 * args.workers)
+
+            async def direct(item):
+                async with semaphore:
+                    return (await loop.run_in_executor(executor, translateInputs, [item]))[0]
+
+            print('%d equations x %d, %d clients, %d workers' % (len(items), args.repeat, args.clients, args.workers))
+            print('%-12s %10s %9s %9s' % ('', 'eq/s', 'p50 ms', 'p99 ms'))
+            print('%-12s %10.0f %9.2f %9.2f' % (('direct',) + await drive(direct)))
+            batcher = MicroBatcher(executor, args.batch_size, args.batch_delay / 1e3)
+            await batcher.start()
+            try:
+                # maxBatch、maxDelay 作用于批量通道
+                async def bulk(item):
+                    return await batcher.submit(item, lane=Lane.BULK)
+
+                print('%-12s %10.0f %9.2f %9.2f' % (('microbatch',) + await drive(bulk)))
+            finally:
+                await batcher.close()
+            print('mean batch %.1f' % batcher.stats()['meanBatch'])
+
+    asyncio.run(run())
+    return 0
+
+
+def benchLanes(args):
+    """
+    批量任务占满进程池时交互请求的延迟：单一 FIFO 队列、按权重轮转、严格优先
+    """
+    import asyncio
+    import time
+    from concurrent.futures import ProcessPoolExecutor
+    from .microbatch import MicroBatcher, Lane, LaneSpec, defaultLanes
+    from .serve import warmWorker, ping
+    from .logger import setLoggerFactory
+    import logging
+
+    setLoggerFactory(lambda name: logging.getLogger('%s.bench' % PACKAGE))
+    logging.getLogger('%s.bench' % PACKAGE).disabled = True
+    corpus = loadCorpus(args.corpus, args.count, args.seed)
+    items = [('ole', bts) for bts in corpus]
+
+    async def drive(batcher, interactiveLane):
+        stop = asyncio.Event()
+        bulkDone = [0]
+        latencies = []
+
+        async def bulk():
+            while not stop.is_set():
+                results = await batcher.submitMany(items, lane=Lane.BULK)
+                bulkDone[0] += len(results)
+
+        async def interactive(offset):
+            for i in range(offset, args.requests, args.interactive):
+                start = time.perf_counter()
+                await batcher.submit(items[i % len(items)], lane=interactiveLane)
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(args.interval / 1e3)
+
+        flood = [asyncio.ensure_future(bulk()) for _ in range(args.bulk)]
+        # 先让批量任务占满进程池
+        await asyncio.sleep(0.2)
+        start = time.perf_counter()
+        await asyncio.gather(*[interactive(offset) for offset in range(args.interactive)])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await asyncio.gather(*flood)
+        latencies.sort()
+        return (latencies[len(latencies) // 2] * 1e3, latencies[int(len(latencies) * 0.99)] * 1e3,
+                sum(1 for value in latencies if value * 1e3 <= args.slo) / len(latencies), bulkDone[0] / elapsed)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=warmWorker) as executor:
+            await asyncio.gather(*[loop.run_in_executor(executor, ping) for _ in range(args.workers)])
+            print('%d workers, %d bulk submitters, %d interactive clients every %gms, SLO %gms' % (
+                args.workers, args.bulk, args.interactive, args.interval, args.slo))
+            print('%-10s %9s %9s %8s %10s' % ('', 'p50 ms', 'p99 ms', 'in SLO', 'bulk eq/s'))
+            configs = [
+                ('fifo', {Lane.BULK: LaneSpec(1, 64, 0.002, 1 << 20)}, False, 0, Lane.BULK),
+                ('weighted', None, False, args.reserved, Lane.INTERACTIVE),
+                ('strict', None, True, args.reserved, Lane.INTERACTIVE),
+            ]
+            for name, lanes, strict, reserved, interactiveLane in configs:
+                if lanes is None:
+                    lanes = defaultLanes(64, 0.002, 1 << 20)
+                batcher = MicroBatcher(executor, lanes=lanes, strict=strict, reserved=reserved)
+                await batcher.start()
+                try:
+                    p50, p99, within, bulkRate = await drive(batcher, interactiveLane)
+                finally:
+                    await batcher.close()
+                print('%-10s %9.2f %9.2f %7.1f%% %10.0f' % (name, p50, p99, within * 100, bulkRate))
+
+    asyncio.run(run())
+    return 0
+
+
+def benchRecycle(args):
+    """
+    语料反复经过 RecyclingPool，每轮结束后记录各 worker 的常驻内存与回收次数
+    """
+    from .batch import translateMany
+    from .pool import RecyclingPool
+    from .serve import warmWorker
+    from .logger import setLoggerFactory
+    import logging
+
+    setLoggerFactory(lambda name: logging.getLogger('%s.bench' % PACKAGE))
+    logging.getLogger('%s.bench' % PACKAGE).disabled = True
+    corpus = loadCorpus(args.corpus, args.count, args.seed)
+    maxRSS = args.max_rss << 20 if args.max_rss else None
+    pool = RecyclingPool(args.workers, initializer=warmWorker, maxTasks=args.max_tasks, maxRSS=maxRSS)
+    print('%d workers, max tasks %s, max rss %s' % (
+        args.workers, args.max_tasks or '-', '%dMB' % args.max_rss if args.max_rss else '-'))
+    try:
+        for index in range(1, args.rounds + 1):
+            translateMany(corpus, chunksize=args.chunksize, executor=pool)
+            stats = pool.stats()
+            rss = sorted(stats['rss'].values())
+            print('round %3d: rss %s MB  started %d  recycled %s' % (
+                index, ' '.join('%.1f' % (value / (1 << 20)) for value in rss), stats['started'], stats['recycled']))
+    finally:
+        pool.shutdown()
+    return 0
+
+
+def settleWorker(delay):
+    """
+    在 worker 中执行一次完整回收，停留 delay 秒使每个 worker 各领到一个任务
+    """
+    import gc
+    import time
+
+    gc.collect()
+    time.sleep(delay)
+    return os.getpid()
+
+
+def forkMode(args):
+    """
+    在当前（全新的）进程中按 args.mode 创建进程池，返回各项指标
+    """
+    import multiprocessing
+    import time
+    from .batch import translateMany
+    from .pool import RecyclingPool, prewarm, memoryInfo
+    from .serve import warmWorker
+    from .logger import setLoggerFactory
+    import logging
+
+    setLoggerFactory(lambda name: logging.getLogger('%s.bench' % PACKAGE))
+    logging.getLogger('%s.bench' % PACKAGE).disabled = True
+    corpus = loadCorpus(args.corpus, args.count, args.seed)
+
+    start = time.perf_counter()
+    if args.mode in ('prewarm', 'freeze'):
+        prewarm(warmWorker, freeze=args.mode == 'freeze')
+    parentMs = (time.perf_counter() - start) * 1e3
+
+    # forkserver 为 RecyclingPool 的默认方式，其余三种直接从父进程 fork
+    context = None if args.mode == 'forkserver' else multiprocessing.get_context('fork')
+    start = time.perf_counter()
+    pool = RecyclingPool(args.workers, initializer=warmWorker, context=context)
+    try:
+        pids = [future.result() for future in [pool.submit(settleWorker, 0.01) for _ in range(args.workers)]]
+        startMs = (time.perf_counter() - start) * 1e3
+        for _ in range(args.rounds):
+            translateMany(corpus, chunksize=16, executor=pool)
+        [future.result() for future in [pool.submit(settleWorker, 0.05) for _ in range(args.workers)]]
+        infos = [memoryInfo(pid) for pid in pids]
+    finally:
+        pool.shutdown()
+    return {
+        'parentMs': parentMs,
+        'startMs': startMs,
+        'rss': sum(info.get('rss', 0) for info in infos) / len(infos),
+        'uss': sum(info.get('uss', 0) for info in infos) / len(infos),
+    }
+
+
+def benchFork(args):
+    """
+    worker 启动耗时与每个 worker 独占的内存（USS）：cold（worker 各自建表）、prewarm（父进程建表）、
+    freeze（父进程建表后 gc.freeze）、forkserver（forkserver 建表后 gc.freeze）；每种方式在新的解释器中运行
+    """
+    import json
+
+    if args.mode:
+        print(json.dumps(forkMode(args)))
+        return 0
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+    argv = ['--count', str(args.count), '--seed', str(args.seed), '--workers', str(args.workers),
+            '--rounds', str(args.rounds)] + (['--corpus', args.corpus] if args.corpus else [])
+    print('%d workers, %d rounds' % (args.workers, args.rounds))
+    print('%-10s %12s %12s %12s %12s' % ('', 'parent ms', 'startup ms', 'rss MB', 'uss MB'))
+    for mode in ('cold', 'prewarm', 'freeze', 'forkserver'):
+        proc = subprocess.run([sys.executable, '-m', '%s.bench' % PACKAGE, 'fork', '--mode', mode] + argv,
+                              env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr)
+        row = json.loads(proc.stdout.strip().splitlines()[-1])
+        print('%-10s %12.1f %12.1f %12.1f %12.1f' % (
+            mode, row['parentMs'], row['startMs'], row['rss'] / (1 << 20), row['uss'] / (1 << 20)))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='%s.bench' % PACKAGE)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser('importtime', help='冷启动导入耗时，超出预算时返回非零')
+    cmd.add_argument('--budget', type=float, default=10.0, help='预算（毫秒）')
+    cmd.add_argument('--repeat', type=int, default=5)
+    cmd.add_argument('--top', type=int, default=8, help='列出自身耗时最多的模块数')
+    cmd.set_defaults(func=benchImportTime)
+
+    cmd = commands.add_parser('compact', help='default 与 compact 输出的字节数、token 数对比')
+    cmd.add_argument('--corpus', help='OLE 公式对象目录，不指定时使用合成语料')
+    cmd.add_argument('--count', type=int, default=400)
+    cmd.add_argument('--seed', type=int, default=1)
+    cmd.set_defaults(func=benchCompact)
+
+    cmd = commands.add_parser('memory', help='解析后每个公式常驻的内存（tracemalloc）')
+    cmd.add_argument('--corpus', help='OLE 公式对象目录，不指定时使用合成语料')
+    cmd.add_argument('--count', type=int, default=400)
+    cmd.add_argument('--seed', type=int, default=1)
+    cmd.add_argument('--flat', action='store_true', help='只保留 FlatAST')
+    cmd.set_defaults(func=benchMemory)
+
+    cmd = commands.add_parser('render', help='AST 节点数与 Translate 耗时')
+    cmd.add_argument('--corpus', help='OLE 公式对象目录，不指定时使用合成语料')
+    cmd.add_argument('--count', type=int, default=400)
+    cmd.add_argument('--seed', type=int, default=1)
+    cmd.add_argument('--repeat', type=int, default=5)
+    cmd.set_defaults(func=benchRender)
+
+    cmd = commands.add_parser('memo', help='子树记忆化的命中率与节省的时间（默认使用矩阵为主的合成语料）')
+    cmd.add_argument('--corpus', help='OLE 公式对象目录，不指定时使用合成语料')
+    cmd.add_argument('--count', type=int, default=400)
+    cmd.add_argument('--seed', type=int, default=1)
+    cmd.add_argument('--entries', type=int, default=4096, help='记忆表条目上限')
+    cmd.set_defaults(func=benchMemo)
+
+    cmd = commands.add_parser('batch', help='translateMany 随 worker 数的扩展性')
+    cmd.add_argument('--corpus', help='OLE 公式对象目录，不指定时使用合成语料')
+    cmd.add_argument('--count', type=int, default=400)
+    cmd.add_argument('--seed', type=int, default=1)
+    cmd.add_argument('--repeat', type=int, default=10, help='语料重复次数')
+    cmd.add_argument('--workers', help='逗号分隔的 worker 数，默认 1,2,4,... 直到 CPU 核数')
+    cmd.add_argument('--chunksize', type=int, default=64)
+    cmd.add_argument('--threads', action='store_true', help='使用线程池（free-threaded 构建上可并行）')
+    cmd.set_defaults(func=benchBatch)
+
+    cmd = commands.add_parser('microbatch', help='单个公式请求逐个提交与攒批提交的吞吐量、延迟')
+    cmd.add_argument('--corpus', help='OLE 公式对象目录，不指定时使用合成语料')
+    cmd.add_argument('--count', type=int, default=400)
+    cmd.add_argument('--seed', type=int, default=1)
+    cmd.add_argument('--repeat', type=int, default=5, help='语料重复次数')
+    cmd.add_argument('--clients', type=int, default=64, help='并发调用方数')
+    cmd.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    cmd.add_argument('--batch-size', type=int, default=64)
+    cmd.add_argument('--batch-delay', type=float, default=2.0, help='毫秒')
+    cmd.set_defaults(func=benchMicrobatch)
+
+    cmd = commands.add_parser('lanes', help='批量任务满载时交互请求的延迟（FIFO / 权重 / 严格优先）')
+    cmd.add_argument('--corpus', help='OLE 公式对象目录，不指定时使用合成语料')
+    cmd.add_argument('--count', type=int, default=400)
+    cmd.add_argument('--seed', type=int, default=1)
+    cmd.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    cmd.add_argument('--reserved', type=int, default=1, help='只给交互通道的在途批数')
+    cmd.add_argument('--bulk', type=int, default=2, help='并发的批量提交方数，每次提交整个语料')
+    cmd.add_argument('--interactive', type=int, default=4, help='交互客户端数')
+    cmd.add_argument('--requests', type=int, default=200, help='交互请求总数')
+    cmd.add_argument('--interval', type=float, default=20.0, help='每个交互客户端两次请求的间隔（毫秒）')
+    cmd.add_argument('--slo', type=float, default=50.0, help='交互请求的延迟目标（毫秒）')
+    cmd.set_defaults(func=benchLanes)
+
+    cmd = commands.add_parser('recycle', help='RecyclingPool 中 worker 的常驻内存随轮数的变化')
+    cmd.add_argument('--corpus', help='OLE 公式对象目录，不指定时使用合成语料')
+    cmd.add_argument('--count', type=int, default=400)
+    cmd.add_argument('--seed', type=int, default=1)
+    cmd.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    cmd.add_argument('--rounds', type=int, default=10)
+    cmd.add_argument('--chunksize', type=int, default=16)
+    cmd.add_argument('--max-tasks', type=int, default=None)
+    cmd.add_argument('--max-rss', type=int, default=None, help='MB')
+    cmd.set_defaults(func=benchRecycle)
+
+    cmd = commands.add_parser('fork', help='父进程预热与 gc.freeze 对 worker 启动耗时、独占内存的影响')
+    cmd.add_argument('--corpus', help='OLE 公式对象目录，不指定时使用合成语料')
+    cmd.add_argument('--count', type=int, default=400)
+    cmd.add_argument('--seed', type=int, default=1)
+    cmd.add_argument('--workers', type=int, default=4)
+    cmd.add_argument('--rounds', type=int, default=3)
+    cmd.add_argument('--mode', choices=('cold', 'prewarm', 'freeze', 'forkserver'), help='只运行一种方式（内部使用）')
+    cmd.set_defaults(func=benchFork)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,433 @@
+"""
+翻译缓存
+
+同一篇论文（以及同一论文的不同修订版）里大量公式是重复的。TranslationCache 以
+"Equation Native" 数据的 blake2b 摘要为键缓存翻译结果，命中时跳过 record -> AST -> latex；
+同时以整个输入的摘要作为别名，完全相同的输入再次出现时连 OLE 解析也省掉。别名只指向规范条目，
+不重复保存 latex。
+
+按缓存内容的字节数淘汰（LRU），适合常驻服务：
+
+    from mtef.cache import TranslationCache
+
+    cache = TranslationCache(maxBytes=64 << 20)
+    latex, err = cache.translate(bts)
+    cache.stats()  # {'hits': ..., 'misses': ..., 'evictions': ..., 'entries': ..., 'bytes': ...}
+
+只缓存成功的翻译。别名按固定开销（AliasOverhead）计入字节数，随所指的条目一起淘汰。
+多个线程同时未命中同一数据时只有一个线程翻译，其余等待并共享结果（singleflight.Group）。
+
+传入 store（store.TranslationStore）后，内存未命中时再查持久化缓存，翻译结果同时写入，
+多个 worker 进程、重启前后共享同一份结果；别名只保存在内存中。
+
+失败同样按摘要记入 FailureCache（负缓存），记录失败类别（FailureKind）。再次遇到时直接返回
+缓存的错误，不再解析。超时、递归过深、内存不足等（QuarantineKinds）的输入被隔离：
+不随 LRU 淘汰，有 store 时写入库中，整个部署内不会再交给解析器。超时由调用方判定后上报：
+
+    latex, err = cache.translate(bts)
+    ...
+    cache.recordFailure(bts, FailureKind.TIMEOUT)
+"""
+from collections import OrderedDict
+from hashlib import blake2b
+from io import BytesIO
+from _thread import allocate_lock
+from .mtef import MTEF
+from .minify import OutputProfile
+from .singleflight import Group
+
+# 每个条目除字符串本身外的估算开销（键、OrderedDict 节点等）
+EntryOverhead = 160
+# 每个别名的估算开销（键、dict 项、反向列表中的引用）
+AliasOverhead = 120
+
+
+class FailureKind:
+    INVALID = 'invalid'          # 解析结束但 Valid 为 False
+    UNSUPPORTED = 'unsupported'  # 未实现的记录，如 v3 FONT
+    ERROR = 'error'              # 解析或渲染抛出异常
+    TIMEOUT = 'timeout'          # 调用方判定超时
+    BLOWUP = 'blowup'            # 递归过深、内存不足或数据超出上限
+
+
+# 需要隔离的失败类别
+QuarantineKinds = frozenset([FailureKind.TIMEOUT, FailureKind.BLOWUP])
+
+
+class Failure:
+    __slots__ = ('kind', 'message')
+
+    def __init__(self, kind, message=''):
+        # kind string //FailureKind
+        self.kind = kind
+        # message string
+        self.message = message
+
+    @property
+    def quarantined(self):
+        return self.kind in QuarantineKinds
+
+    def error(self):
+        if self.message:
+            return '%s: %s' % (self.kind, self.message)
+        return self.kind
+
+
+class FailureCache:
+    """
+    负缓存：摘要 -> Failure。普通失败按条数 LRU 淘汰，隔离的条目一直保留
+    """
+
+    def __init__(self, maxEntries=65536, store=None):
+        # maxEntries int //普通失败的条数上限
+        self.maxEntries = maxEntries
+        # store *TranslationStore //可选的持久化后端
+        self.store = store
+        # entries map[key]*Failure //普通失败，LRU 顺序
+        self.entries = OrderedDict()
+        # quarantine map[key]*Failure //隔离的输入
+        self.quarantine = {}
+        self.lock = allocate_lock()
+
+        # hits int //命中负缓存、未再解析的次数
+        self.hits = 0
+
+    def __len__(self):
+        return len(self.entries) + len(self.quarantine)
+
+    def get(self, key):
+        """
+        取失败记录，先查内存再查 store，没有时返回 None
+        """
+        with self.lock:
+            failure = self.quarantine.get(key)
+            if failure is None:
+                failure = self.entries.get(key)
+                if failure is not None:
+                    self.entries.move_to_end(key)
+        if failure is None and self.store is not None:
+            row = self.store.getFailure(key)
+            if row is not None:
+                failure = Failure(row[0], row[1])
+                self.put(key, failure, persist=False)
+        if failure is not None:
+            with self.lock:
+                self.hits += 1
+        return failure
+
+    def put(self, key, failure, persist=True):
+        with self.lock:
+            if failure.quarantined:
+                self.entries.pop(key, None)
+                self.quarantine[key] = failure
+            elif key not in self.quarantine:
+                self.entries[key] = failure
+                self.entries.move_to_end(key)
+                if len(self.entries) > self.maxEntries:
+                    self.entries.popitem(last=False)
+        if persist and self.store is not None:
+            self.store.putFailure(key, failure.kind, failure.message, failure.quarantined)
+
+    def record(self, key, kind, message=''):
+        failure = Failure(kind, message)
+        self.put(key, failure)
+        return failure
+
+    def isQuarantined(self, key):
+        with self.lock:
+            return key in self.quarantine
+
+    def clear(self):
+        """
+        清空内存中的普通失败；隔离的条目保留
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'entries': len(self.entries),
+                'quarantined': len(self.quarantine),
+            }
+
+
+def bodyDigest(body):
+    """
+    缓存键使用的摘要
+    """
+    return blake2b(body, digest_size=16).digest()
+
+
+class TranslationCache:
+    def __init__(self, maxBytes=64 << 20, store=None, failures=None, maxBodyBytes=4 << 20):
+        # maxBytes int //缓存内容的字节上限
+        self.maxBytes = maxBytes
+        # store *TranslationStore //可选的持久化后端
+        self.store = store
+        # failures *FailureCache //负缓存，默认与 store 共用同一个库
+        self.failures = failures if failures is not None else FailureCache(store=store)
+        # maxBodyBytes int //MTEF 数据的字节上限，超出的直接隔离，None 表示不限
+        self.maxBodyBytes = maxBodyBytes
+        # flights *Group //合并同一数据摘要并发的未命中
+        self.flights = Group()
+        # entries map[key]string //规范键 -> latex，LRU 顺序，最近使用的在末尾
+        self.entries = OrderedDict()
+        # aliases map[key]key //别名 -> 规范键
+        self.aliases = {}
+        # linked map[key][]key //规范键 -> 指向它的别名，条目淘汰时一并删除
+        self.linked = {}
+        # size int //当前估算字节数
+        self.size = 0
+        self.lock = allocate_lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # storeHits int //由持久化后端命中的次数
+        self.storeHits = 0
+        # fingerprintHits int //hits 中按 fingerprint 命中的次数
+        self.fingerprintHits = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def entrySize(latex):
+        return EntryOverhead + len(latex.encode('utf-8'))
+
+    def get(self, key):
+        """
+        取缓存，未命中返回 None；不计入命中统计
+        """
+        with self.lock:
+            key = self.aliases.get(key, key)
+            latex = self.entries.get(key)
+            if latex is not None:
+                self.entries.move_to_end(key)
+            return latex
+
+    def put(self, key, latex):
+        size = self.entrySize(latex)
+        if size > self.maxBytes:
+            return
+        with self.lock:
+            # 原来是别名的键改为独立的条目
+            self.unlink(key)
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= self.entrySize(old)
+            self.entries[key] = latex
+            self.size += size
+            self.evict()
+
+    def link(self, alias, key):
+        """
+        让 alias 指向 key 的条目（key 本身是别名时指向它的规范键）；key 不在缓存中时忽略
+        """
+        with self.lock:
+            key = self.aliases.get(key, key)
+            if alias == key or alias in self.entries or key not in self.entries:
+                return
+            self.unlink(alias)
+            self.aliases[alias] = key
+            self.linked.setdefault(key, []).append(alias)
+            self.entries.move_to_end(key)
+            self.size += AliasOverhead
+            self.evict()
+
+    def unlink(self, alias):
+        # 调用方持有 self.lock
+        key = self.aliases.pop(alias, None)
+        if key is not None:
+            aliases = self.linked[key]
+            aliases.remove(alias)
+            if not aliases:
+                del self.linked[key]
+            self.size -= AliasOverhead
+
+    def evict(self):
+        # 调用方持有 self.lock
+        while self.size > self.maxBytes and self.entries:
+            key, evicted = self.entries.popitem(last=False)
+            self.size -= self.entrySize(evicted)
+            for alias in self.linked.pop(key, ()):
+                del self.aliases[alias]
+                self.size -= AliasOverhead
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.aliases.clear()
+            self.linked.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'storeHits': self.storeHits,
+                'fingerprintHits': self.fingerprintHits,
+                'entries': len(self.entries),
+                'aliases': len(self.aliases),
+                'bytes': self.size,
+                'hitRate': self.hits / lookups if lookups else 0.0,
+                'failures': self.failures.stats(),
+                'coalesced': self.flights.shared,
+            }
+
+    def resetStats(self):
+        with self.lock:
+            self.hits = self.misses = self.evictions = self.storeHits = self.fingerprintHits = 0
+        with self.failures.lock:
+            self.failures.hits = 0
+
+    def preload(self, limit=10000):
+        """
+        把持久化后端中最近使用的 limit 条记录载入内存，返回载入条数
+        """
+        if self.store is None:
+            return 0
+        rows = self.store.recent(limit)
+        # recent 按最近使用倒序，倒着放入使最近的位于 LRU 末尾
+        for key, latex in reversed(rows):
+            self.put(key, latex)
+        return len(rows)
+
+    def find(self, key):
+        """
+        先查内存，未命中时再查持久化后端；不计入命中统计
+        """
+        latex = self.get(key)
+        if latex is None and self.store is not None:
+            latex = self.store.get(key)
+            if latex is not None:
+                self.put(key, latex)
+                with self.lock:
+                    self.storeHits += 1
+        return latex
+
+    def remember(self, key, latex, canonical=None):
+        """
+        缓存结果；给出 canonical 时内存中 key 只作为它的别名，持久化后端仍按 key 保存
+        """
+        if canonical is None:
+            self.put(key, latex)
+        else:
+            self.link(key, canonical)
+        if self.store is not None:
+            self.store.put(key, latex)
+
+    def count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def recordFailure(self, data, kind, message=''):
+        """
+        记录 translate / translateBody 输入的失败，如调用方判定的超时；返回错误字符串
+        """
+        return self.failures.record(bodyDigest(data), kind, message).error()
+
+    def guard(self, digest, parse):
+        """
+        执行 parse()，异常按类别记入负缓存，返回 (result, err)
+        """
+        try:
+            return parse(), None
+        except (RecursionError, MemoryError) as exc:
+            return None, self.failures.record(digest, FailureKind.BLOWUP, type(exc).__name__).error()
+        except Exception as exc:
+            return None, self.failures.record(digest, FailureKind.ERROR, '%s: %s' % (type(exc).__name__, exc)).error()
+
+    def translateBody(self, body, profile=OutputProfile.DEFAULT):
+        """
+        翻译 MTEF 数据（已去掉 OLE 包装与 28 字节头），返回 (latex, err)
+
+        数据摘要未命中时先解析并按 MTEF.fingerprint() 再查一次，只是 nudge、字号等不同的公式共用结果
+        """
+        digest = bodyDigest(body)
+        key = digest + profile.encode()
+        latex = self.find(key)
+        if latex is not None:
+            self.count(True)
+            return latex, None
+
+        failure = self.failures.get(digest)
+        if failure is not None:
+            return '', failure.error()
+        if self.maxBodyBytes is not None and len(body) > self.maxBodyBytes:
+            return '', self.failures.record(digest, FailureKind.BLOWUP, '%d bytes' % len(body)).error()
+
+        # 同一数据正在由其他线程翻译时等待其结果
+        (latex, err), shared = self.flights.do(key, lambda: self.translateMiss(body, digest, key, profile))
+        if shared and err is None:
+            self.count(True)
+        return latex, err
+
+    def translateMiss(self, body, digest, key, profile):
+        opened, err = self.guard(digest, lambda: MTEF.OpenBody(body))
+        if err is None:
+            eqn, err = opened
+            if err is not None:
+                err = self.failures.record(digest, FailureKind.ERROR, err).error()
+            elif not eqn.Valid:
+                kind = FailureKind.UNSUPPORTED if eqn.InvalidReason else FailureKind.INVALID
+                err = self.failures.record(digest, kind, eqn.InvalidReason).error()
+        if err is not None:
+            self.count(False)
+            return '', err
+
+        fingerprintKey = b'fp/' + eqn.fingerprint().encode() + profile.encode()
+        latex = self.find(fingerprintKey)
+        if latex is not None:
+            self.count(True)
+            with self.lock:
+                self.fingerprintHits += 1
+            self.remember(key, latex, fingerprintKey)
+            return latex, None
+
+        self.count(False)
+        latex, err = self.guard(digest, lambda: eqn.Translate(profile))
+        if err is not None:
+            return '', err
+        # 结果只保存在 fingerprint 条目中，数据摘要为其别名
+        self.remember(fingerprintKey, latex)
+        self.remember(key, latex, fingerprintKey)
+        return latex, None
+
+    def translate(self, bts, profile=OutputProfile.DEFAULT):
+        """
+        翻译 OLE 公式对象，返回 (latex, err)
+        """
+        digest = bodyDigest(bts)
+        alias = b'ole/' + digest + profile.encode()
+        latex = self.get(alias)
+        if latex is not None:
+            self.count(True)
+            return latex, None
+
+        # 上报过的失败（如超时）按整个输入的摘要记录
+        failure = self.failures.get(digest)
+        if failure is not None:
+            return '', failure.error()
+
+        found, err = self.guard(digest, lambda: MTEF.ReadEquationNative(BytesIO(bts)))
+        if err is not None:
+            return '', err
+        body, err = found
+        if body is None:
+            return '', self.failures.record(digest, FailureKind.INVALID,
+                                            err or 'MTEF.Open: Equation Native not found').error()
+
+        latex, err = self.translateBody(body, profile)
+        if err is None:
+            self.link(alias, bodyDigest(body) + profile.encode())
+        return latex, err
@@ -0,0 +1,131 @@
+"""
+字符翻译表
+
+chars.py 中的 Chars 以 'char/0x%04x[/mathmode]' 字符串为键，SpecialChar 以字符为键。
+每个 CHAR 都去格式化 key 再查两次字典开销较大，这里把两张表合并编译成
+以 mtcode 为键的整数表，普通模式与 /mathmode 各一张，fnTEXT 的 \\rm 包裹也预先生成。
+
+chars.py 体积较大，导入本模块时并不加载，第一次翻译字符时才编译（loadCharTables）。
+整数表可以直接作为 str.translate 的映射表使用，连续字符（CHAR_RUN）一次翻译整段（translateRun）。
+"""
+from _thread import allocate_lock
+from .record import CharTypeface
+from .memo import invalidateRenderMemo
+
+# fnTEXT 字符需要包一层
+TextFmt = '{ \\rm{ %s } }'
+
+
+def compileCharTable(hexExtend):
+    """
+    编译一张 mtcode -> latex 的整数表，查找顺序与原先一致：
+    先找扩展字符 Chars，找不到（或为空）再看是否为需要转义的 SpecialChar
+    只保存翻译结果与原字符不同的项
+    """
+    from .chars import Chars, SpecialChar
+
+    codes = set(ord(char) for char in SpecialChar)
+    for key in Chars:
+        code, _, extend = key[len('char/0x'):].partition('/')
+        if (extend and '/' + extend) == hexExtend:
+            codes.add(int(code, 16))
+
+    table = {}
+    for mtcode in codes:
+        char = chr(mtcode)
+        sChar = Chars.get('char/0x%04x%s' % (mtcode, hexExtend))
+        if sChar:
+            char = sChar
+        else:
+            # 如果char是特殊symbol，需要转义
+            sChar = SpecialChar.get(char)
+            if sChar:
+                char = sChar
+        if char != chr(mtcode):
+            table[mtcode] = char
+    return table
+
+
+# map[uint16]string，loadCharTables 之后才可用
+CharTable = None
+CharTableMath = None
+CharTableText = None
+
+# typeface（偏移128）-> 使用的翻译表
+TypefaceTables = None
+
+# TextBreaks set[string] //fnTEXT 的连续字符在这些字符之后断开，loadCharTables 时计算
+TextBreaks = frozenset()
+
+# 只需要一把锁，不为此导入 threading
+loadLock = allocate_lock()
+
+
+def loadCharTables():
+    """
+    编译全部字符翻译表，重复调用无副作用
+    """
+    global CharTable, CharTableMath, CharTableText, TypefaceTables, TextBreaks
+    with loadLock:
+        if TypefaceTables is not None:
+            return TypefaceTables
+
+        CharTable = compileCharTable('')
+        CharTableMath = compileCharTable('/mathmode')
+        CharTableText = {mtcode: TextFmt % char for mtcode, char in CharTable.items()}
+        # 不在表中的字符原样输出，其中只有反斜杠需要断开
+        TextBreaks = frozenset(chr(mtcode) for mtcode in set(CharTable) | {0x5C}
+                               if endsWithCommand(CharTable.get(mtcode, chr(mtcode))))
+        TypefaceTables = {
+            128 + CharTypeface.fnMTEXTRA: CharTableMath,
+            128 + CharTypeface.fnSPACE: CharTableMath,
+            128 + CharTypeface.fnTEXT: CharTableText,
+        }
+        # 重新加载（如把 TypefaceTables 置为 None 后）时，记忆表中的片段按旧表渲染
+        invalidateRenderMemo()
+        return TypefaceTables
+
+
+def translateChar(mtcode, typeface):
+    """
+    把一个 v5 CHAR 翻译为 latex
+    """
+    if TypefaceTables is None:
+        loadCharTables()
+    table = TypefaceTables.get(typeface, CharTable)
+    char = table.get(mtcode)
+    if char is None:
+        char = chr(mtcode)
+        # 确定字符是否为文本，如果是文本，则需要包一层
+        if table is CharTableText:
+            char = TextFmt % char
+    return char
+
+
+def endsWithCommand(latex):
+    """
+    是否以反斜杠或控制字结尾：后面紧跟字母（或任意字符，对单独的反斜杠而言）时会粘连成另一个命令
+    """
+    return latex.rstrip('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz').endswith('\\')
+
+
+def translateRun(text, typeface):
+    """
+    把同一 typeface 的一段连续字符翻译为 latex，fnTEXT 只整体包一层（遇到 TextBreaks 中的字符时断开）
+    """
+    if TypefaceTables is None:
+        loadCharTables()
+    table = TypefaceTables.get(typeface, CharTable)
+    if table is not CharTableText:
+        return text.translate(table)
+    if TextBreaks.isdisjoint(text):
+        return TextFmt % text.translate(CharTable)
+    parts = []
+    start = 0
+    for i, char in enumerate(text):
+        if char in TextBreaks:
+            parts.append(TextFmt % text[start:i + 1].translate(CharTable))
+            start = i + 1
+    if start < len(text):
+        parts.append(TextFmt % text[start:].translate(CharTable))
+    return ''.join(parts)
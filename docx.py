@@ -0,0 +1,76 @@
+"""
+从 docx 中取出公式
+
+Word 把 MathType 公式作为 OLE 对象保存在 word/embeddings/oleObject*.bin，
+document.xml 中的 <o:OLEObject ProgID="Equation.DSMT4" r:id="..."/> 引用它们。
+readEquations 按文档中出现的顺序返回公式的 OLE 数据（可直接交给 MTEF.OpenBytes）：
+
+    from mtef.docx import readEquations
+
+    objects, err = readEquations(docxBytes)
+"""
+import re
+import zipfile
+from io import BytesIO
+
+# MathType / 公式编辑器 3.0 的 ProgID 前缀
+EquationProgIDs = ('Equation.',)
+
+oleObjectPattern = re.compile(rb'<o:OLEObject\b[^>]*>')
+attrPattern = re.compile(rb'([\w:]+)="([^"]*)"')
+relationshipPattern = re.compile(rb'<Relationship\b[^>]*>')
+
+
+def attributes(tag):
+    return {name.decode(): value.decode('utf-8', 'replace') for name, value in attrPattern.findall(tag)}
+
+
+def readEquations(bts, maxObjects=None, maxBytes=64 << 20):
+    """
+    返回 ([]bytes, err)，没有公式时为空列表；maxBytes 限制解压后的总字节数，
+    同一对象被引用多次时只解压一次，返回同一个 bytes
+    """
+    try:
+        archive = zipfile.ZipFile(BytesIO(bts))
+    except zipfile.BadZipFile as err:
+        return None, 'docx: %s' % err
+
+    with archive:
+        # 重名的文件以最后一个为准，与 archive.read 一致
+        infos = {info.filename: info for info in archive.infolist()}
+        if 'word/document.xml' not in infos:
+            return None, 'docx: word/document.xml not found'
+        # 解压出的数据不超过 file_size（否则 CRC 校验失败），先按它计算预算，超出时不解压
+        parts = [name for name in ('word/document.xml', 'word/_rels/document.xml.rels') if name in infos]
+        size = sum(infos[name].file_size for name in parts)
+        if size > maxBytes:
+            return None, 'docx: more than %d bytes after decompression' % maxBytes
+
+        # rId -> 包内路径
+        targets = {}
+        if 'word/_rels/document.xml.rels' in infos:
+            for tag in relationshipPattern.findall(archive.read('word/_rels/document.xml.rels')):
+                attrs = attributes(tag)
+                if attrs.get('Type', '').endswith('/oleObject') and 'Id' in attrs:
+                    targets[attrs['Id']] = 'word/' + attrs.get('Target', '').lstrip('/').replace('word/', '', 1)
+
+        # 按文档顺序，只保留公式对象；同一对象被引用多次时每次都返回
+        paths = []
+        for tag in oleObjectPattern.findall(archive.read('word/document.xml')):
+            attrs = attributes(tag)
+            if not attrs.get('ProgID', '').startswith(EquationProgIDs):
+                continue
+            path = targets.get(attrs.get('r:id'))
+            if path in infos:
+                paths.append(path)
+        if maxObjects is not None and len(paths) > maxObjects:
+            return None, 'docx: more than %d equations' % maxObjects
+
+        # contents map[string]bytes //每个对象只解压一次
+        contents = dict.fromkeys(paths)
+        size += sum(infos[path].file_size for path in contents)
+        if size > maxBytes:
+            return None, 'docx: more than %d bytes after decompression' % maxBytes
+        for path in contents:
+            contents[path] = archive.read(path)
+        return [contents[path] for path in paths], None
@@ -0,0 +1,424 @@
+"""
+扁平 AST
+
+MtAST 树每个节点都是一个 Python 对象（外加 record 对象和 children 列表），批量处理时大量公式
+同时驻留内存，树本身成了最大的开销。FlatAST 把整棵树按先序存入几组并行的 array：
+
+    tags        节点的 RecordType
+    firstChild  第一个子节点的下标，-1 表示没有
+    nextSibling 下一个兄弟节点的下标，-1 表示没有
+    records     record 在对应类型 payload 表中的下标，-1 表示 value 为 None
+
+record 的 payload 按类型分别打包（CHAR: mtcode/typeface，TMPL: selector/variation，
+MATRIX: rows/cols，EMBELL: embellType，LINE: null，CHAR_RUN: typeface 与 runCodes 中的一段），
+只保留渲染需要的字段。
+
+渲染时通过 FlatNode 视图访问，视图提供与 MtAST 相同的 tag/value/children，
+makeLatex / makeLatexV3 以及模板处理器无需区分两种表示。FlatAST 只由 array 与少量
+标量组成，pickle 体积小，适合在进程间传递：
+
+    flat = eqn.flatten()
+    latex = MTEF.FromFlat(flat).Translate()
+
+dumps / Loads 把 FlatAST 序列化为紧凑的字节串（zlib 压缩的各列），可以与源文件放在一起。
+修改 chars.py、模板或 makeLatex 后只需重新渲染，跳过 OLE 解析与 record 解析：
+
+    python -m mtef.flatast dump DIR            # 为 DIR 下每个 OLE 文件写入 <name>.ast
+    python -m mtef.flatast render DIR [--write]  # 只加载 .ast 并渲染，--write 写入 <name>.tex
+
+序列化数据带有 ParserVersion，record 解析或 FlatAST 布局改动时需要递增；版本不符的 .ast
+在 render 时从源文件重新解析并覆盖。
+
+mtef.mtef 导入本模块，序列化（struct、zlib、blake2b）与命令行（argparse）用到的模块在函数内导入，
+不计入默认的导入耗时。
+"""
+import os
+import sys
+from array import array
+from .record import RecordType
+
+# 解析器版本：record 解析、合并 CHAR_RUN 或 FlatAST 列布局改变时递增，只改渲染时不需要
+ParserVersion = 1
+
+# 序列化格式：magic, ParserVersion, mMtefVer, valid，之后为 zlib 压缩的各列（长度 + 小端字节）
+DumpMagic = b'MTFA'
+DumpHeaderFormat = '<4sHBB'
+DumpHeaderSize = 8
+
+
+class FlatRecord:
+    """
+    record 的只读视图，只包含渲染用到的字段
+    """
+    __slots__ = ('mtcode', 'typeface', 'selector', 'variation', 'rows', 'cols', 'embellType', 'null', 'text')
+
+    def __init__(self):
+        self.mtcode = 0
+        self.typeface = 0
+        self.selector = 0
+        self.variation = 0
+        self.rows = 0
+        self.cols = 0
+        self.embellType = 0
+        self.null = False
+        self.text = ''
+
+
+class FlatNode:
+    """
+    FlatAST 中一个节点的视图，接口与 MtAST 一致
+    """
+    __slots__ = ('flat', 'index', 'childList', 'record', 'key')
+
+    def __init__(self, flat, index):
+        # flat  *FlatAST
+        self.flat = flat
+        # index int32
+        self.index = index
+        # childList []*FlatNode //第一次访问 children 时生成
+        self.childList = None
+        # record *FlatRecord //第一次访问 value 时生成
+        self.record = None
+        # key tuple //不参与子树记忆化
+        self.key = None
+
+    @property
+    def tag(self):
+        return self.flat.tags[self.index]
+
+    @property
+    def value(self):
+        if self.record is None:
+            self.record = self.flat.recordAt(self.index)
+        return self.record
+
+    @property
+    def children(self):
+        if self.childList is None:
+            flat = self.flat
+            childList = []
+            child = flat.firstChild[self.index]
+            while child >= 0:
+                childList.append(FlatNode(flat, child))
+                child = flat.nextSibling[child]
+            self.childList = childList
+        return self.childList
+
+
+class FlatAST:
+    # 全部 array 列
+    columns = ('tags', 'firstChild', 'nextSibling', 'records',
+               'lineNull', 'charCode', 'charTypeface', 'tmplSelector', 'tmplVariation',
+               'matrixRows', 'matrixCols', 'embellType', 'runTypeface', 'runStart', 'runLength', 'runCodes')
+    __slots__ = ('version', 'valid') + columns
+
+    def __init__(self):
+        # version uint8 //mMtefVer
+        self.version = 0
+        # valid bool
+        self.valid = False
+
+        # 节点
+        self.tags = array('B')
+        self.firstChild = array('i')
+        self.nextSibling = array('i')
+        self.records = array('i')
+
+        # payload
+        self.lineNull = array('B')
+        self.charCode = array('I')
+        self.charTypeface = array('B')
+        self.tmplSelector = array('B')
+        self.tmplVariation = array('H')
+        self.matrixRows = array('B')
+        self.matrixCols = array('B')
+        self.embellType = array('B')
+        self.runTypeface = array('B')
+        self.runStart = array('I')
+        self.runLength = array('I')
+        self.runCodes = array('I')
+
+    def __len__(self):
+        return len(self.tags)
+
+    def digest(self, digestSize=16):
+        """
+        树结构与全部 payload 的摘要。payload 只含渲染用到的字段，nudge、SIZE、字体、颜色、
+        EQN_PREFS 等不影响输出的内容不参与计算
+        """
+        from hashlib import blake2b
+
+        digest = blake2b(digest_size=digestSize)
+        digest.update(bytes([self.version, 1 if self.valid else 0]))
+        for name in self.columns:
+            column = getattr(self, name)
+            if column.itemsize > 1 and sys.byteorder != 'little':
+                column = array(column.typecode, column)
+                column.byteswap()
+            # 列长度也写入，避免相邻两列的边界不同却拼接出相同的字节
+            digest.update(len(column).to_bytes(4, 'little'))
+            digest.update(column.tobytes())
+        return digest.hexdigest()
+
+    def dumps(self, level=6):
+        """
+        序列化为字节串
+        """
+        import struct
+        import zlib
+
+        parts = []
+        for name in self.columns:
+            column = getattr(self, name)
+            if column.itemsize > 1 and sys.byteorder != 'little':
+                column = array(column.typecode, column)
+                column.byteswap()
+            parts.append(struct.pack('<I', len(column)))
+            parts.append(column.tobytes())
+        header = struct.pack(DumpHeaderFormat, DumpMagic, ParserVersion, self.version, 1 if self.valid else 0)
+        return header + zlib.compress(b''.join(parts), level)
+
+    @classmethod
+    def Loads(cls, data):
+        """
+        由 dumps 的结果还原，返回 (flat, err)；ParserVersion 不符时返回错误
+        """
+        import struct
+        import zlib
+
+        if len(data) < DumpHeaderSize:
+            return None, 'FlatAST.Loads: data too short'
+        magic, parserVersion, version, valid = struct.unpack_from(DumpHeaderFormat, data)
+        if magic != DumpMagic:
+            return None, 'FlatAST.Loads: bad magic'
+        if parserVersion != ParserVersion:
+            return None, 'FlatAST.Loads: parser version %d, want %d' % (parserVersion, ParserVersion)
+        try:
+            payload = zlib.decompress(data[DumpHeaderSize:])
+        except zlib.error as err:
+            return None, 'FlatAST.Loads: %s' % err
+
+        flat = cls()
+        flat.version = version
+        flat.valid = bool(valid)
+        offset = 0
+        for name in cls.columns:
+            column = getattr(flat, name)
+            if offset + 4 > len(payload):
+                return None, 'FlatAST.Loads: truncated column %s' % name
+            length, = struct.unpack_from('<I', payload, offset)
+            offset += 4
+            end = offset + length * column.itemsize
+            if end > len(payload):
+                return None, 'FlatAST.Loads: truncated column %s' % name
+            column.frombytes(payload[offset:end])
+            if column.itemsize > 1 and sys.byteorder != 'little':
+                column.byteswap()
+            offset = end
+        if offset != len(payload):
+            return None, 'FlatAST.Loads: trailing data'
+        return flat, None
+
+    def addRecord(self, tag, value):
+        """
+        把 record 的 payload 追加到对应的表，返回其下标
+        """
+        if value is None:
+            return -1
+        if tag == RecordType.LINE:
+            self.lineNull.append(1 if value.null else 0)
+            return len(self.lineNull) - 1
+        if tag == RecordType.CHAR:
+            self.charCode.append(value.mtcode or 0)
+            self.charTypeface.append(value.typeface or 0)
+            return len(self.charCode) - 1
+        if tag == RecordType.TMPL:
+            self.tmplSelector.append(value.selector or 0)
+            self.tmplVariation.append(value.variation or 0)
+            return len(self.tmplSelector) - 1
+        if tag == RecordType.MATRIX:
+            self.matrixRows.append(value.rows or 0)
+            self.matrixCols.append(value.cols or 0)
+            return len(self.matrixRows) - 1
+        if tag == RecordType.EMBELL:
+            self.embellType.append(value.embellType or 0)
+            return len(self.embellType) - 1
+        if tag == RecordType.CHAR_RUN:
+            self.runTypeface.append(value.typeface or 0)
+            self.runStart.append(len(self.runCodes))
+            self.runLength.append(len(value.text))
+            self.runCodes.extend(ord(char) for char in value.text)
+            return len(self.runTypeface) - 1
+        # PILE 等渲染时不读取字段，只需保留 value 非空
+        return 0
+
+    def recordAt(self, index):
+        """
+        取第 index 个节点的 record 视图，value 为空时返回 None
+        """
+        rec = self.records[index]
+        if rec < 0:
+            return None
+
+        record = FlatRecord()
+        tag = self.tags[index]
+        if tag == RecordType.LINE:
+            record.null = bool(self.lineNull[rec])
+        elif tag == RecordType.CHAR:
+            record.mtcode = self.charCode[rec]
+            record.typeface = self.charTypeface[rec]
+        elif tag == RecordType.TMPL:
+            record.selector = self.tmplSelector[rec]
+            record.variation = self.tmplVariation[rec]
+        elif tag == RecordType.MATRIX:
+            record.rows = self.matrixRows[rec]
+            record.cols = self.matrixCols[rec]
+        elif tag == RecordType.EMBELL:
+            record.embellType = self.embellType[rec]
+        elif tag == RecordType.CHAR_RUN:
+            start = self.runStart[rec]
+            record.typeface = self.runTypeface[rec]
+            record.text = ''.join(map(chr, self.runCodes[start:start + self.runLength[rec]]))
+        return record
+
+    def root(self):
+        """
+        根节点视图，没有节点时返回 None
+        """
+        if not self.tags:
+            return None
+        return FlatNode(self, 0)
+
+    @classmethod
+    def FromAST(cls, ast, version=0, valid=True):
+        """
+        把 MtAST 树按先序压平
+        """
+        flat = cls()
+        flat.version = version
+        flat.valid = valid
+        if ast is None:
+            return flat
+
+        # lastChild []int32 //建表过程中每个节点最近一个已加入的子节点
+        lastChild = []
+        stack = [(ast, -1)]
+        while stack:
+            node, parent = stack.pop()
+            index = len(flat.tags)
+            flat.tags.append(node.tag)
+            flat.firstChild.append(-1)
+            flat.nextSibling.append(-1)
+            flat.records.append(flat.addRecord(node.tag, node.value))
+            lastChild.append(-1)
+
+            if parent >= 0:
+                if lastChild[parent] >= 0:
+                    flat.nextSibling[lastChild[parent]] = index
+                else:
+                    flat.firstChild[parent] = index
+                lastChild[parent] = index
+
+            if node.children:
+                # 先序：倒序压栈，子节点按原顺序弹出
+                stack.extend((child, index) for child in reversed(node.children))
+        return flat
+
+
+def astPath(path):
+    return path + '.ast'
+
+
+def dumpFile(path):
+    """
+    解析 OLE 文件并写入 <path>.ast，返回 (flat, err)
+    """
+    from .mtef import MTEF
+
+    with open(path, 'rb') as f:
+        eqn, err = MTEF.OpenBytes(f.read())
+    if eqn is None:
+        return None, err or 'MTEF.Open: Equation Native not found'
+    flat = eqn.flatten()
+    with open(astPath(path), 'wb') as f:
+        f.write(flat.dumps())
+    return flat, None
+
+
+def walk(root, suffix=None):
+    for base, _, names in os.walk(root):
+        for name in sorted(names):
+            if suffix is None or name.endswith(suffix):
+                yield os.path.join(base, name)
+
+
+def dump(args):
+    import time
+
+    count = failed = 0
+    start = time.perf_counter()
+    for path in walk(args.corpus):
+        if path.endswith(('.ast', '.tex')):
+            continue
+        _, err = dumpFile(path)
+        if err is not None:
+            failed += 1
+            print('%s: %s' % (path, err), file=sys.stderr)
+        else:
+            count += 1
+    print('dumped %d (%d failed) in %.2fs' % (count, failed, time.perf_counter() - start))
+    return 0
+
+
+def render(args):
+    import time
+    from .mtef import MTEF
+
+    count = reparsed = 0
+    start = time.perf_counter()
+    for path in walk(args.corpus, '.ast'):
+        with open(path, 'rb') as f:
+            flat, err = FlatAST.Loads(f.read())
+        source = path[:-len('.ast')]
+        if err is not None:
+            # 旧版本或损坏的 .ast：有源文件时重新解析
+            if not os.path.exists(source):
+                print('%s: %s' % (path, err), file=sys.stderr)
+                continue
+            flat, err = dumpFile(source)
+            if err is not None:
+                print('%s: %s' % (source, err), file=sys.stderr)
+                continue
+            reparsed += 1
+
+        latex = MTEF.FromFlat(flat).Translate(args.profile)
+        if args.write:
+            with open(source + '.tex', 'w', encoding='utf-8') as f:
+                f.write(latex)
+        count += 1
+    print('rendered %d (%d reparsed) in %.2fs' % (count, reparsed, time.perf_counter() - start))
+    return 0
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='%s.flatast' % (__package__ or 'mtef'))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser('dump', help='解析目录下全部 OLE 公式对象，写入 <name>.ast')
+    cmd.add_argument('corpus')
+    cmd.set_defaults(func=dump)
+
+    cmd = commands.add_parser('render', help='只加载 .ast 并渲染')
+    cmd.add_argument('corpus')
+    cmd.add_argument('--profile', default='default', choices=('default', 'compact'))
+    cmd.add_argument('--write', action='store_true', help='把结果写入 <name>.tex')
+    cmd.set_defaults(func=render)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""
+可替换的日志
+
+库内部通过 getLogger 取得的是一个代理，第一次真正写日志时才创建底层 logger，
+导入本库时不会加载 logging 或外部依赖。默认优先使用 thesis_guru.utils.logger，
+不存在时退回标准库 logging；也可以注入自己的工厂函数：
+
+    from mtef.logger import setLoggerFactory
+    setLoggerFactory(structlog.get_logger)
+"""
+
+# factory func(name string) Logger
+loggerFactory = None
+
+
+def defaultLoggerFactory(name):
+    try:
+        from thesis_guru.utils.logger import get_logger
+    except ImportError:
+        from logging import getLogger as get_logger
+    return get_logger(name)
+
+
+def setLoggerFactory(factory):
+    """
+    替换日志工厂，传入 None 恢复默认；已创建的代理在下一次写日志时生效
+    """
+    global loggerFactory
+    loggerFactory = factory
+
+
+class LoggerProxy:
+    def __init__(self, name):
+        self.name = name
+        # resolved (factory, logger) //整体替换，多线程下不会读到不匹配的一对
+        self.resolved = (None, None)
+
+    def resolve(self):
+        factory = loggerFactory or defaultLoggerFactory
+        resolved = self.resolved
+        if factory is not resolved[0]:
+            resolved = (factory, factory(self.name))
+            self.resolved = resolved
+        return resolved[1]
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+
+def getLogger(name):
+    return LoggerProxy(name)
@@ -0,0 +1,121 @@
+"""
+子树记忆化
+
+同一公式、同一文档中相同的子树反复出现（\\frac{1}{2}、x_i、矩阵中重复的单元格），
+makeLatex 每次都从头渲染。这里对子树做 hash-consing：建树时每个 LINE/TMPL/PILE/MATRIX 在对应的
+END 出栈时（自底向上）得到结构键 (version, tag, 子树的 record 字节)。记录自带长度、与上下文无关，
+字节相同的子树解析出的结构必然相同；bytes 的哈希值会被缓存，查表时不需要再遍历子树。
+渲染这些节点时先按键查有界的记忆表（LRU），命中则直接返回片段。
+
+（在 Python 里逐节点拼结构元组的开销与渲染本身相当，直接用子树字节作键，
+代价只是每个记录一次 tell() 和每个出栈节点一次切片；nudge 不同的子树因此不会共用片段。）
+
+默认关闭，开启后对之后解析的公式生效：
+
+    from mtef.memo import enableRenderMemo
+    memo = enableRenderMemo(maxEntries=4096)
+    ...
+    memo.stats()  # {'hits': ..., 'misses': ..., 'evictions': ..., 'entries': ...}
+
+命中时跳过子树的渲染，不支持的模板等告警日志也不会重复输出。
+
+片段依赖模板注册表与字符表，TmplRegistry.register / unregister 与 loadCharTables 会调用
+invalidateRenderMemo 清空记忆表；清空之前开始渲染的片段不再写入（generation 不同）。
+"""
+from _thread import allocate_lock
+from .record import RecordType
+
+# 渲染时查记忆表的节点类型，CHAR 等叶子节点直接查字符表更快
+MemoTags = frozenset([RecordType.LINE, RecordType.TMPL, RecordType.PILE, RecordType.MATRIX])
+
+
+def subtreeKey(version, node, body, end):
+    """
+    出栈时把 node.key 中暂存的起始偏移换成结构键，end 为对应 END 记录之后的偏移
+    """
+    start = node.key
+    if body is None or end is None or not isinstance(start, int):
+        node.key = None
+    else:
+        node.key = (version, node.tag, body[start:end])
+
+
+class SubtreeMemo:
+    def __init__(self, maxEntries=4096):
+        # maxEntries int
+        self.maxEntries = maxEntries
+        # entries map[tuple]string //结构键 -> 片段，插入顺序即 LRU 顺序（不为此导入 collections）
+        self.entries = {}
+        self.lock = allocate_lock()
+        # generation int //invalidate 的次数，渲染开始时记下，写入时不一致则丢弃
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            latex = self.entries.get(key)
+            if latex is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                # 重新插入，移到末尾
+                self.entries[key] = self.entries.pop(key)
+            return latex
+
+    def put(self, key, latex, generation=None):
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = latex
+            if len(self.entries) > self.maxEntries:
+                del self.entries[next(iter(self.entries))]
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def invalidate(self):
+        """
+        模板或字符表改变后调用：清空记忆表，正在渲染的旧片段也不会写入
+        """
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'hitRate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+# renderMemo *SubtreeMemo //None 表示关闭
+renderMemo = None
+
+
+def enableRenderMemo(maxEntries=4096):
+    global renderMemo
+    renderMemo = SubtreeMemo(maxEntries)
+    return renderMemo
+
+
+def disableRenderMemo():
+    global renderMemo
+    renderMemo = None
+
+
+def invalidateRenderMemo():
+    if renderMemo is not None:
+        renderMemo.invalidate()
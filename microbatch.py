@@ -0,0 +1,319 @@
+"""
+微批量调度
+
+单个公式的请求各自提交给进程池，每次都要付一次完整的进程间往返，而翻译本身往往不到一毫秒。
+MicroBatcher 把到达的请求攒到 maxBatch 个或等待 maxDelay 秒后作为一批提交，结果再分发给各自的
+等待方。队列有上限：进程池饱和时调度器停止取队列，队列满后 submit 按 policy 等待或抛出 Overloaded，
+内存不会无限增长。
+
+    batcher = MicroBatcher(executor, maxBatch=64, maxDelay=0.002, maxQueue=4096)
+    await batcher.start()
+    latex, kind, error = await batcher.submit(('ole', bts), profile)
+
+请求分为两条通道（Lane）：编辑器的交互请求（INTERACTIVE）与批量任务（BULK）。每条通道有各自的队列、
+批大小与等待时间，交互通道默认小批、短等待。调度按 strict（有交互请求时总是先发交互批）或按权重轮转；
+reserved 个 worker 只给交互通道使用：其他通道合计在途批数不超过 worker 数减去 reserved（至少为 1），
+进程池的任务队列中不会积压批量任务，批量任务满载时交互请求仍能立即拿到空闲的 worker：
+
+    batcher = MicroBatcher(executor, maxInflight=4, reserved=1)
+    await batcher.submit(item, profile, Lane.BULK)
+
+executor 已损坏或已关闭（提交时抛出 BrokenProcessPool、RuntimeError 等）时，这一批与排队中的请求都以
+ExecutorBroken（Overloaded 的子类）失败，之后的 submit 直接抛出，broken 给出原因。
+
+stats() 按通道给出排队数、在途批数与延迟分位数。
+serve（/translate、/batch）与 sidecar（--workers > 0）的请求都经过它。
+"""
+import asyncio
+from collections import deque
+from .minify import OutputProfile
+
+
+class Policy:
+    # 队列满时等待空位
+    WAIT = 'wait'
+    # 队列满时立即抛出 Overloaded
+    REJECT = 'reject'
+
+
+class Lane:
+    INTERACTIVE = 'interactive'
+    BULK = 'bulk'
+
+
+class Overloaded(Exception):
+    pass
+
+
+class ExecutorBroken(Overloaded):
+    """
+    executor 已损坏或已关闭（如 BrokenProcessPool），之后的请求立即失败
+    """
+
+
+class LaneSpec:
+    def __init__(self, weight=1, maxBatch=64, maxDelay=0.002, maxQueue=4096):
+        # weight int //按权重调度时的份额
+        self.weight = weight
+        # maxBatch int //每批最多的请求数
+        self.maxBatch = maxBatch
+        # maxDelay float //第一个请求到达后最多等待的秒数
+        self.maxDelay = maxDelay
+        # maxQueue int //等待组批的请求数上限
+        self.maxQueue = maxQueue
+
+
+class laneState:
+    def __init__(self, spec, window=2048):
+        self.spec = spec
+        # pending deque[(item, future, enqueued)]
+        self.pending = deque()
+        # space asyncio.Semaphore //队列空位
+        self.space = asyncio.Semaphore(spec.maxQueue)
+        self.inflight = 0
+        # credit int //平滑加权轮转的当前值
+        self.credit = 0
+        self.batches = 0
+        self.items = 0
+        self.rejected = 0
+        # latencies deque[float] //最近 window 个请求从提交到得到结果的秒数
+        self.latencies = deque(maxlen=window)
+
+
+def translateBatch(items):
+    """
+    worker 中执行：翻译 [(mode, bytes, profile)]，返回 [(latex, kind, error)]
+    """
+    from .batch import translateOne, translateBody
+
+    return [translateOne(bts, profile) if mode == 'ole' else translateBody(bts, profile)
+            for mode, bts, profile in items]
+
+
+def defaultLanes(maxBatch, maxDelay, maxQueue):
+    return {
+        Lane.INTERACTIVE: LaneSpec(8, min(maxBatch, 8), min(maxDelay, 0.0005), maxQueue),
+        Lane.BULK: LaneSpec(1, maxBatch, maxDelay, maxQueue),
+    }
+
+
+class MicroBatcher:
+    def __init__(self, executor, maxBatch=64, maxDelay=0.002, maxQueue=4096, maxInflight=None,
+                 policy=Policy.WAIT, fn=translateBatch, lanes=None, strict=False, reserved=0):
+        # executor Executor //通常为预热好的 ProcessPoolExecutor
+        self.executor = executor
+        # workers int //进程池大小
+        self.workers = getattr(executor, '_max_workers', None) or 1
+        # maxInflight int //同时在进程池中的批数，默认为 worker 数的 2 倍
+        self.maxInflight = maxInflight or 2 * self.workers
+        # policy string //Policy
+        self.policy = policy
+        # fn func([]item) []result //在 executor 中执行
+        self.fn = fn
+        # lanes map[string]*LaneSpec //按优先级从高到低排列，默认为 defaultLanes
+        self.specs = lanes or defaultLanes(maxBatch, maxDelay, maxQueue)
+        # strict bool //true 时高优先级通道有请求就先发，否则按 weight 轮转
+        self.strict = strict
+        # reserved int //只给第一条通道使用的 worker 数
+        self.reserved = reserved
+
+        self.lanes = None
+        self.inflight = 0
+        self.wakeup = None
+        self.dispatcher = None
+        # broken string //向 executor 提交失败后设置，之后的请求抛出 ExecutorBroken
+        self.broken = None
+
+    async def start(self):
+        self.lanes = {name: laneState(spec) for name, spec in self.specs.items()}
+        self.wakeup = asyncio.Event()
+        self.dispatcher = asyncio.ensure_future(self.dispatch())
+
+    async def close(self):
+        if self.dispatcher is not None:
+            self.dispatcher.cancel()
+            try:
+                await self.dispatcher
+            except asyncio.CancelledError:
+                pass
+            self.dispatcher = None
+        # 尚未组批的请求
+        self.failPending(Overloaded('batcher closed'))
+
+    def failPending(self, error):
+        for state in (self.lanes or {}).values():
+            while state.pending:
+                _, future, _ = state.pending.popleft()
+                state.space.release()
+                if not future.done():
+                    future.set_exception(error)
+
+    async def submit(self, item, profile=OutputProfile.DEFAULT, lane=Lane.INTERACTIVE):
+        """
+        提交一个 (mode, bytes)，返回 (latex, kind, error)
+        """
+        state = self.lanes.get(lane)
+        if state is None:
+            raise ValueError('unknown lane: %s' % lane)
+        if self.broken is not None:
+            raise ExecutorBroken(self.broken)
+        if self.policy == Policy.REJECT and state.space.locked():
+            state.rejected += 1
+            raise Overloaded('%s queue full (%d)' % (lane, state.spec.maxQueue))
+        await state.space.acquire()
+        if self.broken is not None:
+            state.space.release()
+            raise ExecutorBroken(self.broken)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        state.pending.append(((item[0], item[1], profile), future, loop.time()))
+        self.wakeup.set()
+        return await future
+
+    async def submitMany(self, items, profile=OutputProfile.DEFAULT, lane=Lane.BULK):
+        """
+        提交多个 (mode, bytes)，返回与输入顺序一致的 [(latex, kind, error)]
+        """
+        state = self.lanes.get(lane)
+        if state is None:
+            raise ValueError('unknown lane: %s' % lane)
+        if self.broken is not None:
+            raise ExecutorBroken(self.broken)
+        # 拒绝模式下整批要么全部入队，要么全部拒绝
+        if self.policy == Policy.REJECT and len(items) > state.spec.maxQueue - len(state.pending):
+            state.rejected += len(items)
+            raise Overloaded('%s queue full (%d)' % (lane, state.spec.maxQueue))
+        return await asyncio.gather(*[self.submit(item, profile, lane) for item in items])
+
+    def capacity(self, name):
+        if self.inflight >= self.maxInflight:
+            return False
+        first = next(iter(self.lanes))
+        if self.reserved and name != first:
+            return self.inflight - self.lanes[first].inflight < max(1, self.workers - self.reserved)
+        return True
+
+    def eligible(self):
+        return [name for name, state in self.lanes.items() if state.pending and self.capacity(name)]
+
+    def pickLane(self):
+        names = self.eligible()
+        if not names:
+            return None
+        if self.strict or len(names) == 1:
+            return names[0]
+        # 平滑加权轮转
+        total = 0
+        best = None
+        for name in names:
+            state = self.lanes[name]
+            state.credit += state.spec.weight
+            total += state.spec.weight
+            if best is None or state.credit > self.lanes[best].credit:
+                best = name
+        self.lanes[best].credit -= total
+        return best
+
+    async def wait(self, timeout):
+        # 检查状态与 clear 之间没有 await，不会丢失唤醒
+        self.wakeup.clear()
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # 进程池饱和时在这里等待，队列随之积压，形成背压
+            name = self.pickLane()
+            if name is None:
+                await self.wait(None)
+                continue
+            state = self.lanes[name]
+            deadline = loop.time() + state.spec.maxDelay
+            while len(state.pending) < state.spec.maxBatch:
+                # 其他通道有可发的请求时不再等待凑满
+                if any(other != name for other in self.eligible()):
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                await self.wait(remaining)
+
+            entries = []
+            while state.pending and len(entries) < state.spec.maxBatch:
+                entry = state.pending.popleft()
+                state.space.release()
+                # 等待方已取消的请求不再提交
+                if not entry[1].done():
+                    entries.append(entry)
+            if not entries:
+                continue
+            try:
+                future = loop.run_in_executor(self.executor, self.fn, [item for item, _, _ in entries])
+            except Exception as exc:
+                # executor 已损坏或已关闭：这一批与排队的请求都失败，之后的 submit 直接抛出，调度循环继续运行
+                self.broken = 'executor unavailable: %s' % (str(exc) or type(exc).__name__)
+                error = ExecutorBroken(self.broken)
+                for _, future, _ in entries:
+                    if not future.done():
+                        future.set_exception(error)
+                self.failPending(error)
+                continue
+            self.inflight += 1
+            state.inflight += 1
+            state.batches += 1
+            state.items += len(entries)
+            future.add_done_callback(lambda done, state=state, entries=entries: self.fanOut(done, state, entries))
+
+    def fanOut(self, done, state, entries):
+        self.inflight -= 1
+        state.inflight -= 1
+        self.wakeup.set()
+        if done.cancelled():
+            error = Overloaded('batch cancelled')
+            for _, future, _ in entries:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        exc = done.exception()
+        if exc is not None:
+            for _, future, _ in entries:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        now = asyncio.get_running_loop().time()
+        for (_, future, enqueued), result in zip(entries, done.result()):
+            state.latencies.append(now - enqueued)
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self):
+        lanes = {}
+        batches = items = rejected = 0
+        for name, state in (self.lanes or {}).items():
+            ordered = sorted(state.latencies)
+            lanes[name] = {
+                'queued': len(state.pending),
+                'inflight': state.inflight,
+                'batches': state.batches,
+                'items': state.items,
+                'rejected': state.rejected,
+                'meanBatch': state.items / state.batches if state.batches else 0.0,
+                'p50Ms': ordered[len(ordered) // 2] * 1e3 if ordered else 0.0,
+                'p99Ms': ordered[int(len(ordered) * 0.99)] * 1e3 if ordered else 0.0,
+            }
+            batches += state.batches
+            items += state.items
+            rejected += state.rejected
+        return {
+            'batches': batches,
+            'items': items,
+            'meanBatch': items / batches if batches else 0.0,
+            'inflight': self.inflight,
+            'rejected': rejected,
+            'broken': self.broken,
+            'lanes': lanes,
+        }
@@ -0,0 +1,215 @@
+"""
+紧凑输出
+
+生成器为了可读性留了大量空格和花括号（'{ %s }'、' {\\underline{ %s }} '、空槽位的 '%s %s %s %s' 等）。
+输出交给大模型改写时这些都是额外的 token，compact 配置下在不改变公式含义的前提下压缩：
+
+- 去掉所有多余空格，只保留控制词后紧跟字母时必需的分隔空格
+- {{X}} -> {X}，{\\rm{X}} -> {\\rm X}
+- 上下标、独立位置只有一个字母或数字的组去掉花括号：_{i} -> _i，{ x } -> x
+  （宏参数位置的组保留，如 \\frac{1}{2}）
+- 同义宏取最短写法：\\rightarrow -> \\to，\\leq -> \\le 等
+- \\text{...} 等文本模式参数原样保留
+
+花括号不配对时（v3 直接输出的 { } 字符），只做空格压缩。
+
+re 及正则表达式在第一次压缩时才加载（loadPatterns），默认配置的导入不承担这部分开销。
+"""
+
+
+class OutputProfile:
+    DEFAULT = 'default'
+    COMPACT = 'compact'
+
+
+# 同义宏 -> 最短写法
+ShortMacros = {
+    '\\rightarrow': '\\to',
+    '\\leftarrow': '\\gets',
+    '\\leq': '\\le',
+    '\\geq': '\\ge',
+    '\\neq': '\\ne',
+    '\\lbrace': '\\{',
+    '\\rbrace': '\\}',
+    '\\Vert': '\\|',
+    '\\wedge': '\\land',
+    '\\lnot': '\\neg',
+}
+
+# 参数处于文本模式，空格有意义
+TextMacros = frozenset(['\\text', '\\mbox', '\\hbox', '\\textrm', '\\textit', '\\textbf'])
+
+# Pattern，loadPatterns 之后才可用
+tokenPattern = None
+controlWordPattern = None
+
+
+def loadPatterns():
+    """
+    编译压缩用的正则表达式，重复调用无副作用
+    """
+    global tokenPattern, controlWordPattern
+    if tokenPattern is None:
+        import re
+
+        controlWordPattern = re.compile(r'\\[A-Za-z]+$')
+        tokenPattern = re.compile(r'\\[A-Za-z]+|\\.|\s+|.', re.S)
+
+
+class Group:
+    def __init__(self, items, verbatim=None):
+        # items []string|*Group //组内的记号与子组，已去掉空白
+        self.items = items
+        # verbatim string //文本模式参数，原样输出
+        self.verbatim = verbatim
+
+
+def isBalanced(tokens):
+    depth = 0
+    for token in tokens:
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+            if depth < 0:
+                return False
+    return depth == 0
+
+
+def parseGroups(tokens):
+    """
+    把记号序列解析为嵌套的 Group，调用前需保证花括号配对
+    """
+    stack = [[]]
+    verbatimFrom = None
+    for idx, token in enumerate(tokens):
+        if verbatimFrom is not None:
+            # 文本模式参数，找到配对的右括号为止
+            if token == '{':
+                verbatimDepth += 1
+            elif token == '}':
+                verbatimDepth -= 1
+                if verbatimDepth == 0:
+                    stack[-1].append(Group(None, ''.join(tokens[verbatimFrom:idx + 1])))
+                    verbatimFrom = None
+            continue
+
+        if token == '{':
+            items = stack[-1]
+            prev = items[-1] if items else None
+            if isinstance(prev, str) and prev in TextMacros:
+                verbatimFrom = idx
+                verbatimDepth = 1
+                continue
+            stack.append([])
+        elif token == '}':
+            items = stack.pop()
+            stack[-1].append(Group(items))
+        elif not token.isspace():
+            stack[-1].append(ShortMacros.get(token, token))
+    return stack[0]
+
+
+def singleToken(group, allowControlWord):
+    """
+    组内只有一个字母/数字（或控制词）时返回它，否则返回 None
+    """
+    if group.verbatim is not None or len(group.items) != 1:
+        return None
+    item = group.items[0]
+    if not isinstance(item, str):
+        return None
+    if len(item) == 1 and item.isalnum():
+        return item
+    if allowControlWord and controlWordPattern.match(item):
+        return item
+    return None
+
+
+def simplifyGroup(group):
+    # {{X}} -> {X}
+    while group.verbatim is None and len(group.items) == 1 and isinstance(group.items[0], Group) \
+            and group.items[0].verbatim is None:
+        group = group.items[0]
+    return group
+
+
+def emitItems(items, out):
+    """
+    输出一个组内的记号，out 为扁平的记号列表
+    """
+    prev = None
+    for item in items:
+        if isinstance(item, str):
+            out.append(item)
+            prev = item
+            continue
+
+        if item.verbatim is not None:
+            out.append(item.verbatim)
+            prev = '}'
+            continue
+
+        group = simplifyGroup(item)
+        if prev in ('_', '^'):
+            # 上下标：_{i} -> _i，_{\alpha} -> _\alpha
+            token = singleToken(group, True)
+            if token is not None:
+                out.append(token)
+                prev = token
+                continue
+        elif prev is None or prev in ('{', '&', '$') or (len(prev) == 1 and prev not in '}]\\'):
+            # 独立位置（不是宏参数）：{ x } -> x
+            token = singleToken(group, False)
+            if token is not None:
+                out.append(token)
+                prev = token
+                continue
+
+        if len(group.items) == 2 and group.items[0] == '\\rm' and isinstance(group.items[1], Group) \
+                and group.items[1].verbatim is None:
+            # {\rm{X}} -> {\rm X}
+            out.append('{')
+            out.append('\\rm')
+            emitItems(simplifyGroup(group.items[1]).items, out)
+            out.append('}')
+        else:
+            emitGroup(group, out)
+        prev = '}'
+
+
+def emitGroup(group, out):
+    out.append('{')
+    emitItems(group.items, out)
+    out.append('}')
+
+
+def joinTokens(tokens):
+    """
+    拼接记号，只在控制词后紧跟字母（含 Unicode 字母）或 \\\\ 后紧跟 [ 时补空格
+    """
+    buf = []
+    prev = ''
+    for token in tokens:
+        if prev and token:
+            if controlWordPattern.match(prev) and token[0].isalpha():
+                buf.append(' ')
+            elif prev == '\\\\' and token[0] in '[*':
+                buf.append(' ')
+        buf.append(token)
+        prev = token
+    return ''.join(buf)
+
+
+def minifyLatex(latex):
+    """
+    压缩 latex 字符串，保持含义不变
+    """
+    loadPatterns()
+    tokens = tokenPattern.findall(latex)
+    if not isBalanced(tokens):
+        return joinTokens([ShortMacros.get(token, token) for token in tokens if not token.isspace()])
+
+    out = []
+    emitItems(parseGroups(tokens), out)
+    return joinTokens(out)
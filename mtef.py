@@ -1,15 +1,83 @@
 from io import BytesIO
+from time import perf_counter
+from types import MappingProxyType
 from .ole_util.helper import Helper
 from .ole_util.ole import Ole
 from .record import MtLine, MtChar, MtTmpl, MtPile, MtMatrix, MtEmbellRd, MtfontStyleDef, MtSize, MtfontDef, \
-    MtColorDefIndex, MtColorDef, MtEqnPrefs, RecordType, OptionType, CharTypeface, SelectorType, EmbellType, MtAST, \
-    RecordTypeV3, TagTypeV3, MTCharV3, EmbellTypeV3, SelectorTypeV3
-from .chars import Chars, SpecialChar
-from thesis_guru.utils.logger import get_logger
-
-logger = get_logger(__name__)
+    MtColorDefIndex, MtColorDef, MtEqnPrefs, RecordType, OptionType, EmbellType, MtAST, \
+    RecordTypeV3, TagTypeV3, MTCharV3, EmbellTypeV3, MtCharRun
+from .chartable import translateChar, translateRun
+from .templates import TmplHandlers, TmplHandlersV3, mergeScripts
+from .logger import getLogger
+from .minify import OutputProfile, minifyLatex
+from . import memo
+
+logger = getLogger(__name__)
 oleCbHdr = 28
 
+# MTEF V5 版本的装饰映射，只读，多线程共享
+EmbellMapping = MappingProxyType({
+    EmbellType.emb1DOT: "\\dot",
+    EmbellType.emb2DOT: "\\ddot",
+    EmbellType.emb3DOT: "\\dddot",
+    EmbellType.emb1PRIME: "'",
+    EmbellType.emb2PRIME: "''",
+    EmbellType.emb3PRIME: "'''",
+    EmbellType.embBPRIME: "^\\backprime",
+    EmbellType.embTILDE: "\\tilde",
+    EmbellType.embHAT: "\\hat",
+    EmbellType.embNOT: "\\not",
+    EmbellType.embRARROW: "\\overrightarrow",
+    EmbellType.embLARROW: "\\overleftarrow",
+    EmbellType.embBARROW: "\\overleftrightarrow",
+    EmbellType.embR1ARROW: "\\overrightarrow",  # 单倒钩箭头暂用普通箭头
+    EmbellType.embL1ARROW: "\\overleftarrow",   # 单倒钩箭头暂用普通箭头
+    EmbellType.embMBAR: "\\overline",  # 中高度横线暂用上划线
+    EmbellType.embOBAR: "\\overline",
+    EmbellType.embFROWN: "\\frown",
+    EmbellType.embSMILE: "\\smile",
+    EmbellType.embX_BARS: "\\cancel",  # 双对角线暂用取消线
+    EmbellType.embUP_BAR: "\\nearrow",  # 左下到右上对角线暂用箭头
+    EmbellType.embDOWN_BAR: "\\searrow",  # 左上到右下对角线暂用箭头
+    EmbellType.emb4DOT: "\\ddddot",  # 四点装饰需要特殊宏包
+    EmbellType.embU_1DOT: "\\underdot",  # 下单点
+    EmbellType.embU_2DOT: "\\underddot",  # 下双点
+    EmbellType.embU_3DOT: "\\underdddot",  # 下三点
+    EmbellType.embU_4DOT: "\\underddddot",  # 下四点
+    EmbellType.embU_BAR: "\\underline",
+    EmbellType.embU_TILDE: "\\undertilde",  # 下波浪线
+    EmbellType.embU_FROWN: "\\underfrown",  # 下弧线
+    EmbellType.embU_SMILE: "\\undersmile",  # 下弧线
+    EmbellType.embU_RARROW: "\\underrightarrow",  # 下右箭头
+    EmbellType.embU_LARROW: "\\underleftarrow",  # 下左箭头
+    EmbellType.embU_BARROW: "\\underleftrightarrow",  # 下双向箭头
+    EmbellType.embU_R1ARROW: "\\underrightarrow",  # 下右单倒钩箭头
+    EmbellType.embU_L1ARROW: "\\underleftarrow",   # 下左单倒钩箭头
+})
+
+# MTEF V3 版本的装饰映射
+EmbellMappingV3 = MappingProxyType({
+    EmbellTypeV3.embDOT: "\\dot",
+    EmbellTypeV3.embDDOT: "\\ddot",
+    EmbellTypeV3.embTDOT: "\\dddot",
+    EmbellTypeV3.embPRIME: "'",
+    EmbellTypeV3.embDPRIME: "''",
+    EmbellTypeV3.embTPRIME: "'''",
+    EmbellTypeV3.embBPRIME: "^\\backprime",
+    EmbellTypeV3.embTILDE: "\\tilde",
+    EmbellTypeV3.embHAT: "\\hat",
+    EmbellTypeV3.embNOT: "\\not",
+    EmbellTypeV3.embRARROW: "\\overrightarrow",
+    EmbellTypeV3.embLARROW: "\\overleftarrow",
+    EmbellTypeV3.embBARROW: "\\overleftrightarrow",
+    EmbellTypeV3.embR1ARROW: "\\overrightarrow",  # 单倒钩箭头暂用普通箭头
+    EmbellTypeV3.embL1ARROW: "\\overleftarrow",   # 单倒钩箭头暂用普通箭头
+    EmbellTypeV3.embMBAR: "\\overline",  # 中高度横线暂用上划线
+    EmbellTypeV3.embOBAR: "\\overline",
+    EmbellTypeV3.embFROWN: "\\frown",
+    EmbellTypeV3.embSMILE: "\\smile",
+})
+
 
 class MTEF:
     def __init__(self):
@@ -38,6 +106,14 @@ class MTEF:
 
         # Valid bool //是否合法，顺利解析
         self.Valid = False
+        # InvalidReason string //Valid 为 False 的原因
+        self.InvalidReason = ''
+
+        # fingerprintDigest string //fingerprint() 的结果
+        self.fingerprintDigest = None
+
+        # rendered map[id(node)](string, error) //分片渲染时已渲染的子树，其余时间为 None
+        self.rendered = None
 
     def readRecord(self):
         """
@@ -66,7 +142,10 @@ class MTEF:
         """
         解析 MTEF v3 主体（单字节 tag：高 4 位＝选项，低 4 位＝类型）
         """
+        # 开启子树记忆化时，在可入栈节点的 key 中暂存记录起始偏移，END 的 key 为其后的偏移
+        keyed = memo.renderMemo is not None
         while True:
+            start = self.reader.tell()
             tag_data = self.reader.read(1)
             if not tag_data or len(tag_data) != 1:      # EOF
                 break
@@ -78,6 +157,8 @@ class MTEF:
             # END：无附加数据
             if rec_type == RecordTypeV3.END:
                 self.nodes.append(MtAST(RecordType.END, None, None))
+                if keyed:
+                    self.nodes[-1].key = self.reader.tell()
                 continue
 
             # 需要让下层函数重新读取 tag 的记录
@@ -93,6 +174,8 @@ class MTEF:
                 line = MtLine()
                 self.readLineV3(line)
                 self.nodes.append(MtAST(RecordTypeV3.LINE, line, None))
+                if keyed and not line.null:
+                    self.nodes[-1].key = start
 
             elif rec_type == RecordTypeV3.CHAR:
                 ch = MTCharV3()
@@ -103,16 +186,22 @@ class MTEF:
                 tmpl = MtTmpl()
                 self.readTMPLV3(tmpl)                     # v3 格式兼容 v5
                 self.nodes.append(MtAST(RecordTypeV3.TMPL, tmpl, None))
+                if keyed:
+                    self.nodes[-1].key = start
 
             elif rec_type == RecordTypeV3.PILE:
                 pile = MtPile()
                 self.readPileV3(pile)
                 self.nodes.append(MtAST(RecordTypeV3.PILE, pile, None))
+                if keyed:
+                    self.nodes[-1].key = start
 
             elif rec_type == RecordTypeV3.MATRIX:
                 mat = MtMatrix()
                 self.readMatrixV3(mat)
                 self.nodes.append(MtAST(RecordTypeV3.MATRIX, mat, None))
+                if keyed:
+                    self.nodes[-1].key = start
 
             elif rec_type == RecordTypeV3.EMBELL:
                 emb = MtEmbellRd()
@@ -136,13 +225,17 @@ class MTEF:
             else:
                 # 未识别记录，标记无效并退出
                 self.Valid = False
+                self.InvalidReason = 'unsupported v3 record %d' % rec_type
                 break
 
     def readBody(self):
+        # 开启子树记忆化时，在可入栈节点的 key 中暂存记录起始偏移，END 的 key 为其后的偏移
+        keyed = memo.renderMemo is not None
         while True:
             err = None
             record = RecordType.END
             read_data = None
+            start = self.reader.tell()
             read_data = self.reader.read(1)
             if read_data is None or len(read_data) != 1:
                 err = 'MEFT.readRecord: read byte error'
@@ -162,11 +255,15 @@ class MTEF:
 
             if record == RecordType.END:
                 self.nodes.append(MtAST(RecordType.END, None, None))
+                if keyed:
+                    self.nodes[-1].key = self.reader.tell()
             elif record == RecordType.LINE:
                 line = MtLine()
                 self.readLine(line)
 
                 self.nodes.append(MtAST(RecordType.LINE, line, None))
+                if keyed and not line.null:
+                    self.nodes[-1].key = start
             elif record == RecordType.CHAR:
                 char = MtChar()
                 self.readChar(char, record)
@@ -176,11 +273,15 @@ class MTEF:
                 self.readTMPL(tmpl)
 
                 self.nodes.append(MtAST(RecordType.TMPL, tmpl, None))
+                if keyed:
+                    self.nodes[-1].key = start
             elif record == RecordType.PILE:
                 pile = MtPile()
                 self.readPile(pile)
 
                 self.nodes.append(MtAST(RecordType.PILE, pile, None))
+                if keyed:
+                    self.nodes[-1].key = start
             elif record == RecordType.MATRIX:
                 matrix = MtMatrix()
                 self.readMatrix(matrix)
@@ -190,6 +291,10 @@ class MTEF:
                 # 匹配矩阵数据下面的2个nil
                 self.nodes.append(MtAST(RecordType.LINE, MtLine(), None))
                 self.nodes.append(MtAST(RecordType.LINE, MtLine(), None))
+                if keyed:
+                    # 两个补出的 LINE 没有对应的记录，从矩阵记录之后开始算
+                    self.nodes[-3].key = start
+                    self.nodes[-2].key = self.nodes[-1].key = self.reader.tell()
             elif record == RecordType.EMBELL:
                 embell = MtEmbellRd()
                 self.readEmbell(embell)
@@ -247,6 +352,7 @@ class MTEF:
                 self.nodes.append(MtAST(RecordType.ENCODING_DEF, enc, None))
             else:
                 self.Valid = False
+                self.InvalidReason = 'unsupported v5 record %d' % record
 
         return None
 
@@ -871,55 +977,97 @@ class MTEF:
 
         return None
 
-    def Translate(self):
+    def Translate(self, profile=OutputProfile.DEFAULT):
+        """
+        翻译为 latex，profile 为 OutputProfile.COMPACT 时输出压缩后的 latex
+        """
+        if profile not in (OutputProfile.DEFAULT, OutputProfile.COMPACT):
+            raise ValueError('unknown output profile: %r' % (profile,))
+
         if self.mMtefVer != 3:
             latexStr, err = self.makeLatex(self.ast)
-
         else:
-            # v3没有root节点，所以需要手动添加
             latexStr, err = self.makeLatexV3(self.ast)
-            latexStr = self.fixConsecutiveScripts(latexStr)
-            format = ["$", latexStr, "$"]
-            latexStr = "".join(format)
-
-        if err is not None:
-            logger.error('MTEF.Translate.err: %s', err)
-
-        if self.Valid:
-            return latexStr
-        else:
-            return ''
+        return self.finishLatex(latexStr, err, profile)
 
-    def fixConsecutiveScripts(self, latex_str):
+    def TranslateIter(self, profile=OutputProfile.DEFAULT, sliceNodes=256, sliceMicros=None):
         """
-        修复连续的下标和上标问题
-        将形如 X_A_B 或 X^A^B 的连续脚本转换为 X_{AB} 或 X^{AB}
+        分片翻译的生成器：每渲染 sliceNodes 个节点或超过 sliceMicros 微秒让出一次（产出本片的节点数），
+        结束时以 StopIteration.value 返回与 Translate 相同的结果。用于在事件循环中直接翻译：
+
+            gen = eqn.TranslateIter()
+            while True:
+                try:
+                    next(gen)
+                except StopIteration as stop:
+                    latex = stop.value
+                    break
+                await asyncio.sleep(0)
         """
-        import re
+        if profile not in (OutputProfile.DEFAULT, OutputProfile.COMPACT):
+            raise ValueError('unknown output profile: %r' % (profile,))
 
-        # 修复连续下标：合并相邻的下标
-        # 先处理带花括号的下标：_{ content1 }_{ content2 } -> _{content1 content2}
-        pattern1 = r'_\{\s*([^}]+)\s*\}\s*_\{\s*([^}]+)\s*\}'
-        while re.search(pattern1, latex_str):
-            latex_str = re.sub(pattern1, r'_{\1 \2}', latex_str)
+        latexStr, err = yield from self.iterLatex(sliceNodes, sliceMicros)
+        return self.finishLatex(latexStr, err, profile)
 
-        # 再处理简单下标：_A_B -> _{AB}
-        pattern2 = r'_([^_^{}\s\\])\s*_([^_^{}\s\\])'
-        while re.search(pattern2, latex_str):
-            latex_str = re.sub(pattern2, r'_{\1\2}', latex_str)
+    def iterLatex(self, sliceNodes=256, sliceMicros=None):
+        """
+        后序渲染全部子树并暂存到 self.rendered，父节点渲染时直接取用；根节点最后渲染，返回 (latex, err)
+        """
+        render = self.makeLatexV3 if self.mMtefVer == 3 else self.makeLatex
+        root = self.ast
+        if root is None:
+            return render(root)
+
+        self.rendered = rendered = {}
+        try:
+            count = 0
+            deadline = perf_counter() + sliceMicros / 1e6 if sliceMicros else None
+            # stack [](node, expanded)
+            stack = [(root, False)]
+            while stack:
+                node, expanded = stack.pop()
+                if not expanded:
+                    stack.append((node, True))
+                    if node.children:
+                        stack.extend((child, False) for child in reversed(node.children) if child is not None)
+                    continue
+                if node is root:
+                    break
 
-        # 修复连续上标：合并相邻的上标
-        # 先处理带花括号的上标：^{ content1 }^{ content2 } -> ^{content1 content2}
-        pattern3 = r'\^\{\s*([^}]+)\s*\}\s*\^\{\s*([^}]+)\s*\}'
-        while re.search(pattern3, latex_str):
-            latex_str = re.sub(pattern3, r'^{\1 \2}', latex_str)
+                try:
+                    rendered[id(node)] = render(node)
+                except Exception:
+                    # 父节点不一定用到这棵子树（如 tmANGLE 子节点不足时），不暂存，用到时再渲染并抛出
+                    pass
+                count += 1
+                # 每 16 个节点看一次时钟
+                if count >= sliceNodes or (deadline is not None and count % 16 == 0 and perf_counter() >= deadline):
+                    yield count
+                    count = 0
+                    if deadline is not None:
+                        deadline = perf_counter() + sliceMicros / 1e6
+            return render(root)
+        finally:
+            self.rendered = None
+
+    def finishLatex(self, latexStr, err, profile):
+        """
+        Translate 的收尾：v3 补上 $，检查 Valid，按 profile 压缩
+        """
+        if self.mMtefVer == 3:
+            # v3没有root节点，所以需要手动添加
+            format = ["$", latexStr, "$"]
+            latexStr = "".join(format)
 
-        # 再处理简单上标：^A^B -> ^{AB}
-        pattern4 = r'\^([^_^{}\s\\])\s*\^([^_^{}\s\\])'
-        while re.search(pattern4, latex_str):
-            latex_str = re.sub(pattern4, r'^{\1\2}', latex_str)
+        if err is not None:
+            logger.error('MTEF.Translate.err: %s', err)
 
-        return latex_str
+        if not self.Valid:
+            return ''
+        if profile == OutputProfile.COMPACT:
+            return minifyLatex(latexStr)
+        return latexStr
 
     def makeAST(self):
         """
@@ -932,8 +1080,12 @@ class MTEF:
 
         # v3 格式需要特殊处理
         if self.mMtefVer == 3:
-            return self.makeASTv3()
+            err = self.makeASTv3()
+            self.coalesceCharRuns()
+            return err
 
+        # 子树记忆化的结构键取自原始数据
+        body = self.reader.getvalue() if self.reader is not None else None
         stack = []
         stack.append(ast)
 
@@ -974,6 +1126,8 @@ class MTEF:
                 if len(stack):
                     ele = stack[len(stack) - 1]
                     stack.remove(ele)
+                    if ele.key is not None:
+                        memo.subtreeKey(self.mMtefVer, ele, body, node.key)
             if node.tag == RecordType.CHAR:
                 if len(stack):
                     parent = stack[len(stack) - 1]
@@ -1001,12 +1155,57 @@ class MTEF:
 
                 stack.append(node)
 
+        for ele in stack:
+            # 没有等到 END 的节点不参与记忆化
+            ele.key = None
+        self.coalesceCharRuns()
         return None
 
+    def coalesceCharRuns(self):
+        """
+        把 LINE 下同一 typeface 的连续 CHAR 合并为一个 CHAR_RUN 节点，渲染时整段查表。
+        与 EMBELL 相邻的 CHAR 保持独立
+        """
+        stack = [self.ast]
+        while stack:
+            node = stack.pop()
+            if not node.children:
+                continue
+            if node.tag == RecordType.LINE:
+                node.children = self.mergeCharRuns(node.children)
+            stack.extend(node.children)
+
+    def mergeCharRuns(self, children):
+        merged = []
+        run = []
+
+        def flush():
+            if len(run) > 1:
+                text = ''.join(chr(char.value.mtcode) for char in run)
+                merged.append(MtAST(RecordType.CHAR_RUN, MtCharRun(run[0].value.typeface, text), None))
+            else:
+                merged.extend(run)
+            del run[:]
+
+        last = len(children) - 1
+        for idx, child in enumerate(children):
+            if child.tag == RecordType.CHAR and child.value is not None and child.value.mtcode is not None \
+                    and not (idx > 0 and children[idx - 1].tag == RecordType.EMBELL) \
+                    and not (idx < last and children[idx + 1].tag == RecordType.EMBELL):
+                if run and run[0].value.typeface != child.value.typeface:
+                    flush()
+                run.append(child)
+                continue
+            flush()
+            merged.append(child)
+        flush()
+        return merged
+
     def makeASTv3(self):
         """
         专门处理 v3 格式的 AST 构建
         """
+        body = self.reader.getvalue() if self.reader is not None else None
         stack = []
         stack.append(self.ast)
 
@@ -1047,6 +1246,8 @@ class MTEF:
                 if len(stack):
                     ele = stack[len(stack) - 1]
                     stack.remove(ele)
+                    if ele.key is not None:
+                        memo.subtreeKey(self.mMtefVer, ele, body, node.key)
             if node.tag == RecordTypeV3.CHAR:
                 if len(stack):
                     parent = stack[len(stack) - 1]
@@ -1078,11 +1279,36 @@ class MTEF:
 
                 stack.append(node)
 
+        for ele in stack:
+            # 没有等到 END 的节点不参与记忆化
+            ele.key = None
         return None
 
     def makeLatex(self, ast):
         """
-        根据出栈入栈结构生成latex字符串
+        根据出栈入栈结构生成latex字符串，开启子树记忆化时相同子树只渲染一次
+        """
+        if self.rendered is not None:
+            result = self.rendered.get(id(ast))
+            if result is not None:
+                return result
+
+        renderMemo = memo.renderMemo
+        if renderMemo is None or ast.key is None or ast.tag not in memo.MemoTags:
+            return self.renderLatex(ast)
+
+        latex = renderMemo.get(ast.key)
+        if latex is not None:
+            return latex, None
+        generation = renderMemo.generation
+        latex, err = self.renderLatex(ast)
+        if err is None:
+            renderMemo.put(ast.key, latex, generation)
+        return latex, err
+
+    def renderLatex(self, ast):
+        """
+        渲染一个 v5 节点
         """
 
         buf = ''
@@ -1095,659 +1321,22 @@ class MTEF:
             buf += ' $'
             return buf, None
         elif ast.tag == RecordType.CHAR:
-            mtcode = ast.value.mtcode
-            typeface = ast.value.typeface
-            char = chr(mtcode)
-
-            # 生成char的一些特殊集
-            hexExtend = ''
-            typefaceFmt = ''
-            if typeface - 128 == CharTypeface.fnMTEXTRA:
-                hexExtend = '/mathmode'
-            elif typeface - 128 == CharTypeface.fnSPACE:
-                hexExtend = '/mathmode'
-            elif typeface - 128 == CharTypeface.fnTEXT:
-                typefaceFmt = '{ \\rm{ %s } }'
-
-            # 生成扩展字符的key
-            # hexCode := fmt.Sprintf("%04x", mtcode)
-            hexCode = '%04x' % mtcode
-            # hexKey := fmt.Sprintf("char/0x%s%s", hexCode, hexExtend)
-            hexKey = 'char/0x%s%s' % (hexCode, hexExtend)
-
-            # fmt.Println(char, hexKey)
-
-            # 首先去找扩展字符
-            sChar = Chars.get(hexKey)
-            if sChar:
-                char = sChar
-            else:
-                # 如果char是特殊symbol，需要转义
-                sChar = SpecialChar.get(char)
-                if sChar:
-                    char = sChar
-
-            # 确定字符是否为文本，如果是文本，则需要包一层
-            if typefaceFmt != '':
-                char = typefaceFmt % char
-
-            buf += char
+            # 查预编译的整数翻译表
+            buf += translateChar(ast.value.mtcode, ast.value.typeface)
+            return buf, None
+        elif ast.tag == RecordType.CHAR_RUN:
+            buf += translateRun(ast.value.text, ast.value.typeface)
             return buf, None
         elif ast.tag == RecordType.TMPL:
-            # 强制类型转换为MtTmpl
-            tmpl = ast.value
+            # 按selector分派到模板处理器
+            result = TmplHandlers.dispatch(self, ast, self.makeLatex)
+            if result is not None:
+                return result
 
-            if tmpl.selector == SelectorType.tmANGLE:
-                if len(ast.children) < 3:
-                    return '<unknown>', None
-                mainAST = ast.children[0]
-                leftAST = ast.children[1]
-                rightAST = ast.children[2]
-
-                mainSlot, _ = self.makeLatex(mainAST)
-                leftSlot, _ = self.makeLatex(leftAST)
-                rightSlot, _ = self.makeLatex(rightAST)
-
-                # 转成latex代码
-                mainStr = ''
-                leftStr = ''
-                rightStr = ''
-                if mainSlot != '':
-                    mainStr = '{ %s }' % mainSlot
-                if leftSlot != '':
-                    leftStr = '\\left %s' % leftSlot
-                if rightSlot != '':
-                    rightStr = '\\right %s' % rightSlot
-
-                buf += '%s %s %s' % (leftStr, mainStr, rightStr)
-
-                return buf, None
-            elif tmpl.selector == SelectorType.tmPAREN:
-                if len(ast.children) < 3:
-                    return '()', None
-                mainAST = ast.children[0]
-                leftAST = ast.children[1]
-                rightAST = ast.children[2]
-
-                mainSlot, _ = self.makeLatex(mainAST)
-                leftSlot, _ = self.makeLatex(leftAST)
-                rightSlot, _ = self.makeLatex(rightAST)
-
-                # 转成latex代码
-                mainStr = ''
-                leftStr = ''
-                rightStr = ''
-                if mainSlot != '':
-                    mainStr = '{ %s }' % mainSlot
-                if leftSlot != '':
-                    leftStr = '\\left %s' % leftSlot
-                if rightSlot != '':
-                    rightStr = '\\right %s' % rightSlot
-
-                buf += '%s %s %s' % (leftStr, mainStr, rightStr)
-                return buf, None
-            elif tmpl.selector == SelectorType.tmBRACE:
-                mainSlot = ''
-                leftSlot = ''
-                rightSlot = ''
-                idx = 0
-                for astData in ast.children:
-                    if idx == 0:
-                        mainSlot, _ = self.makeLatex(astData)
-                    elif idx == 1:
-                        leftSlot, _ = self.makeLatex(astData)
-                    else:
-                        rightSlot, _ = self.makeLatex(astData)
-                    idx += 1
-
-                if rightSlot == '':
-                    rightSlot = '.'
-                else:
-                    rightSlot = ' ' + rightSlot
-
-                # 组装公式
-                buf += '\\left %s \\begin{array}{l} %s \\end{array} \\right%s' % (leftSlot, mainSlot, rightSlot)
-
-                return buf, None
-            elif tmpl.selector == SelectorType.tmBRACK:
-                mainAST = ast.children[0]
-                leftAST = ast.children[1]
-                rightAST = ast.children[2]
-                mainSlot, _ = self.makeLatex(mainAST)
-                if mainSlot == '':
-                    mainSlot = '\\space'
-                leftSlot, _ = self.makeLatex(leftAST)
-                rightSlot, _ = self.makeLatex(rightAST)
-                buf += '\\left%s %s \\right%s' % (leftSlot, mainSlot, rightSlot)
-                return buf, None
-            elif tmpl.selector == SelectorType.tmBAR:
-                # 读取数据 ParBoxClass
-                mainSlot = ''
-                leftSlot = ''
-                rightSlot = ''
-                idx = 0
-                for astData in ast.children:
-                    if idx == 0:
-                        mainSlot, _ = self.makeLatex(astData)
-                    elif idx == 1:
-                        leftSlot, _ = self.makeLatex(astData)
-                    else:
-                        rightSlot, _ = self.makeLatex(astData)
-                    idx += 1
-
-                if rightSlot == '':
-                    rightSlot = '.'
-                else:
-                    rightSlot = ' ' + rightSlot
-
-                # 转成latex代码
-                mainStr = ''
-                leftStr = ''
-                rightStr = ''
-                if mainSlot != '':
-                    mainStr = '{ %s }' % mainSlot
-                if leftSlot != '':
-                    leftStr = '\\left %s' % leftSlot
-                if rightSlot != '':
-                    rightStr = '\\right %s' % rightSlot
-
-                # 组成整体公式
-                tmplStr = '%s %s %s' % (leftStr, mainStr, rightStr)
-                buf += tmplStr
-
-                return buf, None
-            elif tmpl.selector == SelectorType.tmINTERVAL:
-                # 读取数据 ParBoxClass
-                mainAST = ast.children[0]
-                leftAST = ast.children[1]
-                rightAST = ast.children[2]
-
-                # 读取latex数据
-                mainSlot, _ = self.makeLatex(mainAST)
-                leftSlot, _ = self.makeLatex(leftAST)
-                rightSlot, _ = self.makeLatex(rightAST)
-
-                # 转成latex代码
-                mainStr = ''
-                leftStr = ''
-                rightStr = ''
-                if mainSlot != '':
-                    mainStr = '{ %s }' % mainSlot
-                if leftSlot != '':
-                    leftStr = '\\left %s' % leftSlot
-                if rightSlot != '':
-                    rightStr = '\\right %s' % rightSlot
-
-                # 组成整体公式
-                tmplStr = '%s %s %s' % (leftStr, mainStr, rightStr)
-                buf += tmplStr
-
-                return buf, None
-            elif tmpl.selector == SelectorType.tmROOT:
-                mainAST = ast.children[0]
-                radiAST = ast.children[1]
-                mainSlot, _ = self.makeLatex(mainAST)
-                radiSlot, _ = self.makeLatex(radiAST)
-                buf += '\\sqrt[%s] { %s }' % (radiSlot, mainSlot)
-                return buf, None
-            elif tmpl.selector == SelectorType.tmFRACT:
-                if len(ast.children) < 2:
-                    # 直接传入bin文件这里不会触发，传入字节流在公式太多/thesis_06公式太多.docx以及thesis_15公式太多中会触发
-                    numAST = ast.children[0]
-                    numSlot, _ = self.makeLatex(numAST)
-                    buf += '\\frac { %s } {Unknown}' % numSlot
-                    return buf, None
-                numAST = ast.children[0]
-                denAST = ast.children[1]
-                numSlot, _ = self.makeLatex(numAST)
-                denSlot, _ = self.makeLatex(denAST)
-                buf += '\\frac { %s } { %s }' % (numSlot, denSlot)
-                return buf, None
-            elif tmpl.selector == SelectorType.tmARROW:
-                """
-                    variation	symbol	description
-                    0×0000	tvAR_SINGLE	single arrow
-                    0×0001	tvAR_DOUBLE	double arrow
-                    0×0002	tvAR_HARPOON	harpoon
-                    0×0004	tvAR_TOP	top slot is present
-                    0×0008	tvAR_BOTTOM	bottom slot is present
-                    0×0010	tvAR_LEFT	if single, arrow points left
-                    0×0020	tvAR_RIGHT	if single, arrow points right
-                    0×0010	tvAR_LOS	if double or harpoon, large over small
-                    0×0020	tvAR_SOL	if double or harpoon, small over large
-                """
-                topAST = ast.children[0]
-                bottomAST = ast.children[1]
-
-                # 读取latex数据
-                topSlot, _ = self.makeLatex(topAST)
-                bottomSlot, _ = self.makeLatex(bottomAST)
-
-                # 转成latex代码
-                topStr = ''
-                bottomStr = ''
-                if topSlot != '':
-                    topStr = '{\\mathrm{ %s }}' % topSlot
-                if bottomSlot != '':
-                    bottomStr = '[\\mathrm{ %s }]' % bottomSlot
-
-                """
-                    variation转码
-                """
-                variationsMap = {}  # map[uint16]string
-                variationsMap[0x0000] = "single"
-                variationsMap[0x0001] = "double"
-                variationsMap[0x0002] = "harpoon"
-                variationsMap[0x0004] = "topSlotPresent"
-                variationsMap[0x0008] = "bottomSlotPresent"
-                variationsMap[0x0010] = "pointLeft"
-                variationsMap[0x0020] = "pointRight"
-
-                # 有序循环
-                variationsCode = [0x0000, 0x0001, 0x0002, 0x0004, 0x0008, 0x0010,
-                                  0x0020]  # []uint16{0x0000, 0x0001, 0x0002, 0x0004, 0x0008, 0x0010, 0x0020}
-
-                arrowStyle = "single"
-                latexFmt = "\\x"
-                for vCode in variationsCode:
-                    # 如果存在掩码
-                    if vCode & tmpl.variation != 0:
-                        # 判断类型，默认是single
-                        if variationsMap[vCode] == "double":
-                            arrowStyle = "double"
-                        elif variationsMap[vCode] == "harpoon":
-                            arrowStyle = "harpoon"
-
-                        if arrowStyle == "single" and variationsMap[vCode] == "pointLeft":
-                            latexFmt = latexFmt + "leftarrow"
-                        elif arrowStyle == "double" and variationsMap[vCode] == "pointLeft":
-                            logger.warning('MTEF.makeLatex: not implement double , large over small')
-                        elif arrowStyle == "harpoon" and variationsMap[vCode] == "pointLeft":
-                            logger.warning('MTEF.makeLatex: not implement harpoon, large over small')
-
-                        if arrowStyle == "single" and variationsMap[vCode] == "pointRight":
-                            latexFmt = latexFmt + "rightarrow"
-                        elif arrowStyle == "double" and variationsMap[vCode] == "pointRight":
-                            logger.warning('MTEF.makeLatex: not implement double , small over large')
-                        elif arrowStyle == "harpoon" and variationsMap[vCode] == "pointRight":
-                            logger.warning('MTEF.makeLatex: not implement harpoon, small over large')
-
-                # 组成整体公式
-                tmplStr = "%s %s %s" % (latexFmt, bottomStr, topStr)
-                buf += tmplStr
-
-                return buf, None
-            elif tmpl.selector == SelectorType.tmUBAR:
-                # 读取数据
-                mainAST = ast.children[0]
-
-                # 读取latex数据
-                mainSlot, _ = self.makeLatex(mainAST)
-
-                # 转成latex代码
-                mainStr = ''
-                if mainSlot != "":
-                    mainStr = " {\\underline{ %s }} " % mainSlot
-
-                # 组成整体公式
-                tmplStr = " %s " % mainStr
-                buf += tmplStr
-
-                # 返回数据
-                return buf, None
-            elif tmpl.selector == SelectorType.tmOBAR:
-                # 读取数据 - 上划线 (overbar)
-                mainAST = ast.children[0]
-
-                # 读取latex数据
-                mainSlot, _ = self.makeLatex(mainAST)
-
-                # 转成latex代码
-                mainStr = ''
-                if mainSlot != "":
-                    # 检查variation来决定是否使用双线
-                    if tmpl.variation & 0x0001:  # tvBAR_DOUBLE - 双划线
-                        mainStr = " {\\overline{\\overline{ %s }}} " % mainSlot
-                    else:  # 单划线
-                        mainStr = " {\\overline{ %s }} " % mainSlot
-
-                # 组成整体公式
-                tmplStr = " %s " % mainStr
-                buf += tmplStr
-
-                # 返回数据
-                return buf, None
-            elif tmpl.selector == SelectorType.tmSUM:
-                # 读取数据 BigOpBoxClass
-                mainSlot = ''
-                upperSlot = ''
-                lowerSlot = ''
-                operatorSlot = ''
-                idx = 0
-                for astData in ast.children:
-                    if idx == 0:
-                        mainSlot, _ = self.makeLatex(astData)
-                    elif idx == 1:
-                        lowerSlot, _ = self.makeLatex(astData)
-                    elif idx == 2:
-                        upperSlot, _ = self.makeLatex(astData)
-                    else:
-                        operatorSlot, _ = self.makeLatex(astData)
-                    idx += 1
-
-                # 转成latex代码
-                mainStr = ''
-                lowerStr = ''
-                upperStr = ''
-                if mainSlot != "":
-                    mainStr = "{ %s }" % mainSlot
-                if lowerSlot != "":
-                    lowerStr = "\\limits_{ %s }" % lowerSlot
-                if upperSlot != "":
-                    upperStr = "^ %s" % upperSlot
-
-                # 组成整体公式
-                tmplStr = "%s %s %s %s" % (operatorSlot, lowerStr, upperStr, mainStr)
-                buf += tmplStr
-
-                return buf, None
-            elif tmpl.selector == SelectorType.tmLIM:
-                # 读取数据 LimBoxClass
-                mainSlot = ''
-                lowerSlot = ''
-                upperSlot = ''
-                idx = 0
-                for astData in ast.children:
-                    if idx == 0:
-                        mainSlot, _ = self.makeLatex(astData)
-                    elif idx == 1:
-                        lowerSlot, _ = self.makeLatex(astData)
-                    else:
-                        upperSlot, _ = self.makeLatex(astData)
-                    idx += 1
-
-                # 转成latex代码
-                mainStr = ''
-                lowerStr = ''
-                upperStr = ''
-                if mainSlot != "":
-                    mainStr = "\\mathop { %s }" % mainSlot
-                if lowerSlot != "":
-                    lowerStr = "\\limits_{ %s }" % lowerSlot
-                if upperSlot != "":
-                    upperStr = ""
-
-                # 组成整体公式
-                tmplStr = "%s %s %s" % (mainStr, lowerStr, upperStr)
-                buf += tmplStr
-
-                return buf, None
-            elif tmpl.selector == SelectorType.tmSUP:
-                # 只处理上标 (superscript only)
-                if ast.children:
-                    supAST = ast.children[0]  # 只读取第一个子对象作为上标内容
-                    supSlot, _ = self.makeLatex(supAST)
-
-                    if supSlot:
-                        buf += f"^{{ {supSlot} }}"
-                return buf, None
-            elif tmpl.selector == SelectorType.tmSUB:
-                # 只处理下标 (subscript only)
-                if ast.children:
-                    subAST = ast.children[0]  # 只读取第一个子对象作为下标内容
-                    subSlot, _ = self.makeLatex(subAST)
-
-                    if subSlot:
-                        buf += f"_{{ {subSlot} }}"
-                return buf, None
-            elif tmpl.selector == SelectorType.tmSUBSUP:
-                # 同时处理下标和上标 (both subscript and superscript)
-                subSlot = ''
-                supSlot = ''
-
-                if len(ast.children) >= 1:
-                    subAST = ast.children[0]  # 第一个子对象是下标
-                    subSlot, _ = self.makeLatex(subAST)
-
-                if len(ast.children) >= 2:
-                    supAST = ast.children[1]  # 第二个子对象是上标
-                    supSlot, _ = self.makeLatex(supAST)
-
-                # 转成latex代码
-                subFmt = f"_{{ {subSlot} }}" if subSlot else ''
-                supFmt = f"^{{ {supSlot} }}" if supSlot else ''
-
-                # 组成整体公式
-                tmplStr = f"{subFmt}{supFmt}"
-                buf += tmplStr
-                return buf, None
-            elif tmpl.selector == SelectorType.tmVEC:
-                """
-                    variations：
-                    variation	symbol	description
-                    0×0001	tvVE_LEFT	arrow points left
-                    0×0002	tvVE_RIGHT	arrow points right
-                    0×0004	tvVE_UNDER	arrow under slot, else over slot
-                    0×0008	tvVE_HARPOON	harpoon
-
-                    这个转换是通过掩码计算的：
-                    比如variation的值是3，即0000 0000 0000 0011
-
-                    对应的是0×0001和0×0002：
-                    0000 0000 0000 0001
-                    0000 0000 0000 0010
-                """
-
-                # 读取数据 HatBoxClass
-                mainAST = ast.children[0]
-
-                # 读取latex数据
-                mainSlot, _ = self.makeLatex(mainAST)
-
-                # 转成latex代码
-                mainStr = ''
-                if mainSlot != "":
-                    mainStr = "{ %s }" % mainSlot
-
-                """
-                    variation转码
-                """
-                variationsMap = {}  # map[uint16]string
-                variationsMap[0x0001] = "left"
-                variationsMap[0x0002] = "right"
-                variationsMap[0x0004] = "tvVE_UNDER"
-                variationsMap[0x0008] = "harpoonup"
-
-                # 有序循环
-                variationsCode = [0x0001, 0x0002, 0x0004, 0x0008]  # []uint16{0x0001, 0x0002, 0x0004, 0x0008}
-
-                topStr = "\\overset\\"
-                for vCode in variationsCode:
-                    if vCode & tmpl.variation != 0:
-                        topStr = topStr + variationsMap[vCode]
-
-                # 如果variationCode小于8，则一定不是harpoon,那么默认就使用arrow
-                if tmpl.variation < 8:
-                    topStr = topStr + "arrow"
-                """
-                    variation转码 END
-                """
-
-                # 组成整体公式
-                tmplStr = "%s %s" % (topStr, mainStr)
-                buf += tmplStr
-
-                return buf, None
-            elif tmpl.selector == SelectorType.tmHAT:
-                # 读取数据 HatBoxClass
-                mainAST = ast.children[0]
-                topAST = ast.children[1]
-
-                # 读取latex数据
-                mainSlot, _ = self.makeLatex(mainAST)
-                topSlot, _ = self.makeLatex(topAST)
-
-                # 转成latex代码
-                mainStr = ''
-                topStr = ''
-                if mainSlot != "":
-                    mainStr = "{ %s }" % mainSlot
-                if topSlot != "":
-                    topStr = " %s " % topSlot
-
-                # 组成整体公式
-                tmplStr = "%s %s" % (topStr, mainStr)
-                buf += tmplStr
-
-                return buf, None
-            elif tmpl.selector == SelectorType.tmARC:
-                # 读取数据 HatBoxClass
-                mainAST = ast.children[0]
-                topAST = ast.children[1]
-
-                # 读取latex数据
-                mainSlot, _ = self.makeLatex(mainAST)
-                topSlot, _ = self.makeLatex(topAST)
-
-                # 转成latex代码
-                mainStr = ''
-                topStr = ''
-                if mainSlot != "":
-                    mainStr = "{ %s }" % mainSlot
-                if topSlot != "":
-                    topStr = "\\overset %s" % topSlot
-
-                # 组成整体公式
-                tmplStr = "%s %s" % (topStr, mainStr)
-                buf += tmplStr
-
-                return buf, None
-            elif tmpl.selector == SelectorType.tmINTEG:
-                # 积分符号处理
-                mainSlot = ''
-                lowerSlot = ''
-                upperSlot = ''
-                idx = 0
-                for astData in ast.children:
-                    if idx == 0:
-                        mainSlot, _ = self.makeLatex(astData)
-                    elif idx == 1:
-                        lowerSlot, _ = self.makeLatex(astData)
-                    elif idx == 2:
-                        upperSlot, _ = self.makeLatex(astData)
-                    idx += 1
-
-                # 根据variation决定积分类型
-                integral_symbol = '\\int'
-                if tmpl.variation & 0x0002:  # tvINT_2 - 双重积分
-                    integral_symbol = '\\iint'
-                elif tmpl.variation & 0x0003:  # tvINT_3 - 三重积分
-                    integral_symbol = '\\iiint'
-                elif tmpl.variation & 0x0004:  # tvINT_LOOP - 环积分
-                    integral_symbol = '\\oint'
-
-                # 转成latex代码
-                mainStr = f'{{ {mainSlot} }}' if mainSlot else ''
-                lowerStr = f'_{{{lowerSlot}}}' if lowerSlot else ''
-                upperStr = f'^{{{upperSlot}}}' if upperSlot else ''
-
-                tmplStr = f'{integral_symbol}{lowerStr}{upperStr} {mainStr}'
-                buf += tmplStr
-                return buf, None
-            elif tmpl.selector == SelectorType.tmPROD:
-                # 乘积符号处理
-                mainSlot = ''
-                lowerSlot = ''
-                upperSlot = ''
-                idx = 0
-                for astData in ast.children:
-                    if idx == 0:
-                        mainSlot, _ = self.makeLatex(astData)
-                    elif idx == 1:
-                        lowerSlot, _ = self.makeLatex(astData)
-                    elif idx == 2:
-                        upperSlot, _ = self.makeLatex(astData)
-                    idx += 1
-
-                # 转成latex代码
-                mainStr = f'{{ {mainSlot} }}' if mainSlot else ''
-                lowerStr = f'\\limits_{{ {lowerSlot} }}' if lowerSlot else ''
-                upperStr = f'^{{ {upperSlot} }}' if upperSlot else ''
-
-                tmplStr = f'\\prod {lowerStr}{upperStr} {mainStr}'
-                buf += tmplStr
-                return buf, None
-            elif tmpl.selector == SelectorType.tmTILDE:
-                # 波浪号装饰
-                mainAST = ast.children[0] if ast.children else None
-                if mainAST:
-                    mainSlot, _ = self.makeLatex(mainAST)
-                    buf += f'\\tilde{{ {mainSlot} }}'
-                return buf, None
-            elif tmpl.selector == SelectorType.tmFLOOR:
-                # 向下取整 (floor brackets)
-                mainAST = ast.children[0] if ast.children else None
-                if mainAST:
-                    mainSlot, _ = self.makeLatex(mainAST)
-                    buf += f'\\lfloor {mainSlot} \\rfloor'
-                return buf, None
-            elif tmpl.selector == SelectorType.tmCEILING:
-                # 向上取整 (ceiling brackets)
-                mainAST = ast.children[0] if ast.children else None
-                if mainAST:
-                    mainSlot, _ = self.makeLatex(mainAST)
-                    buf += f'\\lceil {mainSlot} \\rceil'
-                return buf, None
-            elif tmpl.selector == SelectorType.tmDBAR:
-                # 双竖线 (double vertical bars)
-                mainAST = ast.children[0] if ast.children else None
-                if mainAST:
-                    mainSlot, _ = self.makeLatex(mainAST)
-                    buf += f'\\| {mainSlot} \\|'
-                return buf, None
-            elif tmpl.selector == SelectorType.tmINTOP:
-                # 积分样式大型操作符处理 (big integral-style operators)
-                mainSlot = ''
-                lowerSlot = ''
-                upperSlot = ''
-                operatorChar = ''
-
-                # 解析子对象 - BigOpBoxClass 的顺序：main slot, lower slot, upper slot, large operator character
-                idx = 0
-                for astData in ast.children:
-                    if idx == 0:  # main slot (被操作的表达式)
-                        mainSlot, _ = self.makeLatex(astData)
-                    elif idx == 1:  # lower slot (下限)
-                        lowerSlot, _ = self.makeLatex(astData)
-                    elif idx == 2:  # upper slot (上限)
-                        upperSlot, _ = self.makeLatex(astData)
-                    elif idx == 3:  # large operator character (大型操作符字符)
-                        operatorChar, _ = self.makeLatex(astData)
-                    idx += 1
-
-                # 根据variation决定限制的位置
-                # 0: tvUINTOP - upper limit
-                # 1: tvLINTOP - lower limit
-                # 2: tvBINTOP - both upper and lower limits
-
-                # 积分样式意味着限制放在操作符右侧，而非上下方
-                # 如果没有操作符字符，使用默认的积分样式操作符
-                if not operatorChar:
-                    operatorChar = '\\bigodot'  # 默认使用大圆点操作符
-
-                # 转成latex代码
-                mainStr = f'{{ {mainSlot} }}' if mainSlot else ''
-                lowerStr = f'_{{{lowerSlot}}}' if lowerSlot else ''
-                upperStr = f'^{{{upperSlot}}}' if upperSlot else ''
-
-                # 积分样式布局：操作符 + 上下标 + 被操作表达式
-                tmplStr = f'{operatorChar}{lowerStr}{upperStr} {mainStr}'
-                buf += tmplStr
-                return buf, None
-            else:
-                # self.Valid = False
-                buf = "latex tmpl not implement"  # 设置一个特殊字符方便在论文中定位
-                logger.warning('MTEF.makeLatex:TMPL NOT IMPLEMENT, %s, %s', tmpl.selector, tmpl.variation)
+            # self.Valid = False
+            tmpl = ast.value
+            buf = "latex tmpl not implement"  # 设置一个特殊字符方便在论文中定位
+            logger.warning('MTEF.makeLatex:TMPL NOT IMPLEMENT, %s, %s', tmpl.selector, tmpl.variation)
             for _ast in ast.children:
                 _latex, _ = self.makeLatex(_ast)
                 buf += _latex
@@ -1791,7 +1380,7 @@ class MTEF:
             return buf, None
         elif ast.tag == RecordType.EMBELL:
             embellType = ast.value.embellType
-            embellMapping = self.getEmbellMapping(is_v3=False)
+            embellMapping = EmbellMapping
 
             embellStr = embellMapping.get(embellType, "")
             if not embellStr:
@@ -1809,7 +1398,29 @@ class MTEF:
 
     def makeLatexV3(self, ast):
         """
-        为 MTEF v3 版本生成 LaTeX 代码
+        为 MTEF v3 版本生成 LaTeX 代码，开启子树记忆化时相同子树只渲染一次
+        """
+        if self.rendered is not None:
+            result = self.rendered.get(id(ast))
+            if result is not None:
+                return result
+
+        renderMemo = memo.renderMemo
+        if renderMemo is None or ast is None or ast.key is None or ast.tag not in memo.MemoTags:
+            return self.renderLatexV3(ast)
+
+        latex = renderMemo.get(ast.key)
+        if latex is not None:
+            return latex, None
+        generation = renderMemo.generation
+        latex, err = self.renderLatexV3(ast)
+        if err is None:
+            renderMemo.put(ast.key, latex, generation)
+        return latex, err
+
+    def renderLatexV3(self, ast):
+        """
+        渲染一个 v3 节点
         处理 v3 特有的模板选择器和变体代码
         """
         if ast is None:
@@ -1822,14 +1433,33 @@ class MTEF:
             if ast.value and ast.value.null:
                 return '', None
 
+            # 连续的上下标在生成时直接合并（X_{A}_{B} -> X_{A B}），
+            # 中间只隔着不产生输出的记录（如 SIZE 类记录）也视为相邻
             latex_parts = []
+            scripts = []
             if ast.children:
                 for child in ast.children:
+                    handler = None
+                    if child.tag == RecordTypeV3.TMPL and child.value:
+                        handler = TmplHandlersV3.get(child.value.selector)
+                    if handler is not None and handler.pieces is not None:
+                        pieces, err = handler.renderPieces(child, self.makeLatexV3)
+                        if err:
+                            return '', err
+                        if pieces is not None:
+                            scripts.extend(pieces)
+                            continue
+
                     child_latex, err = self.makeLatexV3(child)
                     if err:
                         return '', err
                     if child_latex:
+                        if scripts:
+                            latex_parts.append(mergeScripts(scripts))
+                            scripts = []
                         latex_parts.append(child_latex)
+            if scripts:
+                latex_parts.append(mergeScripts(scripts))
             return ''.join(latex_parts), None
 
         elif ast.tag == RecordTypeV3.CHAR:
@@ -1863,229 +1493,17 @@ class MTEF:
                 except:
                     return f'\\text{{{mtcode}}}', None
 
+        elif ast.tag == RecordTypeV3.CHAR_RUN:
+            return ast.value.text, None
+
         elif ast.tag == RecordTypeV3.TMPL:
             if not ast.value:
                 return '', None
 
-            tmpl = ast.value
-            selector = tmpl.selector
-            variation = tmpl.variation
-
-            # 处理各种模板类型
-            if selector == SelectorTypeV3.tmFRACT:  # 分数
-                if len(ast.children) >= 2:
-                    numerator, err = self.makeLatexV3(ast.children[0])
-                    if err:
-                        return '', err
-                    denominator, err = self.makeLatexV3(ast.children[1])
-                    if err:
-                        return '', err
-                    return f'\\frac{{{numerator}}}{{{denominator}}}', None
-
-            elif selector == SelectorTypeV3.tmSINT:  # 单积分
-                integral_symbol = '\\int'
-
-                # 在当前 AST 结构中，所有子节点都在一个列表中
-                # 需要根据实际内容智能分组
-                main_parts = []
-
-                if ast.children:
-                    for child in ast.children:
-                        child_latex, err = self.makeLatexV3(child)
-                        if err:
-                            return '', err
-                        if child_latex:
-                            main_parts.append(child_latex)
-
-                main_slot = ''.join(main_parts)
-
-                # 根据 variation 决定积分的样式
-                if variation == 0:  # tvNSINT - no limits
-                    return f'{integral_symbol} {main_slot}', None
-                elif variation == 1:  # tvLSINT - lower limit only
-                    # 对于这个变体，我们暂时简化处理
-                    return f'{integral_symbol} {main_slot}', None
-                elif variation == 2:  # tvBSINT - both limits
-                    return f'{integral_symbol} {main_slot}', None
-                elif variation == 3:  # tvNCINT - contour, no limits
-                    return f'\\oint {main_slot}', None
-                elif variation == 4:  # tvLCINT - contour, lower limit only
-                    return f'\\oint {main_slot}', None
-
-            elif selector == SelectorTypeV3.tmSCRIPT:  # 上下标
-                # 从调试中发现，上标模板通常有两个子节点
-                # 第一个子节点通常为空，第二个子节点包含实际内容
-                superscript_content = ''
-                subscript_content = ''
-
-                # 寻找非空的子节点作为上标或下标内容
-                for child in ast.children:
-                    child_latex, err = self.makeLatexV3(child)
-                    if err:
-                        return '', err
-                    if child_latex.strip():  # 非空内容
-                        if variation == 0:  # tvSUPER - superscript
-                            superscript_content = child_latex
-                        elif variation == 1:  # tvSUB - subscript
-                            subscript_content = child_latex
-                        break  # 找到第一个非空内容就停止
-
-                if variation == 0:  # tvSUPER - superscript
-                    return f'^{{{superscript_content}}}', None
-                elif variation == 1:  # tvSUB - subscript
-                    return f'_{{{subscript_content}}}', None
-                elif variation == 2:  # tvSUBSUP - both
-                    if len(ast.children) >= 2:
-                        subscript, err = self.makeLatexV3(ast.children[0])
-                        if err:
-                            return '', err
-                        superscript, err = self.makeLatexV3(ast.children[1])
-                        if err:
-                            return '', err
-                        return f'_{{{subscript}}}^{{{superscript}}}', None
-
-            elif selector == SelectorTypeV3.tmROOT:  # 根号
-                if variation == 0:  # tvSQROOT - square root
-                    if ast.children:
-                        radicand, err = self.makeLatexV3(ast.children[0])
-                        if err:
-                            return '', err
-                        return f'\\sqrt{{{radicand}}}', None
-                elif variation == 1:  # tvNTHROOT - nth root
-                    if len(ast.children) >= 2:
-                        main_slot, err = self.makeLatexV3(ast.children[0])
-                        if err:
-                            return '', err
-                        nth_slot, err = self.makeLatexV3(ast.children[1])
-                        if err:
-                            return '', err
-                        return f'\\sqrt[{nth_slot}]{{{main_slot}}}', None
-
-            elif selector == SelectorTypeV3.tmPAREN:  # 括号
-                if ast.children:
-                    content, err = self.makeLatexV3(ast.children[0])
-                    if err:
-                        return '', err
-
-                    if variation == 0:  # tvBPAREN - both left and right
-                        return f'\\left({content}\\right)', None
-                    elif variation == 1:  # tvLPAREN - left only
-                        return f'\\left({content}\\right.', None
-                    elif variation == 2:  # tvRPAREN - right only
-                        return f'\\left.{content}\\right)', None
-
-            elif selector == SelectorTypeV3.tmBRACK:  # 方括号
-                if ast.children:
-                    content, err = self.makeLatexV3(ast.children[0])
-                    if err:
-                        return '', err
-
-                    if variation == 0:  # tvBBRACK - both left and right
-                        return f'\\left[{content}\\right]', None
-                    elif variation == 1:  # tvLBRACK - left only
-                        return f'\\left[{content}\\right.', None
-                    elif variation == 2:  # tvRBRACK - right only
-                        return f'\\left.{content}\\right]', None
-
-            elif selector == SelectorTypeV3.tmBRACE:  # 花括号
-                if ast.children:
-                    content, err = self.makeLatexV3(ast.children[0])
-                    if err:
-                        return '', err
-
-                    if variation == 0:  # tvBBRACE - both left and right
-                        return f'\\left\\{{{content}\\right\\}}', None
-                    elif variation == 1:  # tvLBRACE - left only
-                        return f'\\left\\{{{content}\\right.', None
-                    elif variation == 2:  # tvRBRACE - right only
-                        return f'\\left.{content}\\right\\}}', None
-
-            elif selector == SelectorTypeV3.tmSUM:  # 求和
-                sum_symbol = '\\sum'
-                main_slot = ''
-                lower_slot = ''
-                upper_slot = ''
-
-                if ast.children:
-                    if len(ast.children) >= 1:
-                        main_slot, err = self.makeLatexV3(ast.children[0])
-                        if err:
-                            return '', err
-                    if len(ast.children) >= 2:
-                        upper_slot, err = self.makeLatexV3(ast.children[1])
-                        if err:
-                            return '', err
-                    if len(ast.children) >= 3:
-                        lower_slot, err = self.makeLatexV3(ast.children[2])
-                        if err:
-                            return '', err
-
-                if variation == 0:  # tvLSUM - lower only
-                    return f'{sum_symbol}_{{{lower_slot}}} {main_slot}', None
-                elif variation == 1:  # tvBSUM - both upper and lower limits
-                    return f'{sum_symbol}_{{{lower_slot}}}^{{{upper_slot}}} {main_slot}', None
-                elif variation == 2:  # tvNSUM - no limits
-                    return f'{sum_symbol} {main_slot}', None
-
-            elif selector == SelectorTypeV3.tmPROD:  # 乘积
-                prod_symbol = '\\prod'
-                main_slot = ''
-                lower_slot = ''
-                upper_slot = ''
-
-                if ast.children:
-                    if len(ast.children) >= 1:
-                        main_slot, err = self.makeLatexV3(ast.children[0])
-                        if err:
-                            return '', err
-                    if len(ast.children) >= 2:
-                        upper_slot, err = self.makeLatexV3(ast.children[1])
-                        if err:
-                            return '', err
-                    if len(ast.children) >= 3:
-                        lower_slot, err = self.makeLatexV3(ast.children[2])
-                        if err:
-                            return '', err
-
-                if variation == 0:  # tvLPROD - lower only
-                    return f'{prod_symbol}_{{{lower_slot}}} {main_slot}', None
-                elif variation == 1:  # tvBPROD - both upper and lower limits
-                    return f'{prod_symbol}_{{{lower_slot}}}^{{{upper_slot}}} {main_slot}', None
-                elif variation == 2:  # tvNPROD - no limits
-                    return f'{prod_symbol} {main_slot}', None
-            elif selector == SelectorTypeV3.tmLSCRIPT:  # 左上标和左下标
-                # 左上标和左下标的处理
-                if variation == 0:  # tvLSUPER - 左上标
-                    if ast.children:
-                        superscript_content = ''
-                        for child in ast.children:
-                            child_latex, err = self.makeLatexV3(child)
-                            if err:
-                                return '', err
-                            if child_latex.strip():
-                                superscript_content = child_latex
-                                break
-                        return f'{{}}^{{{superscript_content}}}', None
-                elif variation == 1:  # tvLSUB - 左下标
-                    if ast.children:
-                        subscript_content = ''
-                        for child in ast.children:
-                            child_latex, err = self.makeLatexV3(child)
-                            if err:
-                                return '', err
-                            if child_latex.strip():
-                                subscript_content = child_latex
-                                break
-                        return f"{{}}_{{{subscript_content}}}", None
-                elif variation == 2:  # tvLSUBSUP - 左上标和左下标
-                    if len(ast.children) >= 2:
-                        subscript, err = self.makeLatexV3(ast.children[0])
-                        if err:
-                            return '', err
-                        superscript, err = self.makeLatexV3(ast.children[1])
-                        if err:
-                            return '', err
-                        return f'{{}}_{{{subscript}}}^{{{superscript}}}', None
+            # 按selector分派到模板处理器，返回None表示不支持该variation
+            result = TmplHandlersV3.dispatch(self, ast, self.makeLatexV3)
+            if result is not None:
+                return result
 
             # 默认情况：处理未明确支持的模板
             latex_parts = []
@@ -2155,7 +1573,7 @@ class MTEF:
 
             embell = ast.value
             embell_type = embell.embellType
-            embellMapping = self.getEmbellMapping(is_v3=True)
+            embellMapping = EmbellMappingV3
 
             embellStr = embellMapping.get(embell_type, "")
             if not embellStr:
@@ -2198,12 +1616,51 @@ class MTEF:
                         latex_parts.append(child_latex)
             return ''.join(latex_parts), None
 
+    def flatten(self):
+        """
+        把 AST 压平为 FlatAST，用于批量驻留内存或在进程间传递
+        """
+        # flatast 与 array 只在压平时才需要，不计入导入耗时
+        from .flatast import FlatAST
+
+        return FlatAST.FromAST(self.ast, self.mMtefVer, self.Valid)
+
+    def fingerprint(self):
+        """
+        公式的规范摘要，只覆盖影响输出的内容（tag、selector、variation、typeface、mtcode 等），
+        nudge、SIZE/FULL/SUB、字体样式、颜色、EQN_PREFS 不同但输出相同的公式得到相同的值
+        """
+        if self.fingerprintDigest is None:
+            self.fingerprintDigest = self.flatten().digest()
+        return self.fingerprintDigest
+
+    @classmethod
+    def FromFlat(cls, flat):
+        """
+        由 FlatAST 构造可直接 Translate 的 MTEF，输出与原 AST 一致
+        """
+        eqn = cls()
+        eqn.mMtefVer = flat.version
+        eqn.Valid = flat.valid
+        eqn.ast = flat.root()
+        return eqn
+
     @classmethod
     def OpenBytes(cls, bts):
         return cls.Open(BytesIO(bts))
 
     @classmethod
     def Open(cls, reader):
+        body, err = cls.ReadEquationNative(reader)
+        if body is None:
+            return None, err
+        return cls.OpenBody(body)
+
+    @classmethod
+    def ReadEquationNative(cls, reader):
+        """
+        从 OLE 对象中取出 "Equation Native" 流去掉 28 字节头之后的 MTEF 数据
+        """
         ole, err = Ole.Open(reader)
         if err is not None:
             logger.error(err)
@@ -2234,83 +1691,29 @@ class MTEF:
                     # body from 'cbHdr' to 'cbHdr + cbSize'
                     reader.seek(cbHdr, 0)  # io.SeekStart
                     real_size = file.Size - oleCbHdr
-                    eqnBody = reader.read(real_size)
-                    eqn = MTEF()
-                    eqn.reader = BytesIO(eqnBody)
-
-                    eqn.readRecord()
-                    eqn.makeAST()
-                    return eqn, None
+                    return reader.read(real_size), None
 
                 return None, 'MTEF.Open: read byte error'
 
         return None, err
 
+    @classmethod
+    def OpenBody(cls, body):
+        """
+        解析 MTEF 数据（ReadEquationNative 的结果）
+        """
+        eqn = cls()
+        eqn.reader = BytesIO(body)
+
+        eqn.readRecord()
+        eqn.makeAST()
+        # AST 建好后不再需要原始数据
+        eqn.reader = None
+        return eqn, None
+
     def getEmbellMapping(self, is_v3=False):
         """
-        获取装饰类型到 LaTeX 符号的映射表
+        获取装饰类型到 LaTeX 符号的映射表（只读，模块级共享）
         is_v3: True表示V3版本，False表示V5版本
         """
-        if is_v3:
-            # MTEF V3 版本的装饰映射
-            return {
-                EmbellTypeV3.embDOT: "\\dot",
-                EmbellTypeV3.embDDOT: "\\ddot",
-                EmbellTypeV3.embTDOT: "\\dddot",
-                EmbellTypeV3.embPRIME: "'",
-                EmbellTypeV3.embDPRIME: "''",
-                EmbellTypeV3.embTPRIME: "'''",
-                EmbellTypeV3.embBPRIME: "^\\backprime",
-                EmbellTypeV3.embTILDE: "\\tilde",
-                EmbellTypeV3.embHAT: "\\hat",
-                EmbellTypeV3.embNOT: "\\not",
-                EmbellTypeV3.embRARROW: "\\overrightarrow",
-                EmbellTypeV3.embLARROW: "\\overleftarrow",
-                EmbellTypeV3.embBARROW: "\\overleftrightarrow",
-                EmbellTypeV3.embR1ARROW: "\\overrightarrow",  # 单倒钩箭头暂用普通箭头
-                EmbellTypeV3.embL1ARROW: "\\overleftarrow",   # 单倒钩箭头暂用普通箭头
-                EmbellTypeV3.embMBAR: "\\overline",  # 中高度横线暂用上划线
-                EmbellTypeV3.embOBAR: "\\overline",
-                EmbellTypeV3.embFROWN: "\\frown",
-                EmbellTypeV3.embSMILE: "\\smile",
-            }
-        else:
-            # MTEF V5 版本的装饰映射
-            return {
-                EmbellType.emb1DOT: "\\dot",
-                EmbellType.emb2DOT: "\\ddot",
-                EmbellType.emb3DOT: "\\dddot",
-                EmbellType.emb1PRIME: "'",
-                EmbellType.emb2PRIME: "''",
-                EmbellType.emb3PRIME: "'''",
-                EmbellType.embBPRIME: "^\\backprime",
-                EmbellType.embTILDE: "\\tilde",
-                EmbellType.embHAT: "\\hat",
-                EmbellType.embNOT: "\\not",
-                EmbellType.embRARROW: "\\overrightarrow",
-                EmbellType.embLARROW: "\\overleftarrow",
-                EmbellType.embBARROW: "\\overleftrightarrow",
-                EmbellType.embR1ARROW: "\\overrightarrow",  # 单倒钩箭头暂用普通箭头
-                EmbellType.embL1ARROW: "\\overleftarrow",   # 单倒钩箭头暂用普通箭头
-                EmbellType.embMBAR: "\\overline",  # 中高度横线暂用上划线
-                EmbellType.embOBAR: "\\overline",
-                EmbellType.embFROWN: "\\frown",
-                EmbellType.embSMILE: "\\smile",
-                EmbellType.embX_BARS: "\\cancel",  # 双对角线暂用取消线
-                EmbellType.embUP_BAR: "\\nearrow",  # 左下到右上对角线暂用箭头
-                EmbellType.embDOWN_BAR: "\\searrow",  # 左上到右下对角线暂用箭头
-                EmbellType.emb4DOT: "\\ddddot",  # 四点装饰需要特殊宏包
-                EmbellType.embU_1DOT: "\\underdot",  # 下单点
-                EmbellType.embU_2DOT: "\\underddot",  # 下双点
-                EmbellType.embU_3DOT: "\\underdddot",  # 下三点
-                EmbellType.embU_4DOT: "\\underddddot",  # 下四点
-                EmbellType.embU_BAR: "\\underline",
-                EmbellType.embU_TILDE: "\\undertilde",  # 下波浪线
-                EmbellType.embU_FROWN: "\\underfrown",  # 下弧线
-                EmbellType.embU_SMILE: "\\undersmile",  # 下弧线
-                EmbellType.embU_RARROW: "\\underrightarrow",  # 下右箭头
-                EmbellType.embU_LARROW: "\\underleftarrow",  # 下左箭头
-                EmbellType.embU_BARROW: "\\underleftrightarrow",  # 下双向箭头
-                EmbellType.embU_R1ARROW: "\\underrightarrow",  # 下右单倒钩箭头
-                EmbellType.embU_L1ARROW: "\\underleftarrow",   # 下左单倒钩箭头
-            }
+        return EmbellMappingV3 if is_v3 else EmbellMapping
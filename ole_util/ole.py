@@ -4,6 +4,7 @@ from .header import Header
 from .sector import Sector
 from .dir import File, FileType
 from .stream_reader import StreamReader
+from .source import ByteSource
 
 class Ole:
     def __init__(self):
@@ -19,7 +20,7 @@ class Ole:
         self.SSecID = []
         # Files    []File
         self.Files = []
-        # reader   io.ReadSeeker
+        # reader   *ByteSource //整个文件，按位置读取
         self.reader = None
 
     @classmethod
@@ -28,11 +29,13 @@ class Ole:
     
     @classmethod
     def Open(cls, reader, charset=None):
-        hbts = reader.read(512)
+        # 一次读入，之后各个流按位置读取，互不影响
+        source = ByteSource(reader.read())
+        hbts = source.readAt(0, 512)
         header, err = Header.parseHeader(hbts)
         if err == None:
             ole = Ole()
-            ole.reader = reader
+            ole.reader = source
             ole.header = header
             ole.Lsector = 512
             ole.Lssector = 64
@@ -128,12 +131,9 @@ class Ole:
 
     def sector_read_internal(self, sid, size):
         pos = self.sector_pos(sid, size)
-        index = self.reader.seek(pos, 0)
-        if index != -1:
-            bts = self.reader.read(size)
-            return Sector(bts), None
-        else:
+        if pos < 0:
             return None, 'bytes seek error'
+        return Sector(self.reader.readAt(pos, size)), None
 
     @classmethod
     def sector_pos(cls, sid, size):
@@ -0,0 +1,14 @@
+class ByteSource:
+    """
+    OLE 文件的全部字节，按位置读取、不保存读取位置，
+    同一 Ole 打开的多个 StreamReader 可以在不同线程中同时读取
+    """
+    def __init__(self, data):
+        # data []byte
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def readAt(self, pos, size):
+        return self.data[pos:pos+size]
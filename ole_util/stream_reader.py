@@ -3,12 +3,12 @@ from .helper import Helper
 DEBUG = False
 
 class StreamReader:
-    def __init__(self, sat=[], start=0, reader=None, offset_of_sector=0, offset_in_sector=0, size_sector = 0, size=0, offset=0, sector_pos=None):
+    def __init__(self, sat=None, start=0, reader=None, offset_of_sector=0, offset_in_sector=0, size_sector = 0, size=0, offset=0, sector_pos=None):
         # sat              []uint32
-        self.sat = sat
+        self.sat = sat if sat is not None else []
         # start            uint32
         self.start = start
-        # reader           io.ReadSeeker
+        # reader           *ByteSource | *StreamReader //ByteSource 按位置读取，StreamReader 为短流所在的流
         self.reader = reader
         # offset_of_sector uint32
         self.offset_of_sector = offset_of_sector
@@ -31,12 +31,11 @@ class StreamReader:
 
         ans = []
         pos = self.sector_pos(self.offset_of_sector, self.size_sector) + self.offset_in_sector
-        self.reader.seek(pos, 0)
         readed = 0
         reaminLen = read_size-readed
         while reaminLen > self.size_sector-self.offset_in_sector:
             to_read_size = self.size_sector-self.offset_in_sector
-            read_bytes = self.reader.read(self.size_sector-self.offset_in_sector)
+            read_bytes = self.readSource(pos, to_read_size)
             if read_bytes:
                 ans.append(read_bytes)
             if read_bytes is None or len(read_bytes) != to_read_size:
@@ -59,13 +58,12 @@ class StreamReader:
                 if self.offset_of_sector == Helper.ENDOFCHAIN:
                     return b''.join(ans)
                 pos = self.sector_pos(self.offset_of_sector, self.size_sector)+self.offset_in_sector
-                self.reader.seek(pos, 0)
                 # print("(DEBUG)StreamReader.Read.for.else:readed:%s" % readed)
                 # print("(DEBUG)StreamReader.Read.for.else:offset_of_sector:%s" % self.offset_of_sector)
 
             reaminLen = read_size-readed
 
-        read_bytes = self.reader.read(read_size-readed)
+        read_bytes = self.readSource(pos, read_size-readed)
         if read_bytes:
             ans.append(read_bytes)
         if read_bytes and len(read_bytes) == read_size-readed:
@@ -77,6 +75,14 @@ class StreamReader:
         else:
             return b''.join(ans)
 
+    def readSource(self, pos, size):
+        # 底层为 ByteSource 时按位置读取，不移动共享的读取位置
+        readAt = getattr(self.reader, 'readAt', None)
+        if readAt is not None:
+            return readAt(pos, size)
+        self.reader.seek(pos, 0)
+        return self.reader.read(size)
+
     def seek(self, offset, whence=0):
         if whence == 0:
             self.offset_of_sector = self.start
@@ -0,0 +1,322 @@
+"""
+可回收 worker 的进程池
+
+长期运行的 worker 内存会慢慢上涨（解析出的 MtAST、缓存、日志缓冲使堆碎片化），只能手工重启进程池。
+RecyclingPool 实现 concurrent.futures.Executor 接口，可以替换 ProcessPoolExecutor（MicroBatcher、
+batch.iterTranslate、serve、sidecar 都可以直接使用），额外提供两个上限：
+
+    pool = RecyclingPool(8, initializer=warmWorker, maxTasks=10000, maxRSS=512 << 20)
+
+maxTasks   每个 worker 执行的任务数上限
+maxRSS     worker 的常驻内存上限（字节），每个任务结束后读取 /proc/self/statm 检查
+
+每个 worker 同一时间只有一个任务。超过任一上限的 worker 先把当前任务的结果发回，然后退出，
+父进程随即启动新的 worker 接替，在途的任务不会丢失。worker 意外退出（如被 OOM killer 杀掉）时
+它正在执行的任务以 WorkerLost 失败，同样补齐 worker 数。
+
+补上的 worker 由后台线程 mtef-pool 启动，此时父进程中已有事件循环、线程池等多个线程，直接 fork
+可能继承其他线程持有的锁（日志、malloc、import 锁）而死锁。因此默认使用 forkserver（forkserverContext）：
+forkserver 是单线程的干净进程，预加载 warm 模块，所有 worker 都从它 fork。显式传入 fork 上下文时
+回收与补齐仍在后台线程中 fork，只适合没有其他线程的进程。
+
+worker fork 之前调用 prewarm(warmWorker)：加载全部翻译表，再 gc.freeze() 把此时的对象移出
+GC 的扫描范围。否则 worker 每次回收都要写遍这些对象的 GC 头，Chars 等大表所在的页面逐渐被
+写时复制，N 个 worker 各持一份。冻结后 worker 只在真正用到时因引用计数复制少量页面，
+启动时也没有建表开销。forkserver 导入 warm 模块时完成这一步；使用 fork 上下文时由调用方在父进程中调用。
+memoryInfo(pid) 读取 /proc/<pid>/smaps_rollup，uss 为 worker 独占的内存。
+"""
+import gc
+import os
+import threading
+from _thread import allocate_lock
+from collections import deque
+from concurrent.futures import Executor, Future
+import multiprocessing
+from multiprocessing.connection import wait
+
+# Linux 以外读取不到 /proc/self/statm 时为 0，不检查 RSS
+PageSize = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class WorkerLost(Exception):
+    pass
+
+
+class RecycleReason:
+    TASKS = 'tasks'
+    RSS = 'rss'
+    # worker 意外退出
+    LOST = 'lost'
+
+
+def rssBytes(pid='self'):
+    """
+    读取 /proc/<pid>/statm 的常驻页数，返回字节数；读取失败时返回 0
+    """
+    try:
+        with open('/proc/%s/statm' % pid, 'rb') as f:
+            return int(f.read().split()[1]) * PageSize
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def memoryInfo(pid='self'):
+    """
+    返回 {'rss', 'pss', 'uss'}（字节）；uss 为 Private_Clean + Private_Dirty，读取失败时为空字典
+    """
+    fields = {}
+    try:
+        with open('/proc/%s/smaps_rollup' % pid, 'rb') as f:
+            for line in f:
+                name, _, value = line.partition(b':')
+                if name in (b'Rss', b'Pss', b'Private_Clean', b'Private_Dirty'):
+                    fields[name.decode()] = int(value.split()[0]) << 10
+    except (OSError, ValueError):
+        return {}
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'uss': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def prewarm(initializer=None, initargs=(), freeze=True):
+    """
+    fork worker 之前在父进程中调用：执行 initializer（通常为 serve.warmWorker）、导入 worker 用到的模块，
+    然后 gc.freeze()；worker 继承冻结的对象，不再因 GC 扫描复制这些页面
+    """
+    from . import batch, microbatch  # noqa: F401
+
+    if initializer is not None:
+        initializer(*initargs)
+    if freeze and hasattr(gc, 'freeze'):
+        gc.collect()
+        gc.freeze()
+
+
+def forkserverContext(preload=None):
+    """
+    返回 forkserver 上下文，forkserver 启动时导入 preload（默认为 warm 模块，建表并 gc.freeze）；
+    不支持 forkserver 的平台返回默认上下文。set_forkserver_preload 对整个进程生效，且只在 forkserver 启动前有效
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context()
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(preload or ['%s.warm' % (__package__ or 'mtef')])
+    return context
+
+
+def workerMain(conn, initializer, initargs, maxTasks, maxRSS):
+    if initializer is not None:
+        initializer(*initargs)
+    tasks = 0
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+        fn, args, kwargs = message
+        try:
+            ok, value = True, fn(*args, **kwargs)
+        except BaseException as exc:
+            ok, value = False, exc
+        tasks += 1
+        rss = rssBytes() if maxRSS else 0
+        reason = None
+        if maxTasks and tasks >= maxTasks:
+            reason = RecycleReason.TASKS
+        elif maxRSS and rss > maxRSS:
+            reason = RecycleReason.RSS
+        try:
+            conn.send((ok, value, reason, rss))
+        except Exception as exc:
+            # 结果或异常无法 pickle
+            conn.send((False, WorkerLost('%s: %s' % (type(exc).__name__, exc)), reason, rss))
+        if reason is not None:
+            break
+    conn.close()
+
+
+class worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        # task (Future, fn, args, kwargs) //正在执行的任务，空闲时为 None
+        self.task = None
+        self.tasks = 0
+        self.rss = 0
+
+
+class RecyclingPool(Executor):
+    def __init__(self, workers=None, initializer=None, initargs=(), maxTasks=None, maxRSS=None, context=None):
+        # workers int //进程数，默认为 CPU 核数
+        self.workers = workers or os.cpu_count() or 1
+        # _max_workers int //与 ProcessPoolExecutor 一致，MicroBatcher、batch 据此决定在途任务数
+        self._max_workers = self.workers
+        self.initializer = initializer
+        self.initargs = initargs
+        # maxTasks int //每个 worker 的任务数上限，None 表示不限
+        self.maxTasks = maxTasks
+        # maxRSS int //worker 常驻内存上限（字节），None 表示不限
+        self.maxRSS = maxRSS
+        # context //默认为 forkserverContext()，补上的 worker 不从多线程的父进程 fork
+        self.context = context or forkserverContext()
+
+        self.lock = allocate_lock()
+        # pending deque[(Future, fn, args, kwargs)]
+        self.pending = deque()
+        self.closing = False
+        self.cancelPending = False
+        # recycled map[RecycleReason]int
+        self.recycled = {}
+        self.started = 0
+
+        self.wakeRead, self.wakeWrite = os.pipe()
+        self.pool = [self.spawn() for _ in range(self.workers)]
+        self.manager = threading.Thread(target=self.manage, name='mtef-pool', daemon=True)
+        self.manager.start()
+
+    def spawn(self):
+        parent, child = self.context.Pipe()
+        process = self.context.Process(
+            target=workerMain, args=(child, self.initializer, self.initargs, self.maxTasks, self.maxRSS),
+            daemon=True)
+        process.start()
+        child.close()
+        self.started += 1
+        return worker(process, parent)
+
+    def wake(self):
+        try:
+            os.write(self.wakeWrite, b'\0')
+        except OSError:
+            pass
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        with self.lock:
+            if self.closing:
+                raise RuntimeError('cannot schedule new futures after shutdown')
+            self.pending.append((future, fn, args, kwargs))
+        self.wake()
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self.lock:
+            self.closing = True
+            self.cancelPending = self.cancelPending or cancel_futures
+        self.wake()
+        if wait:
+            self.manager.join()
+
+    def assign(self):
+        """
+        把排队的任务交给空闲的 worker
+        """
+        for w in self.pool:
+            if w.task is not None:
+                continue
+            while True:
+                with self.lock:
+                    if not self.pending:
+                        return
+                    task = self.pending.popleft()
+                # 因 worker 退出而放回队列的任务已经是 running
+                if not task[0].running() and not task[0].set_running_or_notify_cancel():
+                    continue
+                try:
+                    w.conn.send(task[1:])
+                except OSError:
+                    # worker 已经退出（管道断开）：任务放回队首，换上新的 worker 后重新分配
+                    with self.lock:
+                        self.pending.appendleft(task)
+                    self.replace(w, RecycleReason.LOST)
+                    self.wake()
+                    break
+                except Exception as exc:
+                    # 函数或参数无法 pickle
+                    task[0].set_exception(exc)
+                    continue
+                w.task = task
+                break
+
+    def replace(self, w, reason):
+        self.recycled[reason] = self.recycled.get(reason, 0) + 1
+        w.conn.close()
+        w.process.join()
+        self.pool[self.pool.index(w)] = self.spawn()
+
+    def receive(self, w):
+        future = w.task[0]
+        w.task = None
+        try:
+            ok, value, reason, rss = w.conn.recv()
+        except (EOFError, OSError):
+            w.process.join(1)
+            future.set_exception(WorkerLost('worker %d exited (code %s)' % (w.process.pid, w.process.exitcode)))
+            self.replace(w, RecycleReason.LOST)
+            return
+        w.tasks += 1
+        w.rss = rss
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+        if reason is not None:
+            # worker 发回结果后已经退出
+            self.replace(w, reason)
+
+    def manage(self):
+        while True:
+            self.assign()
+            with self.lock:
+                closing = self.closing
+                if closing and self.cancelPending:
+                    while self.pending:
+                        self.pending.popleft()[0].cancel()
+                idle = not self.pending
+            if closing and idle and all(w.task is None for w in self.pool):
+                break
+
+            ready = wait([self.wakeRead] + [w.conn for w in self.pool])
+            for item in ready:
+                if item == self.wakeRead:
+                    os.read(self.wakeRead, 4096)
+                    continue
+                for w in self.pool:
+                    if w.conn is item:
+                        if w.task is None:
+                            # 空闲的 worker 不会发送数据，可读说明已经退出
+                            self.replace(w, RecycleReason.LOST)
+                        else:
+                            self.receive(w)
+                        break
+
+        for w in self.pool:
+            try:
+                w.conn.send(None)
+            except OSError:
+                pass
+        for w in self.pool:
+            w.process.join()
+            w.conn.close()
+        os.close(self.wakeRead)
+        os.close(self.wakeWrite)
+
+    def workerRSS(self):
+        """
+        返回 {pid: 常驻内存字节数}，由父进程读取 /proc/<pid>/statm
+        """
+        return {w.process.pid: rssBytes(w.process.pid) for w in self.pool}
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'started': self.started,
+            'recycled': dict(self.recycled),
+            'pending': len(self.pending),
+            'busy': sum(1 for w in self.pool if w.task is not None),
+            'rss': self.workerRSS(),
+        }
@@ -21,6 +21,8 @@ class RecordType:
     EQN_PREFS = 18
     ENCODING_DEF = 19
     FUTURE = 100
+    # 解析后合并的连续 CHAR，不是 MTEF 记录
+    CHAR_RUN = 254
     ROOT = 255
 
 
@@ -41,6 +43,8 @@ class RecordTypeV3:
     SUB2 = 12
     SYM = 13
     SUBSYM = 14
+    # 解析后合并的连续 CHAR，不是 MTEF 记录
+    CHAR_RUN = 254
 
 
 class OptionType:
@@ -99,6 +103,8 @@ class CharTypeface:
 
 
 class MtTabStop:
+    __slots__ = ('next', '_type', 'offset')
+
     def __init__(self):
         # next   *MtTabStop
         self.next = None
@@ -109,6 +115,8 @@ class MtTabStop:
 
 
 class MtRuler:
+    __slots__ = ('nStops', 'tabStopList')
+
     def __init__(self):
         # nStops      int16
         self.nStops = 0
@@ -117,6 +125,8 @@ class MtRuler:
 
 
 class MtLine:
+    __slots__ = ('nudgeX', 'nudgeY', 'lineSpace', 'null', 'ruler', 'objectList')
+
     def __init__(self):
         # nudgeX     int16
         self.nudgeX = 0
@@ -133,6 +143,8 @@ class MtLine:
 
 
 class MtEmbell:
+    __slots__ = ('next', 'nudgeX', 'nudgeY', 'embell')
+
     def __init__(self):
         # next   *MtEmbell
         self.next = None
@@ -145,6 +157,8 @@ class MtEmbell:
 
 
 class MtChar:
+    __slots__ = ('nudgeX', 'nudgeY', 'options', 'typeface', 'mtcode', 'bits8', 'bits16', 'embellishments')
+
     def __init__(self):
         # nudgeX   int16
         self.nudgeX = 0
@@ -165,11 +179,15 @@ class MtChar:
 
 
 class MTCharV3:
+    __slots__ = ('nudgeX', 'nudgeY', 'options', 'typeface', 'mtcode', 'bits8', 'bits16', 'embellishments')
+
     def __init__(self):
         # nudgeX   int16
         self.nudgeX = 0
         # nudgeY   int16
         self.nudgeY = 0
+        # options  uint8 //tag 字节的高4位
+        self.options = 0
         # typeface uint8
         self.typeface = 0
         # mtcode uint16 //16-bit integer MTCode value
@@ -182,7 +200,19 @@ class MTCharV3:
         self.embellishments = None
 
 
+class MtCharRun:
+    __slots__ = ('typeface', 'text')
+
+    def __init__(self, typeface=0, text=''):
+        # typeface uint8
+        self.typeface = typeface
+        # text string //每个字符即一个 mtcode
+        self.text = text
+
+
 class MtEqnPrefs:
+    __slots__ = ('sizes', 'spaces', 'styles')
+
     def __init__(self):
         # sizes  []string
         self.sizes = []
@@ -193,6 +223,8 @@ class MtEqnPrefs:
 
 
 class MtSize:
+    __slots__ = ('lsize', 'dsize')
+
     def __init__(self):
         # lsize uint8
         self.lsize = 0
@@ -201,6 +233,8 @@ class MtSize:
 
 
 class MtfontStyleDef:
+    __slots__ = ('fontDefIndex', 'name')
+
     def __init__(self):
         # fontDefIndex uint8
         self.fontDefIndex = 0
@@ -209,6 +243,8 @@ class MtfontStyleDef:
 
 
 class MtfontDef:
+    __slots__ = ('encDefIndex', 'name')
+
     def __init__(self):
         # encDefIndex uint8
         self.encDefIndex = 0
@@ -217,12 +253,16 @@ class MtfontDef:
 
 
 class MtColorDefIndex:
+    __slots__ = ('index',)
+
     def __init__(self):
         # index uint8
         self.index = 0
 
 
 class MtColorDef:
+    __slots__ = ('values', 'name')
+
     def __init__(self):
         # values []uint8
         self.values = []
@@ -231,6 +271,8 @@ class MtColorDef:
 
 
 class MtObjList:
+    __slots__ = ('next', 'tag', 'objPtr')
+
     def __init__(self):
         # next   *MtObjList
         self.next = None
@@ -241,6 +283,8 @@ class MtObjList:
 
 
 class MtTmpl:
+    __slots__ = ('nudgeX', 'nudgeY', 'selector', 'variation', 'options', 'objectList')
+
     def __init__(self):
         # nudgeX     int16
         self.nudgeX = 0
@@ -257,6 +301,8 @@ class MtTmpl:
 
 
 class MtPile:
+    __slots__ = ('nudgeX', 'nudgeY', 'halign', 'valign', 'ruler', 'objectList')
+
     def __init__(self):
         # nudgeX int16
         self.nudgeX = 0
@@ -275,6 +321,8 @@ class MtPile:
 
 
 class MtMatrix:
+    __slots__ = ('nudgeX', 'nudgeY', 'valign', 'h_just', 'v_just', 'rows', 'cols', 'objectList')
+
     def __init__(self):
         # nudgeX int16
         self.nudgeX = 0
@@ -300,6 +348,8 @@ class MtMatrix:
 
 
 class MtEmbellRd:
+    __slots__ = ('options', 'nudgeX', 'nudgeY', 'embellType')
+
     def __init__(self):
         # options    uint8
         self.options = 0
@@ -312,7 +362,9 @@ class MtEmbellRd:
 
 
 class MtAST:
-    def __init__(self, tag=0, value=None, children=[]):
+    __slots__ = ('tag', 'value', 'children', 'key')
+
+    def __init__(self, tag=0, value=None, children=None):
         # tag      RecordType
         self.tag = tag
         # value    MtObject
@@ -322,6 +374,8 @@ class MtAST:
             self.children = children
         else:
             self.children = []
+        # key tuple //子树结构键，开启子树记忆化时建树过程中设置（见 memo.py）
+        self.key = None
 
     def debug(indent):
         """
@@ -337,6 +391,8 @@ class MtAST:
 
 
 class MtObject:
+    __slots__ = ()
+
     def __init__(self):
         pass
 
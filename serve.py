@@ -0,0 +1,512 @@
+"""
+HTTP 翻译服务
+
+只依赖标准库（asyncio），翻译在预热好的进程池中执行：
+
+    python -m mtef.serve [--host 127.0.0.1] [--port 8080] [--workers N] [--max-body MB]
+
+接口（profile 可通过 ?profile=compact 指定）：
+
+    POST /translate   请求体为 OLE 公式对象（.bin）、"Equation Native" 流、MTEF 数据或 docx
+                      单个公式返回 {"ok", "latex"} 或 {"ok": false, "kind", "error"}，
+                      docx 返回 {"results": [...]}（按文档顺序）
+    POST /batch       {"items": ["<base64>", ...]}，每项可为上述任意单个公式格式；也接受 docx
+    GET  /health      进程池可用时返回 200
+    GET  /metrics     请求数、公式数、失败类别、延迟分位数
+
+请求体或 docx 解压后的总大小超过 --max-body 返回 413，单次请求的公式数超过 --max-items 返回 413，
+超过 --timeout 返回 504。
+公式经 microbatch.MicroBatcher 攒批后提交（--batch-size、--batch-delay）；等待组批的请求超过 --queue 时
+按 --overload 等待或返回 503。/translate 的单个公式走交互通道，/batch 与 docx 走批量通道，
+可用 ?lane=interactive|bulk 指定；--reserved 个在途批名额只留给交互通道，/metrics 给出各通道的延迟。
+--max-tasks 或 --max-rss 时使用 pool.RecyclingPool，超过上限的 worker 在完成当前任务后被替换。
+测试时可以在本地起服务，用 http.client 访问：
+
+    server = Server(workers=2)
+    await server.start('127.0.0.1', 0)
+    port = server.port
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import json
+import os
+import sys
+import time
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+from .batch import translateOne, translateBody
+from .cache import FailureKind
+from .microbatch import MicroBatcher, Overloaded, Policy, Lane, defaultLanes
+from .minify import OutputProfile
+
+OleMagic = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+ZipMagic = b'PK\x03\x04'
+# "Equation Native" 流的头长度
+NativeHeaderSize = 28
+
+# 每个 executor 任务包含的公式数上限
+ChunkSize = 64
+
+Reasons = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 411: 'Length Required',
+    413: 'Payload Too Large', 422: 'Unprocessable Entity', 500: 'Internal Server Error',
+    503: 'Service Unavailable', 504: 'Gateway Timeout',
+}
+
+
+def splitInput(bts, maxItems=None, maxBytes=64 << 20):
+    """
+    识别输入格式，返回 ([](mode, bytes), isDocument, err)；mode 为 'ole' 或 'body'，
+    maxBytes 限制 docx 解压后的总字节数
+    """
+    if bts.startswith(OleMagic):
+        return [('ole', bts)], False, None
+    if bts.startswith(ZipMagic):
+        from .docx import readEquations
+
+        objects, err = readEquations(bts, maxItems, maxBytes)
+        if err is not None:
+            return None, True, err
+        return [('ole', obj) for obj in objects], True, None
+    if len(bts) >= NativeHeaderSize and int.from_bytes(bts[:2], 'little') == NativeHeaderSize:
+        cbSize = int.from_bytes(bts[8:12], 'little')
+        body = bts[NativeHeaderSize:]
+        if 0 < cbSize <= len(body):
+            body = body[:cbSize]
+        return [('body', body)], False, None
+    if bts[:1] in (b'\x03', b'\x04', b'\x05'):
+        return [('body', bts)], False, None
+    return None, False, 'unrecognized input: expected OLE, Equation Native, MTEF or docx'
+
+
+def translateInputs(items, profile=OutputProfile.DEFAULT):
+    """
+    worker 中执行：翻译 [(mode, bytes)]，返回 [(latex, kind, error)]
+    """
+    return [translateOne(bts, profile) if mode == 'ole' else translateBody(bts, profile) for mode, bts in items]
+
+
+def warmWorker():
+    """
+    worker 初始化：编译字符表、加载模板，第一个请求不再承担这些开销
+    """
+    from .chartable import loadCharTables
+    from . import mtef  # noqa: F401
+
+    loadCharTables()
+
+
+def ping():
+    return os.getpid()
+
+
+def createPool(workers, maxTasks=None, maxRSS=None, freeze=True):
+    """
+    创建预热的进程池；设置了 maxTasks 或 maxRSS 时使用可回收 worker 的 RecyclingPool，
+    worker 由预加载了翻译表的 forkserver 启动（pool.forkserverContext）。
+    ProcessPoolExecutor 使用 fork 时先在父进程中建好全部表并 gc.freeze()（pool.prewarm），worker 共享这些页面
+    """
+    import multiprocessing
+    from .pool import prewarm
+
+    if maxTasks or maxRSS:
+        from .pool import RecyclingPool
+        return RecyclingPool(workers, initializer=warmWorker, maxTasks=maxTasks, maxRSS=maxRSS)
+    if multiprocessing.get_start_method() == 'fork':
+        prewarm(warmWorker, freeze=freeze)
+    from concurrent.futures import ProcessPoolExecutor
+    return ProcessPoolExecutor(max_workers=workers, initializer=warmWorker)
+
+
+def resultJSON(item):
+    latex, kind, error = item
+    if kind is None:
+        return {'ok': True, 'latex': latex}
+    return {'ok': False, 'kind': kind, 'error': error}
+
+
+class Metrics:
+    def __init__(self, window=2048):
+        self.started = time.time()
+        # requests map[route]int
+        self.requests = {}
+        # statuses map[int]int
+        self.statuses = {}
+        self.equations = 0
+        # failures map[FailureKind]int
+        self.failures = {}
+        self.inflight = 0
+        # latencies map[route]deque[float] //最近 window 次请求的耗时（秒）
+        self.latencies = {}
+        self.window = window
+
+    def observe(self, route, status, elapsed):
+        self.requests[route] = self.requests.get(route, 0) + 1
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        latencies = self.latencies.get(route)
+        if latencies is None:
+            latencies = self.latencies[route] = deque(maxlen=self.window)
+        latencies.append(elapsed)
+
+    def count(self, results):
+        self.equations += len(results)
+        for _, kind, _ in results:
+            if kind is not None:
+                self.failures[kind] = self.failures.get(kind, 0) + 1
+
+    def snapshot(self):
+        latency = {}
+        for route, values in self.latencies.items():
+            ordered = sorted(values)
+            latency[route] = {
+                'p50': ordered[len(ordered) // 2] * 1e3,
+                'p90': ordered[int(len(ordered) * 0.9)] * 1e3,
+                'p99': ordered[int(len(ordered) * 0.99)] * 1e3,
+            }
+        return {
+            'uptime': time.time() - self.started,
+            'requests': self.requests,
+            'statuses': {str(status): count for status, count in self.statuses.items()},
+            'equations': self.equations,
+            'failures': self.failures,
+            'inflight': self.inflight,
+            'latencyMs': latency,
+        }
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=''):
+        super().__init__(message)
+        self.status = status
+        self.message = message or Reasons.get(status, '')
+
+
+class Server:
+    def __init__(self, workers=None, maxBody=16 << 20, maxItems=10000, timeout=30.0, concurrency=None, executor=None,
+                 batchSize=64, batchDelay=0.002, maxQueue=4096, overload=Policy.WAIT, reserved=None, strict=False,
+                 maxTasks=None, maxRSS=None):
+        # workers int //进程池大小，默认为 CPU 核数
+        self.workers = workers or os.cpu_count() or 1
+        # maxBody int //请求体字节上限
+        self.maxBody = maxBody
+        # maxItems int //单次请求的公式数上限
+        self.maxItems = maxItems
+        # timeout float //单次请求的超时（秒）
+        self.timeout = timeout
+        # concurrency int //同时提交给进程池的任务数上限
+        self.concurrency = concurrency or 2 * self.workers
+        self.executor = executor
+        self.owned = executor is None
+        self.semaphore = None
+        # batcher *MicroBatcher //单个公式的请求，batchSize 为 0 时不攒批
+        self.batcher = None
+        self.batchSize = batchSize
+        self.batchDelay = batchDelay
+        self.maxQueue = maxQueue
+        self.overload = overload
+        # reserved int //只给交互通道的在途批名额，默认为 worker 数的 1/4（至少 1）
+        self.reserved = max(1, self.workers // 4) if reserved is None else reserved
+        self.strict = strict
+        # maxTasks int //每个 worker 的任务数上限
+        self.maxTasks = maxTasks
+        # maxRSS int //worker 常驻内存上限（字节）
+        self.maxRSS = maxRSS
+        self.server = None
+        self.metrics = Metrics()
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    async def prewarm(self):
+        """
+        启动全部 worker 并完成初始化
+        """
+        if self.executor is None:
+            self.executor = createPool(self.workers, self.maxTasks, self.maxRSS)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, ping) for _ in range(self.workers)])
+
+    async def start(self, host='127.0.0.1', port=8080):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        await self.prewarm()
+        if self.batchSize > 0:
+            lanes = defaultLanes(self.batchSize, self.batchDelay, self.maxQueue)
+            # 单次 /batch 请求的公式可以全部入队
+            lanes[Lane.BULK].maxQueue = max(self.maxQueue, self.maxItems)
+            self.batcher = MicroBatcher(self.executor, maxInflight=self.concurrency, policy=self.overload,
+                                        lanes=lanes, strict=self.strict, reserved=self.reserved)
+            await self.batcher.start()
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.batcher is not None:
+            await self.batcher.close()
+            self.batcher = None
+        if self.owned and self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def run(self, items, profile, lane=Lane.BULK):
+        """
+        提交给进程池，返回与输入顺序一致的 [(latex, kind, error)]
+        """
+        if self.batcher is not None:
+            try:
+                results = await asyncio.wait_for(self.batcher.submitMany(items, profile, lane), self.timeout)
+            except asyncio.TimeoutError:
+                raise HTTPError(504, 'timed out after %gs' % self.timeout)
+            except Overloaded as err:
+                raise HTTPError(503, str(err))
+            self.metrics.count(results)
+            return results
+
+        loop = asyncio.get_running_loop()
+
+        async def runChunk(chunk):
+            async with self.semaphore:
+                return await loop.run_in_executor(self.executor, translateInputs, chunk, profile)
+
+        chunks = [items[i:i + ChunkSize] for i in range(0, len(items), ChunkSize)]
+        try:
+            parts = await asyncio.wait_for(asyncio.gather(*[runChunk(chunk) for chunk in chunks]), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(504, 'timed out after %gs' % self.timeout)
+        results = [item for part in parts for item in part]
+        self.metrics.count(results)
+        return results
+
+    async def translate(self, body, profile, lane=None):
+        # docx 解压后的总大小同样以 maxBody 为上限
+        items, document, err = splitInput(body, self.maxItems, self.maxBody)
+        if err is not None:
+            raise HTTPError(413 if 'more than' in err else 400, err)
+        results = await self.run(items, profile, lane or (Lane.BULK if document else Lane.INTERACTIVE))
+        if document:
+            return 200, {'results': [resultJSON(item) for item in results]}
+        result = resultJSON(results[0])
+        return (200 if result['ok'] else 422), result
+
+    async def batch(self, body, profile, lane=None):
+        lane = lane or Lane.BULK
+        if body.startswith(ZipMagic):
+            return await self.translate(body, profile, lane)
+        try:
+            request = json.loads(body)
+            encoded = request['items']
+            profile = request.get('profile', profile)
+        except (ValueError, TypeError, KeyError):
+            raise HTTPError(400, 'expected {"items": ["<base64>", ...]}')
+        if not isinstance(encoded, list):
+            raise HTTPError(400, 'items must be a list')
+        if len(encoded) > self.maxItems:
+            raise HTTPError(413, 'more than %d items' % self.maxItems)
+        if profile not in (OutputProfile.DEFAULT, OutputProfile.COMPACT):
+            raise HTTPError(400, 'unknown profile: %s' % profile)
+
+        items = []
+        # errors map[index]error //无法识别的项不交给进程池
+        errors = {}
+        for index, text in enumerate(encoded):
+            try:
+                bts = base64.b64decode(text, validate=True)
+            except (binascii.Error, TypeError, ValueError):
+                errors[index] = 'invalid base64'
+                continue
+            found, document, err = splitInput(bts, maxBytes=self.maxBody)
+            if err is None and document:
+                err = 'docx is not allowed inside a batch'
+            if err is not None:
+                errors[index] = err
+            else:
+                items.append(found[0])
+
+        translated = iter(await self.run(items, profile, lane))
+        results = []
+        for index in range(len(encoded)):
+            if index in errors:
+                results.append(resultJSON(('', FailureKind.INVALID, errors[index])))
+            else:
+                results.append(resultJSON(next(translated)))
+        return 200, {'results': results}
+
+    async def health(self):
+        if self.batcher is not None and self.batcher.broken is not None:
+            return 503, {'status': 'unavailable', 'error': self.batcher.broken}
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(loop.run_in_executor(self.executor, ping), 5)
+        except Exception as err:
+            return 503, {'status': 'unavailable', 'error': str(err) or type(err).__name__}
+        return 200, {'status': 'ok', 'workers': self.workers}
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        profile = query.get('profile', [OutputProfile.DEFAULT])[0]
+        if profile not in (OutputProfile.DEFAULT, OutputProfile.COMPACT):
+            raise HTTPError(400, 'unknown profile: %s' % profile)
+        lane = query.get('lane', [None])[0]
+        if lane not in (None, Lane.INTERACTIVE, Lane.BULK):
+            raise HTTPError(400, 'unknown lane: %s' % lane)
+
+        route = url.path
+        if route in ('/translate', '/batch'):
+            if method != 'POST':
+                raise HTTPError(405)
+            if route == '/translate':
+                return await self.translate(body, profile, lane)
+            return await self.batch(body, profile, lane)
+        if route in ('/health', '/metrics'):
+            if method != 'GET':
+                raise HTTPError(405)
+            if route == '/health':
+                return await self.health()
+            snapshot = self.metrics.snapshot()
+            if self.batcher is not None:
+                snapshot['batcher'] = self.batcher.stats()
+            if hasattr(self.executor, 'stats'):
+                snapshot['pool'] = self.executor.stats()
+            return 200, snapshot
+        raise HTTPError(404)
+
+    async def readRequest(self, reader, writer):
+        """
+        读取一个请求，返回 (method, target, headers, body)；连接关闭时返回 None
+        """
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, 'bad request line')
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+            if len(headers) > 100:
+                raise HTTPError(400, 'too many headers')
+        headers[':version'] = version
+
+        body = b''
+        if method == 'POST':
+            if 'content-length' not in headers:
+                raise HTTPError(411)
+            try:
+                length = int(headers['content-length'])
+            except ValueError:
+                raise HTTPError(400, 'bad content-length')
+            expectContinue = headers.get('expect', '').lower() == '100-continue'
+            if length < 0 or length > self.maxBody:
+                # 不超过上限 4 倍时读完丢弃，客户端能正常收到 413；再大的直接断开
+                if not expectContinue and 0 < length <= 4 * self.maxBody:
+                    while length > 0:
+                        chunk = await reader.read(min(length, 1 << 16))
+                        if not chunk:
+                            break
+                        length -= len(chunk)
+                raise HTTPError(413, 'body larger than %d bytes' % self.maxBody)
+            if expectContinue:
+                writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            body = await reader.readexactly(length)
+        return method, target, headers, body
+
+    def writeResponse(self, writer, status, payload, keepAlive):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        head = 'HTTP/1.1 %d %s\r\nContent-Type: application/json; charset=utf-8\r\nContent-Length: %d\r\n' % (
+            status, Reasons.get(status, ''), len(data))
+        if not keepAlive:
+            head += 'Connection: close\r\n'
+        writer.write(head.encode('latin-1') + b'\r\n' + data)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                start = time.perf_counter()
+                route = '-'
+                try:
+                    request = await self.readRequest(reader, writer)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    route = urlsplit(target).path
+                    connection = headers.get('connection', '').lower()
+                    keepAlive = connection != 'close' and (headers[':version'] != 'HTTP/1.0' or connection == 'keep-alive')
+                    self.metrics.inflight += 1
+                    try:
+                        status, payload = await self.dispatch(method, target, body)
+                    finally:
+                        self.metrics.inflight -= 1
+                except HTTPError as err:
+                    # 请求体可能没有读完，回复后关闭连接
+                    status, payload, keepAlive = err.status, {'error': err.message}, False
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as err:
+                    status, payload, keepAlive = 500, {'error': '%s: %s' % (type(err).__name__, err)}, False
+
+                self.writeResponse(writer, status, payload, keepAlive)
+                await writer.drain()
+                # 路由之前就被拒绝的请求（400、411、413）与未知路径都记在 '-' 下
+                if route not in ('/translate', '/batch', '/health', '/metrics'):
+                    route = '-'
+                self.metrics.observe(route, status, time.perf_counter() - start)
+                if not keepAlive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(args):
+    server = Server(args.workers, args.max_body << 20, args.max_items, args.timeout,
+                    batchSize=args.batch_size, batchDelay=args.batch_delay / 1e3, maxQueue=args.queue,
+                    overload=args.overload, reserved=args.reserved, strict=args.strict,
+                    maxTasks=args.max_tasks, maxRSS=args.max_rss << 20 if args.max_rss else None)
+    await server.start(args.host, args.port)
+    print('listening on http://%s:%d (%d workers)' % (args.host, server.port, server.workers), file=sys.stderr)
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='%s.serve' % (__package__ or 'mtef'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=None, help='进程池大小，默认为 CPU 核数')
+    parser.add_argument('--max-body', type=int, default=16, help='请求体上限（MB）')
+    parser.add_argument('--max-items', type=int, default=10000, help='单次请求的公式数上限')
+    parser.add_argument('--timeout', type=float, default=30.0, help='单次请求的超时（秒）')
+    parser.add_argument('--batch-size', type=int, default=64, help='单个公式请求每批的最大数量，0 表示不攒批')
+    parser.add_argument('--batch-delay', type=float, default=2.0, help='攒批的最长等待（毫秒）')
+    parser.add_argument('--queue', type=int, default=4096, help='等待组批的请求数上限')
+    parser.add_argument('--overload', choices=(Policy.WAIT, Policy.REJECT), default=Policy.WAIT,
+                        help='队列满时等待或返回 503')
+    parser.add_argument('--reserved', type=int, default=None, help='只给交互通道的在途批数，默认为 worker 数的 1/4')
+    parser.add_argument('--strict', action='store_true', help='交互通道严格优先，默认按 8:1 权重轮转')
+    parser.add_argument('--max-tasks', type=int, default=None, help='每个 worker 执行的任务数上限，超过后替换')
+    parser.add_argument('--max-rss', type=int, default=None, help='worker 常驻内存上限（MB），超过后替换')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
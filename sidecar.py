@@ -0,0 +1,357 @@
+"""
+Unix domain socket 旁路服务
+
+同机调用方每秒请求量很高时，HTTP 解析与 JSON 编码占了单个公式耗时的相当一部分。
+sidecar 使用最简单的长度前缀帧：
+
+    请求  u32 长度 | u8 flags | 公式数据（OLE / Equation Native / MTEF）
+    响应  u32 长度 | u8 status | UTF-8 latex，失败时为 UTF-8 错误说明
+
+长度为其后全部字节数（大端）。flags 第 0 位为 compact 输出，第 1 位表示批量通道（microbatch.Lane.BULK，
+默认为交互通道）。status 见 Status。
+同一连接上可以连续发送多个请求而不等待响应（pipelining），服务端并发处理，按请求顺序回复。
+
+    python -m mtef.sidecar /run/mtef.sock [--workers N]
+
+workers 为 0（默认）时在事件循环中直接翻译，没有进程间往返，适合绝大多数亚毫秒级的公式；
+大于 0 时经 microbatch.MicroBatcher 攒批交给进程池，同一连接及不同连接上的请求合并提交；
+等待组批的请求超过 --queue 时按 --overload 等待或回复 Status.OVERLOADED；--max-tasks、--max-rss
+与 serve 相同，超过上限的 worker 在完成当前任务后被替换。客户端：
+
+    from mtef.sidecar import SidecarClient
+
+    with SidecarClient('/run/mtef.sock') as client:
+        latex = client.translate(bts)
+        results = client.translateMany(objects)   # [(status, text)]，一次发出全部请求
+"""
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import sys
+from .cache import FailureKind
+from .microbatch import MicroBatcher, Overloaded, Policy, Lane
+from .minify import OutputProfile
+from .serve import splitInput, translateInputs, warmWorker, ping, createPool
+
+Frame = struct.Struct('>IB')
+
+FlagCompact = 0x01
+FlagBulk = 0x02
+
+
+class Status:
+    OK = 0
+    INVALID = 1
+    UNSUPPORTED = 2
+    ERROR = 3
+    TIMEOUT = 4
+    BLOWUP = 5
+    # 帧超过上限或格式错误，回复后关闭连接
+    REJECTED = 6
+    # 等待组批的请求已满（--overload reject），连接保持
+    OVERLOADED = 7
+
+
+KindStatus = {
+    FailureKind.INVALID: Status.INVALID,
+    FailureKind.UNSUPPORTED: Status.UNSUPPORTED,
+    FailureKind.ERROR: Status.ERROR,
+    FailureKind.TIMEOUT: Status.TIMEOUT,
+    FailureKind.BLOWUP: Status.BLOWUP,
+}
+
+
+class SidecarError(Exception):
+    def __init__(self, status, message):
+        super().__init__('%d: %s' % (status, message))
+        self.status = status
+        self.message = message
+
+
+def encodeFrame(code, payload):
+    return Frame.pack(len(payload) + 1, code) + payload
+
+
+class Sidecar:
+    def __init__(self, workers=0, maxFrame=16 << 20, maxPending=256, timeout=30.0, executor=None,
+                 batchSize=64, batchDelay=0.002, maxQueue=4096, overload=Policy.WAIT, reserved=None, strict=False,
+                 maxTasks=None, maxRSS=None):
+        # workers int //0 表示在事件循环中直接翻译
+        self.workers = workers
+        # maxFrame int //请求帧的字节上限
+        self.maxFrame = maxFrame
+        # maxPending int //每个连接未回复的请求数上限，达到后暂停读取
+        self.maxPending = maxPending
+        # timeout float //使用进程池时单个请求的超时（秒）
+        self.timeout = timeout
+        self.executor = executor
+        self.owned = executor is None
+        # batcher *MicroBatcher //使用进程池时创建
+        self.batcher = None
+        self.batchSize = batchSize
+        self.batchDelay = batchDelay
+        self.maxQueue = maxQueue
+        self.overload = overload
+        # reserved int //只给交互通道的在途批名额，默认为 worker 数的 1/4（至少 1）
+        self.reserved = max(1, workers // 4) if reserved is None else reserved
+        self.strict = strict
+        # maxTasks int //每个 worker 的任务数上限
+        self.maxTasks = maxTasks
+        # maxRSS int //worker 常驻内存上限（字节）
+        self.maxRSS = maxRSS
+        self.server = None
+
+        self.requests = 0
+        self.connections = 0
+
+    async def start(self, path):
+        if self.executor is None and self.workers > 0:
+            self.executor = createPool(self.workers, self.maxTasks, self.maxRSS)
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[loop.run_in_executor(self.executor, ping) for _ in range(self.workers)])
+        else:
+            warmWorker()
+        if self.executor is not None:
+            self.batcher = MicroBatcher(self.executor, self.batchSize, self.batchDelay, self.maxQueue,
+                                        policy=self.overload, strict=self.strict, reserved=self.reserved)
+            await self.batcher.start()
+        if os.path.exists(path):
+            os.unlink(path)
+        self.server = await asyncio.start_unix_server(self.handle, path)
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.batcher is not None:
+            await self.batcher.close()
+            self.batcher = None
+        if self.owned and self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def translate(self, flags, payload):
+        """
+        返回响应帧
+        """
+        profile = OutputProfile.COMPACT if flags & FlagCompact else OutputProfile.DEFAULT
+        items, document, err = splitInput(payload, maxBytes=self.maxFrame)
+        if err is None and document:
+            err = 'docx is not supported by the sidecar'
+        if err is not None:
+            return encodeFrame(Status.INVALID, err.encode('utf-8'))
+
+        if self.batcher is None:
+            latex, kind, error = translateInputs(items, profile)[0]
+        else:
+            try:
+                lane = Lane.BULK if flags & FlagBulk else Lane.INTERACTIVE
+                latex, kind, error = await asyncio.wait_for(self.batcher.submit(items[0], profile, lane),
+                                                            self.timeout)
+            except asyncio.TimeoutError:
+                return encodeFrame(Status.TIMEOUT, ('%gs' % self.timeout).encode('utf-8'))
+            except Overloaded as err:
+                return encodeFrame(Status.OVERLOADED, str(err).encode('utf-8'))
+        if kind is None:
+            return encodeFrame(Status.OK, latex.encode('utf-8'))
+        return encodeFrame(KindStatus.get(kind, Status.ERROR), error.encode('utf-8'))
+
+    async def writeReplies(self, writer, replies):
+        """
+        按请求顺序写回响应；replies 中为 Task 或 bytes，None 表示结束
+        """
+        while True:
+            reply = await replies.get()
+            if reply is None:
+                break
+            if not isinstance(reply, bytes):
+                try:
+                    reply = await reply
+                except Exception as exc:
+                    # 进程池损坏等意外错误只影响这一个请求
+                    reply = encodeFrame(Status.ERROR, ('%s: %s' % (type(exc).__name__, exc)).encode('utf-8'))
+            writer.write(reply)
+            # 队列中没有已完成的响应时再 drain，连续的响应合并写出
+            if replies.empty():
+                await writer.drain()
+
+    @staticmethod
+    async def enqueue(replies, replier, reply):
+        """
+        把响应放入 replies，队列满时等待空位；写回任务已经结束（连接断开）时返回 False，不会一直阻塞
+        """
+        if replier.done():
+            return False
+        if not replies.full():
+            replies.put_nowait(reply)
+            return True
+        put = asyncio.ensure_future(replies.put(reply))
+        try:
+            await asyncio.wait([put, replier], return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not put.done():
+                put.cancel()
+        return put.done() and not put.cancelled()
+
+    @staticmethod
+    def discard(replies):
+        """
+        取消队列中尚未写回的翻译任务
+        """
+        while not replies.empty():
+            reply = replies.get_nowait()
+            if isinstance(reply, asyncio.Future):
+                reply.cancel()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        replies = asyncio.Queue(self.maxPending)
+        replier = asyncio.ensure_future(self.writeReplies(writer, replies))
+        try:
+            while True:
+                try:
+                    head = await reader.readexactly(Frame.size)
+                except asyncio.IncompleteReadError:
+                    break
+                length, flags = Frame.unpack(head)
+                if length < 1 or length - 1 > self.maxFrame:
+                    await self.enqueue(replies, replier,
+                                       encodeFrame(Status.REJECTED, b'frame larger than %d bytes' % self.maxFrame))
+                    break
+                payload = await reader.readexactly(length - 1)
+                self.requests += 1
+                if self.batcher is None:
+                    reply = await self.translate(flags, payload)
+                else:
+                    reply = asyncio.ensure_future(self.translate(flags, payload))
+                # 队列满时等待，不再读取新的请求
+                if not await self.enqueue(replies, replier, reply):
+                    if isinstance(reply, asyncio.Future):
+                        reply.cancel()
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # 连接断开或服务关闭，处理函数正常结束
+            pass
+        finally:
+            try:
+                # 写回任务写完已排队的响应后结束
+                if await self.enqueue(replies, replier, None):
+                    await replier
+            except (asyncio.CancelledError, Exception):
+                # 服务关闭、连接断开或写回出错
+                pass
+            finally:
+                replier.cancel()
+                if replier.done() and not replier.cancelled():
+                    # 取出写回任务的异常，连接断开时不再报告
+                    replier.exception()
+                self.discard(replies)
+                writer.close()
+                self.connections -= 1
+
+
+class SidecarClient:
+    """
+    阻塞式客户端
+    """
+
+    def __init__(self, path, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(path)
+        self.file = self.sock.makefile('rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def send(self, bts, compact=False, bulk=False):
+        self.sock.sendall(encodeFrame((FlagCompact if compact else 0) | (FlagBulk if bulk else 0), bts))
+
+    def receive(self):
+        """
+        读取一个响应，返回 (status, text)
+        """
+        head = self.file.read(Frame.size)
+        if len(head) < Frame.size:
+            raise ConnectionError('sidecar closed the connection')
+        length, status = Frame.unpack(head)
+        payload = self.file.read(length - 1)
+        if len(payload) < length - 1:
+            raise ConnectionError('sidecar closed the connection')
+        return status, payload.decode('utf-8')
+
+    def translate(self, bts, compact=False):
+        """
+        翻译一个公式，失败时抛出 SidecarError
+        """
+        self.send(bts, compact)
+        status, text = self.receive()
+        if status != Status.OK:
+            raise SidecarError(status, text)
+        return text
+
+    def translateMany(self, items, compact=False, window=128, bulk=False):
+        """
+        pipelining：最多 window 个请求在途，返回与输入顺序一致的 [(status, text)]；bulk 时走批量通道
+        """
+        results = []
+        sent = 0
+        for bts in items:
+            self.send(bts, compact, bulk)
+            sent += 1
+            if sent - len(results) >= window:
+                results.append(self.receive())
+        while len(results) < sent:
+            results.append(self.receive())
+        return results
+
+
+async def serve(args):
+    sidecar = Sidecar(args.workers, args.max_frame << 20, timeout=args.timeout, batchSize=args.batch_size,
+                      batchDelay=args.batch_delay / 1e3, maxQueue=args.queue, overload=args.overload,
+                      reserved=args.reserved, strict=args.strict, maxTasks=args.max_tasks,
+                      maxRSS=args.max_rss << 20 if args.max_rss else None)
+    await sidecar.start(args.path)
+    print('listening on %s (%s)' % (args.path, '%d workers' % args.workers if args.workers else 'inline'),
+          file=sys.stderr)
+    try:
+        await sidecar.server.serve_forever()
+    finally:
+        await sidecar.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='%s.sidecar' % (__package__ or 'mtef'))
+    parser.add_argument('path', help='unix socket 路径')
+    parser.add_argument('--workers', type=int, default=0, help='进程池大小，0 表示在事件循环中直接翻译')
+    parser.add_argument('--max-frame', type=int, default=16, help='请求帧上限（MB）')
+    parser.add_argument('--timeout', type=float, default=30.0, help='使用进程池时单个请求的超时（秒）')
+    parser.add_argument('--batch-size', type=int, default=64, help='使用进程池时每批的最大请求数')
+    parser.add_argument('--batch-delay', type=float, default=2.0, help='攒批的最长等待（毫秒）')
+    parser.add_argument('--queue', type=int, default=4096, help='等待组批的请求数上限')
+    parser.add_argument('--overload', choices=(Policy.WAIT, Policy.REJECT), default=Policy.WAIT,
+                        help='队列满时等待或回复 OVERLOADED')
+    parser.add_argument('--reserved', type=int, default=None, help='只给交互通道的在途批数，默认为 worker 数的 1/4')
+    parser.add_argument('--strict', action='store_true', help='交互通道严格优先，默认按 8:1 权重轮转')
+    parser.add_argument('--max-tasks', type=int, default=None, help='每个 worker 执行的任务数上限，超过后替换')
+    parser.add_argument('--max-rss', type=int, default=None, help='worker 常驻内存上限（MB），超过后替换')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
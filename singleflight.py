@@ -0,0 +1,146 @@
+"""
+同键请求合并（single-flight）
+
+一次上传的文档中同一公式常出现几十次，缓存要等翻译完成才写入，并发到达的相同请求会各自解析一遍。
+Group 保证同一个键同一时刻只有一个调用在执行，其余调用方等待并共享其结果（参照 Go 的
+golang.org/x/sync/singleflight）：
+
+    from mtef.singleflight import Group, translate
+
+    flights = Group()
+    latex, err = translate(bts, group=flights)
+
+asyncio 中使用 AsyncGroup，等待方被取消不会影响正在执行的调用：
+
+    flights = AsyncGroup()
+    latex, err = await translateAsync(bts, group=flights)
+
+TranslationCache 内部也使用 Group 合并同一数据摘要的未命中。asyncio 只在异步接口中导入。
+"""
+from hashlib import blake2b
+from _thread import allocate_lock
+from .minify import OutputProfile
+
+
+class Call:
+    __slots__ = ('done', 'value', 'exc')
+
+    def __init__(self):
+        # done lock //执行期间处于锁定状态，等待方通过获取它等待完成
+        self.done = allocate_lock()
+        self.done.acquire()
+        self.value = None
+        self.exc = None
+
+
+class Group:
+    def __init__(self):
+        # calls map[key]*Call //正在执行的调用
+        self.calls = {}
+        self.lock = allocate_lock()
+
+        # shared int //未执行、直接共享结果的调用次数
+        self.shared = 0
+
+    def do(self, key, fn):
+        """
+        执行 fn()，同一 key 已有调用在执行时等待其结果；返回 (value, shared)，
+        shared 表示结果来自其他调用方的执行，fn 抛出的异常同样共享
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.shared += 1
+                leader = False
+            else:
+                call = self.calls[key] = Call()
+                leader = True
+
+        if not leader:
+            # 获取后立即释放，让其他等待方也能通过
+            with call.done:
+                pass
+            if call.exc is not None:
+                raise call.exc
+            return call.value, True
+
+        try:
+            call.value = fn()
+        except BaseException as exc:
+            call.exc = exc
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.release()
+        return call.value, False
+
+    def inflight(self):
+        with self.lock:
+            return len(self.calls)
+
+
+class AsyncGroup:
+    def __init__(self):
+        # calls map[key]*asyncio.Future //正在执行的调用
+        self.calls = {}
+        self.shared = 0
+
+    async def do(self, key, fn):
+        """
+        await fn()，同一 key 已有调用在执行时等待其结果；返回 (value, shared)。
+        调用在独立的 Task 中执行，发起方被取消时其他等待方不受影响
+        """
+        import asyncio
+
+        task = self.calls.get(key)
+        shared = task is not None
+        if shared:
+            self.shared += 1
+        else:
+            task = self.calls[key] = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        return await asyncio.shield(task), shared
+
+    def inflight(self):
+        return len(self.calls)
+
+
+def flightKey(bts, profile):
+    return blake2b(bts, digest_size=16).digest() + profile.encode()
+
+
+def translateBytes(bts, profile=OutputProfile.DEFAULT):
+    from .mtef import MTEF
+
+    eqn, err = MTEF.OpenBytes(bts)
+    if eqn is None:
+        return '', err or 'MTEF.Open: Equation Native not found'
+    return eqn.Translate(profile), None
+
+
+# defaultGroup / defaultAsyncGroup //未指定 group 时使用
+defaultGroup = Group()
+defaultAsyncGroup = AsyncGroup()
+
+
+def translate(bts, profile=OutputProfile.DEFAULT, group=None):
+    """
+    MTEF.OpenBytes(bts).Translate(profile)，并发的相同输入只翻译一次；返回 (latex, err)
+    """
+    group = group or defaultGroup
+    result, _ = group.do(flightKey(bts, profile), lambda: translateBytes(bts, profile))
+    return result
+
+
+async def translateAsync(bts, profile=OutputProfile.DEFAULT, group=None, executor=None):
+    """
+    在 executor（默认为事件循环的默认线程池）中翻译，并发的相同输入只翻译一次；返回 (latex, err)
+    """
+    import asyncio
+
+    group = group or defaultAsyncGroup
+    loop = asyncio.get_running_loop()
+    result, _ = await group.do(flightKey(bts, profile),
+                               lambda: loop.run_in_executor(executor, translateBytes, bts, profile))
+    return result
@@ -0,0 +1,264 @@
+"""
+持久化翻译缓存
+
+TranslationCache 只在进程内有效，worker 重启后即丢失，多个 worker 也各存一份。
+TranslationStore 把翻译结果写入 sqlite（WAL 模式，多进程可同时读写），键与 TranslationCache 相同，
+每条记录带上输出格式版本 OutputVersion，只读取当前版本的记录。字符表、模板等改动使输出变化时
+递增 OutputVersion；滚动发布期间新旧版本的 worker 共用一个库，各自只读写自己版本的记录，
+自动淘汰只按总大小进行，不删除其他版本的记录。旧版本的记录由 prune 显式删除（只删比自己旧的版本）。
+
+命中时更新的最近使用时间先记在内存中，攒够 TouchBatch 条或写入时再一起写库，读路径上不再每次提交事务。
+
+failures 表保存 cache.FailureCache 记录的失败（失败类别、说明、是否隔离），同样按版本读取，
+隔离的输入在整个部署内（所有 worker、重启前后）都不会再交给解析器。
+
+作为 TranslationCache 的后端使用，内存未命中时先查库，翻译后同时写库：
+
+    from mtef.cache import TranslationCache
+    from mtef.store import TranslationStore
+
+    cache = TranslationCache(store=TranslationStore('/var/cache/mtef.db'))
+
+预热与维护：
+
+    python -m mtef.store warm DB DIR [--profile compact]
+    python -m mtef.store stats DB
+    python -m mtef.store prune DB
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from _thread import allocate_lock
+
+# 输出格式版本：字符表、模板、minify 等改动使同一输入的输出变化时（tests/test_translate.py 的 OutputDigest 随之改变）需要递增
+OutputVersion = 1
+
+# 命中记录的最近使用时间攒够这么多条后写库
+TouchBatch = 256
+
+
+class TranslationStore:
+    def __init__(self, path, maxBytes=256 << 20, version=None):
+        # path string //sqlite 文件路径
+        self.path = path
+        # maxBytes int //latex 总字节数上限，超出后按最近使用时间淘汰
+        self.maxBytes = maxBytes
+        # version int //默认为 OutputVersion
+        self.version = version or OutputVersion
+
+        # 连接不能跨 fork 使用，按进程创建
+        self.conn = None
+        self.pid = None
+        self.lock = allocate_lock()
+        # putsSinceCheck int //每写入若干条检查一次总大小
+        self.putsSinceCheck = 0
+        # touched map[key]float //尚未写库的最近使用时间
+        self.touched = {}
+
+    def connect(self):
+        if self.conn is None or self.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            # 早期的库以源文件摘要（TEXT）为版本、只以 key 为主键，无法比较新旧，整个丢弃
+            columns = {row[1]: row[2] for row in conn.execute('PRAGMA table_info(translations)')}
+            if columns.get('version') == 'TEXT':
+                conn.execute('DROP TABLE translations')
+                conn.execute('DROP TABLE IF EXISTS failures')
+            conn.execute('CREATE TABLE IF NOT EXISTS translations ('
+                         'key BLOB NOT NULL, version INTEGER NOT NULL, latex TEXT NOT NULL, '
+                         'size INTEGER NOT NULL, used REAL NOT NULL, PRIMARY KEY (key, version))')
+            conn.execute('CREATE INDEX IF NOT EXISTS translations_used ON translations (used)')
+            conn.execute('CREATE TABLE IF NOT EXISTS failures ('
+                         'key BLOB NOT NULL, version INTEGER NOT NULL, kind TEXT NOT NULL, '
+                         'message TEXT NOT NULL, quarantined INTEGER NOT NULL, created REAL NOT NULL, '
+                         'PRIMARY KEY (key, version))')
+            self.conn = conn
+            self.pid = os.getpid()
+        return self.conn
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None and self.pid == os.getpid():
+                self.flushTouched(self.conn)
+                self.conn.close()
+            self.conn = None
+            self.touched.clear()
+
+    def get(self, key):
+        """
+        取当前版本的记录，没有或版本不符时返回 None
+        """
+        with self.lock:
+            conn = self.connect()
+            row = conn.execute('SELECT latex FROM translations WHERE key = ? AND version = ?',
+                               (key, self.version)).fetchone()
+            if row is None:
+                return None
+            self.touched[key] = time.time()
+            if len(self.touched) >= TouchBatch:
+                self.flushTouched(conn)
+            return row[0]
+
+    def flushTouched(self, conn):
+        """
+        把内存中的最近使用时间一次写库（调用方持有 self.lock）
+        """
+        if not self.touched:
+            return
+        rows = [(used, key, self.version) for key, used in self.touched.items()]
+        self.touched.clear()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('UPDATE translations SET used = MAX(used, ?) WHERE key = ? AND version = ?', rows)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def put(self, key, latex):
+        with self.lock:
+            conn = self.connect()
+            conn.execute('INSERT OR REPLACE INTO translations (key, version, latex, size, used) VALUES (?, ?, ?, ?, ?)',
+                         (key, self.version, latex, len(latex.encode('utf-8')), time.time()))
+            self.putsSinceCheck += 1
+            if self.putsSinceCheck >= 256:
+                self.putsSinceCheck = 0
+                self.evict(conn)
+
+    def putMany(self, items):
+        """
+        批量写入 [(key, latex)]，预热时使用
+        """
+        now = time.time()
+        rows = [(key, self.version, latex, len(latex.encode('utf-8')), now) for key, latex in items]
+        with self.lock:
+            conn = self.connect()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.executemany('INSERT OR REPLACE INTO translations (key, version, latex, size, used) '
+                                 'VALUES (?, ?, ?, ?, ?)', rows)
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            self.evict(conn)
+
+    def getFailure(self, key):
+        """
+        取当前版本的失败记录 (kind, message, quarantined)，没有时返回 None
+        """
+        with self.lock:
+            row = self.connect().execute('SELECT kind, message, quarantined FROM failures '
+                                         'WHERE key = ? AND version = ?', (key, self.version)).fetchone()
+            if row is None:
+                return None
+            return row[0], row[1], bool(row[2])
+
+    def putFailure(self, key, kind, message, quarantined):
+        with self.lock:
+            self.connect().execute('INSERT OR REPLACE INTO failures (key, version, kind, message, quarantined, created) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)',
+                                   (key, self.version, kind, message, 1 if quarantined else 0, time.time()))
+
+    def evict(self, conn):
+        """
+        总大小超出上限时按最近使用时间删除到上限的 90%（所有版本一起计算，不按版本删除）
+        """
+        self.flushTouched(conn)
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM translations').fetchone()[0]
+        if total <= self.maxBytes:
+            return 0
+
+        target = total - self.maxBytes * 9 // 10
+        removed = 0
+        freed = 0
+        for rowid, size in conn.execute('SELECT rowid, size FROM translations ORDER BY used').fetchall():
+            if freed >= target:
+                break
+            conn.execute('DELETE FROM translations WHERE rowid = ?', (rowid,))
+            freed += size
+            removed += 1
+        return removed
+
+    def prune(self):
+        """
+        删除比当前版本旧的记录，再按总大小淘汰；比当前版本新的记录（滚动发布中的新 worker）保留。
+        返回删除的翻译记录数
+        """
+        with self.lock:
+            conn = self.connect()
+            removed = conn.execute('DELETE FROM translations WHERE version < ?', (self.version,)).rowcount
+            conn.execute('DELETE FROM failures WHERE version < ?', (self.version,))
+            return removed + self.evict(conn)
+
+    def recent(self, limit):
+        """
+        最近使用的 limit 条当前版本记录 [(key, latex)]，用于预加载到内存缓存
+        """
+        with self.lock:
+            self.flushTouched(self.connect())
+            return self.connect().execute('SELECT key, latex FROM translations WHERE version = ? '
+                                          'ORDER BY used DESC LIMIT ?', (self.version, limit)).fetchall()
+
+    def stats(self):
+        with self.lock:
+            conn = self.connect()
+            entries, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM translations '
+                                         'WHERE version = ?', (self.version,)).fetchone()
+            stale = conn.execute('SELECT COUNT(*) FROM translations WHERE version < ?',
+                                 (self.version,)).fetchone()[0]
+            newer = conn.execute('SELECT COUNT(*) FROM translations WHERE version > ?',
+                                 (self.version,)).fetchone()[0]
+            failures, quarantined = conn.execute('SELECT COUNT(*), COALESCE(SUM(quarantined), 0) FROM failures '
+                                                 'WHERE version = ?', (self.version,)).fetchone()
+            return {'version': self.version, 'entries': entries, 'bytes': size, 'stale': stale, 'newer': newer,
+                    'failures': failures, 'quarantined': quarantined}
+
+
+def warm(args):
+    from .cache import TranslationCache
+
+    store = TranslationStore(args.db, args.max_bytes << 20)
+    cache = TranslationCache(store=store)
+    for root, _, names in os.walk(args.corpus):
+        for name in sorted(names):
+            with open(os.path.join(root, name), 'rb') as f:
+                bts = f.read()
+            _, err = cache.translate(bts, args.profile)
+            if err is not None:
+                print('%s: %s' % (name, err), file=sys.stderr)
+    stats = cache.stats()
+    print('hits %d, misses %d' % (stats['hits'], stats['misses']))
+    print(store.stats())
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='%s.store' % (__package__ or 'mtef'))
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    cmd = commands.add_parser('warm', help='翻译目录下全部 OLE 公式对象并写入缓存库')
+    cmd.add_argument('db')
+    cmd.add_argument('corpus')
+    cmd.add_argument('--profile', default='default', choices=('default', 'compact'))
+    cmd.add_argument('--max-bytes', type=int, default=256, help='缓存库上限（MB）')
+    cmd.set_defaults(func=warm)
+
+    cmd = commands.add_parser('stats', help='缓存库条目数与大小')
+    cmd.add_argument('db')
+    cmd.set_defaults(func=lambda args: print(TranslationStore(args.db).stats()) or 0)
+
+    cmd = commands.add_parser('prune', help='删除比当前版本旧的记录并按上限淘汰')
+    cmd.add_argument('db')
+    cmd.add_argument('--max-bytes', type=int, default=256, help='缓存库上限（MB）')
+    cmd.set_defaults(func=lambda args: print('removed %d' % TranslationStore(args.db, args.max_bytes << 20).prune()) or 0)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,698 @@
+"""
+TMPL 模板处理器注册表
+
+makeLatex / makeLatexV3 遇到 TMPL 节点时，按 selector 在注册表中查找处理器，
+不再逐个比较 selector。v5 与 v3 的 selector 编号不同，所以各有一张表：
+
+    TmplHandlers    -> SelectorType
+    TmplHandlersV3  -> SelectorTypeV3
+
+自定义处理器无需修改 mtef.py：
+
+    @TmplHandlers.register(SelectorType.tmBOX, slots=('main',))
+    def tmplBox(eqn, ast, slots):
+        return '\\boxed{ %s }' % slots['main'], None
+"""
+import time
+from .record import SelectorType, SelectorTypeV3
+from .logger import getLogger
+from .memo import invalidateRenderMemo
+
+logger = getLogger(__name__)
+
+
+class TmplHandler:
+    def __init__(self, selector, func, slots, overflow=False, pieces=None, required=0, short=None):
+        # selector uint8
+        self.selector = selector
+        # func func(eqn, ast, slots) (string, error)
+        self.func = func
+        # slots []string //槽位布局，按子节点顺序命名；None表示交给处理器全部子节点的列表
+        self.slots = slots
+        # overflow bool //子节点多于槽位时全部渲染，最后一个槽位取最后一个子节点
+        self.overflow = overflow
+        # pieces func(ast, slots) [](string, string) //可选，把输出拆成可与相邻节点合并的片段
+        self.pieces = pieces
+        # required int //前 required 个槽位必须存在，缺失时抛出 IndexError，与逐个取 ast.children[i] 的原实现一致
+        self.required = required
+        # short string //可选，子节点少于槽位数时直接输出，不渲染子节点
+        self.short = short
+        self.name = func.__name__
+
+        # 性能统计：调用次数、累计耗时（秒，包含子节点的渲染）
+        # 不加锁，避免渲染路径上的争用；多线程（尤其是 free-threaded 构建）下为近似值
+        self.calls = 0
+        self.elapsed = 0.0
+
+    def renderSlots(self, ast, render):
+        """
+        按槽位布局渲染子节点，缺失的可选槽位为空字符串
+        """
+        children = ast.children or []
+        if len(children) < self.required:
+            raise IndexError('%s: missing slot %r' % (self.name, self.slots[len(children)]))
+        if self.slots is None:
+            slots = []
+            for child in children:
+                latex, err = render(child)
+                if err:
+                    return None, err
+                slots.append(latex)
+            return slots, None
+
+        if not self.overflow:
+            children = children[:len(self.slots)]
+
+        slots = dict.fromkeys(self.slots, '')
+        last = len(self.slots) - 1
+        for i, child in enumerate(children):
+            latex, err = render(child)
+            if err:
+                return None, err
+            slots[self.slots[min(i, last)]] = latex
+        return slots, None
+
+    def __call__(self, eqn, ast, render):
+        start = time.perf_counter()
+        try:
+            if self.short is not None and len(ast.children or []) < len(self.slots):
+                return self.short, None
+            slots, err = self.renderSlots(ast, render)
+            if err:
+                return '', err
+            return self.func(eqn, ast, slots)
+        finally:
+            self.calls += 1
+            self.elapsed += time.perf_counter() - start
+
+    def renderPieces(self, ast, render):
+        """
+        渲染为片段列表，供父节点合并；不支持的 variation 返回 None
+        """
+        start = time.perf_counter()
+        try:
+            slots, err = self.renderSlots(ast, render)
+            if err:
+                return None, err
+            return self.pieces(ast, slots), None
+        finally:
+            self.calls += 1
+            self.elapsed += time.perf_counter() - start
+
+
+class TmplRegistry:
+    def __init__(self, name):
+        self.name = name
+        # handlers map[uint8]*TmplHandler
+        self.handlers = {}
+
+    def register(self, selector, slots=('main',), overflow=False, pieces=None, required=0, short=None):
+        """
+        注册模板处理器（装饰器），同一 selector 重复注册时后者覆盖前者；
+        required 为必须存在的槽位数，子节点不足时渲染抛出 IndexError
+        """
+        def decorator(func):
+            self.handlers[selector] = TmplHandler(selector, func, slots, overflow, pieces, required, short)
+            # 记忆表中的片段可能由旧的处理器渲染
+            invalidateRenderMemo()
+            return func
+        return decorator
+
+    def unregister(self, selector):
+        handler = self.handlers.pop(selector, None)
+        invalidateRenderMemo()
+        return handler
+
+    def get(self, selector):
+        return self.handlers.get(selector)
+
+    def dispatch(self, eqn, ast, render):
+        """
+        分派 TMPL 节点；没有对应处理器，或处理器返回 None（不支持的 variation）时返回 None
+        """
+        handler = self.handlers.get(ast.value.selector)
+        if handler is None:
+            return None
+        return handler(eqn, ast, render)
+
+    def stats(self):
+        """
+        返回 {处理器名: (调用次数, 累计耗时)}，按耗时降序
+        """
+        items = sorted(self.handlers.values(), key=lambda h: h.elapsed, reverse=True)
+        return {h.name: (h.calls, h.elapsed) for h in items if h.calls}
+
+    def resetStats(self):
+        for handler in self.handlers.values():
+            handler.calls = 0
+            handler.elapsed = 0.0
+
+
+TmplHandlers = TmplRegistry('v5')
+TmplHandlersV3 = TmplRegistry('v3')
+
+
+# ---------------------------------------------------------------------------
+# MTEF v5
+# ---------------------------------------------------------------------------
+
+# tmARROW variation转码，有序循环
+ArrowVariations = (
+    (0x0000, "single"),
+    (0x0001, "double"),
+    (0x0002, "harpoon"),
+    (0x0004, "topSlotPresent"),
+    (0x0008, "bottomSlotPresent"),
+    (0x0010, "pointLeft"),
+    (0x0020, "pointRight"),
+)
+
+# tmVEC variation转码，有序循环
+VecVariations = (
+    (0x0001, "left"),
+    (0x0002, "right"),
+    (0x0004, "tvVE_UNDER"),
+    (0x0008, "harpoonup"),
+)
+
+
+def fenceLatex(mainSlot, leftSlot, rightSlot):
+    # 转成latex代码
+    mainStr = ''
+    leftStr = ''
+    rightStr = ''
+    if mainSlot != '':
+        mainStr = '{ %s }' % mainSlot
+    if leftSlot != '':
+        leftStr = '\\left %s' % leftSlot
+    if rightSlot != '':
+        rightStr = '\\right %s' % rightSlot
+
+    return '%s %s %s' % (leftStr, mainStr, rightStr)
+
+
+@TmplHandlers.register(SelectorType.tmANGLE, slots=('main', 'left', 'right'), short='<unknown>')
+def tmplAngle(eqn, ast, slots):
+    return fenceLatex(slots['main'], slots['left'], slots['right']), None
+
+
+@TmplHandlers.register(SelectorType.tmPAREN, slots=('main', 'left', 'right'), short='()')
+def tmplParen(eqn, ast, slots):
+    return fenceLatex(slots['main'], slots['left'], slots['right']), None
+
+
+@TmplHandlers.register(SelectorType.tmBRACE, slots=('main', 'left', 'right'), overflow=True)
+def tmplBrace(eqn, ast, slots):
+    rightSlot = slots['right']
+    if rightSlot == '':
+        rightSlot = '.'
+    else:
+        rightSlot = ' ' + rightSlot
+
+    # 组装公式
+    return '\\left %s \\begin{array}{l} %s \\end{array} \\right%s' % (slots['left'], slots['main'], rightSlot), None
+
+
+@TmplHandlers.register(SelectorType.tmBRACK, slots=('main', 'left', 'right'), required=3)
+def tmplBrack(eqn, ast, slots):
+    mainSlot = slots['main']
+    if mainSlot == '':
+        mainSlot = '\\space'
+    return '\\left%s %s \\right%s' % (slots['left'], mainSlot, slots['right']), None
+
+
+@TmplHandlers.register(SelectorType.tmBAR, slots=('main', 'left', 'right'), overflow=True)
+def tmplBar(eqn, ast, slots):
+    # 读取数据 ParBoxClass
+    rightSlot = slots['right']
+    if rightSlot == '':
+        rightSlot = '.'
+    else:
+        rightSlot = ' ' + rightSlot
+
+    return fenceLatex(slots['main'], slots['left'], rightSlot), None
+
+
+@TmplHandlers.register(SelectorType.tmINTERVAL, slots=('main', 'left', 'right'), required=3)
+def tmplInterval(eqn, ast, slots):
+    # 读取数据 ParBoxClass
+    return fenceLatex(slots['main'], slots['left'], slots['right']), None
+
+
+@TmplHandlers.register(SelectorType.tmROOT, slots=('main', 'radi'), required=2)
+def tmplRoot(eqn, ast, slots):
+    return '\\sqrt[%s] { %s }' % (slots['radi'], slots['main']), None
+
+
+@TmplHandlers.register(SelectorType.tmFRACT, slots=('num', 'den'), required=1)
+def tmplFract(eqn, ast, slots):
+    if len(ast.children) < 2:
+        # 直接传入bin文件这里不会触发，传入字节流在公式太多/thesis_06公式太多.docx以及thesis_15公式太多中会触发
+        return '\\frac { %s } {Unknown}' % slots['num'], None
+    return '\\frac { %s } { %s }' % (slots['num'], slots['den']), None
+
+
+@TmplHandlers.register(SelectorType.tmARROW, slots=('top', 'bottom'), required=2)
+def tmplArrow(eqn, ast, slots):
+    """
+        variation	symbol	description
+        0×0000	tvAR_SINGLE	single arrow
+        0×0001	tvAR_DOUBLE	double arrow
+        0×0002	tvAR_HARPOON	harpoon
+        0×0004	tvAR_TOP	top slot is present
+        0×0008	tvAR_BOTTOM	bottom slot is present
+        0×0010	tvAR_LEFT	if single, arrow points left
+        0×0020	tvAR_RIGHT	if single, arrow points right
+        0×0010	tvAR_LOS	if double or harpoon, large over small
+        0×0020	tvAR_SOL	if double or harpoon, small over large
+    """
+    tmpl = ast.value
+
+    # 转成latex代码
+    topStr = ''
+    bottomStr = ''
+    if slots['top'] != '':
+        topStr = '{\\mathrm{ %s }}' % slots['top']
+    if slots['bottom'] != '':
+        bottomStr = '[\\mathrm{ %s }]' % slots['bottom']
+
+    arrowStyle = "single"
+    latexFmt = "\\x"
+    for vCode, vName in ArrowVariations:
+        # 如果存在掩码
+        if vCode & tmpl.variation != 0:
+            # 判断类型，默认是single
+            if vName == "double":
+                arrowStyle = "double"
+            elif vName == "harpoon":
+                arrowStyle = "harpoon"
+
+            if arrowStyle == "single" and vName == "pointLeft":
+                latexFmt = latexFmt + "leftarrow"
+            elif arrowStyle == "double" and vName == "pointLeft":
+                logger.warning('MTEF.makeLatex: not implement double , large over small')
+            elif arrowStyle == "harpoon" and vName == "pointLeft":
+                logger.warning('MTEF.makeLatex: not implement harpoon, large over small')
+
+            if arrowStyle == "single" and vName == "pointRight":
+                latexFmt = latexFmt + "rightarrow"
+            elif arrowStyle == "double" and vName == "pointRight":
+                logger.warning('MTEF.makeLatex: not implement double , small over large')
+            elif arrowStyle == "harpoon" and vName == "pointRight":
+                logger.warning('MTEF.makeLatex: not implement harpoon, small over large')
+
+    # 组成整体公式
+    return "%s %s %s" % (latexFmt, bottomStr, topStr), None
+
+
+@TmplHandlers.register(SelectorType.tmUBAR, required=1)
+def tmplUbar(eqn, ast, slots):
+    mainStr = ''
+    if slots['main'] != "":
+        mainStr = " {\\underline{ %s }} " % slots['main']
+
+    return " %s " % mainStr, None
+
+
+@TmplHandlers.register(SelectorType.tmOBAR, required=1)
+def tmplObar(eqn, ast, slots):
+    # 上划线 (overbar)
+    mainStr = ''
+    if slots['main'] != "":
+        # 检查variation来决定是否使用双线
+        if ast.value.variation & 0x0001:  # tvBAR_DOUBLE - 双划线
+            mainStr = " {\\overline{\\overline{ %s }}} " % slots['main']
+        else:  # 单划线
+            mainStr = " {\\overline{ %s }} " % slots['main']
+
+    return " %s " % mainStr, None
+
+
+@TmplHandlers.register(SelectorType.tmSUM, slots=('main', 'lower', 'upper', 'operator'), overflow=True)
+def tmplSum(eqn, ast, slots):
+    # BigOpBoxClass
+    mainStr = ''
+    lowerStr = ''
+    upperStr = ''
+    if slots['main'] != "":
+        mainStr = "{ %s }" % slots['main']
+    if slots['lower'] != "":
+        lowerStr = "\\limits_{ %s }" % slots['lower']
+    if slots['upper'] != "":
+        upperStr = "^ %s" % slots['upper']
+
+    return "%s %s %s %s" % (slots['operator'], lowerStr, upperStr, mainStr), None
+
+
+@TmplHandlers.register(SelectorType.tmLIM, slots=('main', 'lower', 'upper'), overflow=True)
+def tmplLim(eqn, ast, slots):
+    # LimBoxClass
+    mainStr = ''
+    lowerStr = ''
+    upperStr = ''
+    if slots['main'] != "":
+        mainStr = "\\mathop { %s }" % slots['main']
+    if slots['lower'] != "":
+        lowerStr = "\\limits_{ %s }" % slots['lower']
+
+    return "%s %s %s" % (mainStr, lowerStr, upperStr), None
+
+
+@TmplHandlers.register(SelectorType.tmSUP, slots=('sup',))
+def tmplSup(eqn, ast, slots):
+    # 只处理上标 (superscript only)
+    if slots['sup']:
+        return f"^{{ {slots['sup']} }}", None
+    return '', None
+
+
+@TmplHandlers.register(SelectorType.tmSUB, slots=('sub',))
+def tmplSub(eqn, ast, slots):
+    # 只处理下标 (subscript only)
+    if slots['sub']:
+        return f"_{{ {slots['sub']} }}", None
+    return '', None
+
+
+@TmplHandlers.register(SelectorType.tmSUBSUP, slots=('sub', 'sup'))
+def tmplSubSup(eqn, ast, slots):
+    # 同时处理下标和上标 (both subscript and superscript)
+    subFmt = f"_{{ {slots['sub']} }}" if slots['sub'] else ''
+    supFmt = f"^{{ {slots['sup']} }}" if slots['sup'] else ''
+    return f"{subFmt}{supFmt}", None
+
+
+@TmplHandlers.register(SelectorType.tmVEC, required=1)
+def tmplVec(eqn, ast, slots):
+    """
+        variations：
+        variation	symbol	description
+        0×0001	tvVE_LEFT	arrow points left
+        0×0002	tvVE_RIGHT	arrow points right
+        0×0004	tvVE_UNDER	arrow under slot, else over slot
+        0×0008	tvVE_HARPOON	harpoon
+
+        这个转换是通过掩码计算的：
+        比如variation的值是3，即0000 0000 0000 0011
+
+        对应的是0×0001和0×0002：
+        0000 0000 0000 0001
+        0000 0000 0000 0010
+    """
+    tmpl = ast.value
+
+    mainStr = ''
+    if slots['main'] != "":
+        mainStr = "{ %s }" % slots['main']
+
+    topStr = "\\overset\\"
+    for vCode, vName in VecVariations:
+        if vCode & tmpl.variation != 0:
+            topStr = topStr + vName
+
+    # 如果variationCode小于8，则一定不是harpoon,那么默认就使用arrow
+    if tmpl.variation < 8:
+        topStr = topStr + "arrow"
+
+    return "%s %s" % (topStr, mainStr), None
+
+
+@TmplHandlers.register(SelectorType.tmHAT, slots=('main', 'top'), required=2)
+def tmplHat(eqn, ast, slots):
+    # HatBoxClass
+    mainStr = ''
+    topStr = ''
+    if slots['main'] != "":
+        mainStr = "{ %s }" % slots['main']
+    if slots['top'] != "":
+        topStr = " %s " % slots['top']
+
+    return "%s %s" % (topStr, mainStr), None
+
+
+@TmplHandlers.register(SelectorType.tmARC, slots=('main', 'top'), required=2)
+def tmplArc(eqn, ast, slots):
+    # HatBoxClass
+    mainStr = ''
+    topStr = ''
+    if slots['main'] != "":
+        mainStr = "{ %s }" % slots['main']
+    if slots['top'] != "":
+        topStr = "\\overset %s" % slots['top']
+
+    return "%s %s" % (topStr, mainStr), None
+
+
+@TmplHandlers.register(SelectorType.tmINTEG, slots=('main', 'lower', 'upper'))
+def tmplInteg(eqn, ast, slots):
+    # 根据variation决定积分类型
+    variation = ast.value.variation
+    integral_symbol = '\\int'
+    if variation & 0x0002:  # tvINT_2 - 双重积分
+        integral_symbol = '\\iint'
+    elif variation & 0x0003:  # tvINT_3 - 三重积分
+        integral_symbol = '\\iiint'
+    elif variation & 0x0004:  # tvINT_LOOP - 环积分
+        integral_symbol = '\\oint'
+
+    mainStr = f"{{ {slots['main']} }}" if slots['main'] else ''
+    lowerStr = f"_{{{slots['lower']}}}" if slots['lower'] else ''
+    upperStr = f"^{{{slots['upper']}}}" if slots['upper'] else ''
+
+    return f'{integral_symbol}{lowerStr}{upperStr} {mainStr}', None
+
+
+@TmplHandlers.register(SelectorType.tmPROD, slots=('main', 'lower', 'upper'))
+def tmplProd(eqn, ast, slots):
+    # 乘积符号处理
+    mainStr = f"{{ {slots['main']} }}" if slots['main'] else ''
+    lowerStr = f"\\limits_{{ {slots['lower']} }}" if slots['lower'] else ''
+    upperStr = f"^{{ {slots['upper']} }}" if slots['upper'] else ''
+
+    return f'\\prod {lowerStr}{upperStr} {mainStr}', None
+
+
+@TmplHandlers.register(SelectorType.tmTILDE)
+def tmplTilde(eqn, ast, slots):
+    # 波浪号装饰
+    if ast.children:
+        return f"\\tilde{{ {slots['main']} }}", None
+    return '', None
+
+
+@TmplHandlers.register(SelectorType.tmFLOOR)
+def tmplFloor(eqn, ast, slots):
+    # 向下取整 (floor brackets)
+    if ast.children:
+        return f"\\lfloor {slots['main']} \\rfloor", None
+    return '', None
+
+
+@TmplHandlers.register(SelectorType.tmCEILING)
+def tmplCeiling(eqn, ast, slots):
+    # 向上取整 (ceiling brackets)
+    if ast.children:
+        return f"\\lceil {slots['main']} \\rceil", None
+    return '', None
+
+
+@TmplHandlers.register(SelectorType.tmDBAR)
+def tmplDbar(eqn, ast, slots):
+    # 双竖线 (double vertical bars)
+    if ast.children:
+        return f"\\| {slots['main']} \\|", None
+    return '', None
+
+
+@TmplHandlers.register(SelectorType.tmINTOP, slots=('main', 'lower', 'upper', 'operator'))
+def tmplIntop(eqn, ast, slots):
+    # 积分样式大型操作符处理 (big integral-style operators)
+    # BigOpBoxClass 的顺序：main slot, lower slot, upper slot, large operator character
+    # 积分样式意味着限制放在操作符右侧，而非上下方
+    # 如果没有操作符字符，使用默认的积分样式操作符
+    operatorChar = slots['operator']
+    if not operatorChar:
+        operatorChar = '\\bigodot'  # 默认使用大圆点操作符
+
+    mainStr = f"{{ {slots['main']} }}" if slots['main'] else ''
+    lowerStr = f"_{{{slots['lower']}}}" if slots['lower'] else ''
+    upperStr = f"^{{{slots['upper']}}}" if slots['upper'] else ''
+
+    # 积分样式布局：操作符 + 上下标 + 被操作表达式
+    return f'{operatorChar}{lowerStr}{upperStr} {mainStr}', None
+
+
+# ---------------------------------------------------------------------------
+# MTEF v3
+# 处理器返回 None 表示该 variation 不支持，由 makeLatexV3 按默认方式拼接子节点
+# ---------------------------------------------------------------------------
+
+@TmplHandlersV3.register(SelectorTypeV3.tmFRACT, slots=('num', 'den'))
+def tmplFractV3(eqn, ast, slots):
+    # 分数
+    if len(ast.children) >= 2:
+        return f"\\frac{{{slots['num']}}}{{{slots['den']}}}", None
+    return None
+
+
+@TmplHandlersV3.register(SelectorTypeV3.tmSINT, slots=None)
+def tmplSintV3(eqn, ast, slots):
+    # 单积分
+    # 在当前 AST 结构中，所有子节点都在一个列表中，需要根据实际内容智能分组
+    main_slot = ''.join(slots)
+
+    # 根据 variation 决定积分的样式
+    # 0: tvNSINT - no limits, 1: tvLSINT - lower limit only, 2: tvBSINT - both limits
+    # 3: tvNCINT - contour, no limits, 4: tvLCINT - contour, lower limit only
+    variation = ast.value.variation
+    if variation in (0, 1, 2):
+        return f'\\int {main_slot}', None
+    elif variation in (3, 4):
+        return f'\\oint {main_slot}', None
+    return None
+
+
+def firstNonEmpty(slots):
+    # 从调试中发现，上标模板通常有两个子节点
+    # 第一个子节点通常为空，第二个子节点包含实际内容
+    for latex in slots:
+        if latex.strip():
+            return latex
+    return ''
+
+
+def scriptPiecesV3(ast, slots):
+    """
+    上下标拆成 [(标记, 内容)]，标记为 '_' 或 '^'
+    """
+    variation = ast.value.variation
+    if variation == 0:  # tvSUPER - superscript
+        return [('^', firstNonEmpty(slots))]
+    elif variation == 1:  # tvSUB - subscript
+        return [('_', firstNonEmpty(slots))]
+    elif variation == 2:  # tvSUBSUP - both
+        if len(slots) >= 2:
+            return [('_', slots[0]), ('^', slots[1])]
+    return None
+
+
+def joinScripts(pieces):
+    return ''.join('%s{%s}' % piece for piece in pieces)
+
+
+def mergeScripts(pieces):
+    """
+    合并相邻的同类脚本：X_{A}_{B} -> X_{A B}，X^{A}^{B} -> X^{A B}
+    连续的下标（上标）在 LaTeX 中是 Double subscript 错误；空脚本不参与合并
+    """
+    merged = []
+    for mark, content in pieces:
+        if merged and merged[-1][0] == mark and merged[-1][1] and content:
+            merged[-1] = (mark, merged[-1][1] + ' ' + content)
+        else:
+            merged.append((mark, content))
+    return joinScripts(merged)
+
+
+@TmplHandlersV3.register(SelectorTypeV3.tmSCRIPT, slots=None, pieces=scriptPiecesV3)
+def tmplScriptV3(eqn, ast, slots):
+    # 上下标；同一行内相邻的上下标由 makeLatexV3 按片段合并
+    pieces = scriptPiecesV3(ast, slots)
+    if pieces is None:
+        return None
+    return joinScripts(pieces), None
+
+
+@TmplHandlersV3.register(SelectorTypeV3.tmROOT, slots=('main', 'nth'))
+def tmplRootV3(eqn, ast, slots):
+    # 根号
+    variation = ast.value.variation
+    if variation == 0:  # tvSQROOT - square root
+        if ast.children:
+            return f"\\sqrt{{{slots['main']}}}", None
+    elif variation == 1:  # tvNTHROOT - nth root
+        if len(ast.children) >= 2:
+            return f"\\sqrt[{slots['nth']}]{{{slots['main']}}}", None
+    return None
+
+
+def fenceLatexV3(ast, slots, left, right):
+    if not ast.children:
+        return None
+    content = slots['main']
+    variation = ast.value.variation
+    if variation == 0:  # both left and right
+        return f'\\left{left}{content}\\right{right}', None
+    elif variation == 1:  # left only
+        return f'\\left{left}{content}\\right.', None
+    elif variation == 2:  # right only
+        return f'\\left.{content}\\right{right}', None
+    return None
+
+
+@TmplHandlersV3.register(SelectorTypeV3.tmPAREN)
+def tmplParenV3(eqn, ast, slots):
+    # 括号
+    return fenceLatexV3(ast, slots, '(', ')')
+
+
+@TmplHandlersV3.register(SelectorTypeV3.tmBRACK)
+def tmplBrackV3(eqn, ast, slots):
+    # 方括号
+    return fenceLatexV3(ast, slots, '[', ']')
+
+
+@TmplHandlersV3.register(SelectorTypeV3.tmBRACE)
+def tmplBraceV3(eqn, ast, slots):
+    # 花括号
+    return fenceLatexV3(ast, slots, '\\{', '\\}')
+
+
+def bigOpLatexV3(ast, slots, symbol):
+    # 0: lower only, 1: both upper and lower limits, 2: no limits
+    variation = ast.value.variation
+    if variation == 0:
+        return f"{symbol}_{{{slots['lower']}}} {slots['main']}", None
+    elif variation == 1:
+        return f"{symbol}_{{{slots['lower']}}}^{{{slots['upper']}}} {slots['main']}", None
+    elif variation == 2:
+        return f"{symbol} {slots['main']}", None
+    return None
+
+
+@TmplHandlersV3.register(SelectorTypeV3.tmSUM, slots=('main', 'upper', 'lower'))
+def tmplSumV3(eqn, ast, slots):
+    # 求和
+    return bigOpLatexV3(ast, slots, '\\sum')
+
+
+@TmplHandlersV3.register(SelectorTypeV3.tmPROD, slots=('main', 'upper', 'lower'))
+def tmplProdV3(eqn, ast, slots):
+    # 乘积
+    return bigOpLatexV3(ast, slots, '\\prod')
+
+
+def lscriptPiecesV3(ast, slots):
+    """
+    左上下标以空组 {} 开头，拆成 [('', ''), (标记, 内容)...]
+    """
+    variation = ast.value.variation
+    if variation == 0:  # tvLSUPER - 左上标
+        if slots:
+            return [('', ''), ('^', firstNonEmpty(slots))]
+    elif variation == 1:  # tvLSUB - 左下标
+        if slots:
+            return [('', ''), ('_', firstNonEmpty(slots))]
+    elif variation == 2:  # tvLSUBSUP - 左上标和左下标
+        if len(slots) >= 2:
+            return [('', ''), ('_', slots[0]), ('^', slots[1])]
+    return None
+
+
+@TmplHandlersV3.register(SelectorTypeV3.tmLSCRIPT, slots=None, pieces=lscriptPiecesV3)
+def tmplLscriptV3(eqn, ast, slots):
+    # 左上标和左下标
+    pieces = lscriptPiecesV3(ast, slots)
+    if pieces is None:
+        return None
+    return joinScripts(pieces), None
@@ -0,0 +1,40 @@
+"""
+仓库目录本身就是 mtef 包（没有 __init__.py 的命名空间包），测试按 mtef.xxx 导入。
+目录名不是 mtef 时在临时目录中建一个指向仓库的 mtef 链接；仓库目录不能留在 sys.path 中，
+否则顶层的 mtef.py 会遮住同名的包。因此 tests 也不是包（没有 __init__.py）。
+"""
+import atexit
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path[:] = [path for path in sys.path if os.path.abspath(path or os.curdir) != Root]
+if os.path.basename(Root) == 'mtef':
+    sys.path.insert(0, os.path.dirname(Root))
+else:
+    linkDir = tempfile.mkdtemp(prefix='mtef-tests-')
+    os.symlink(Root, os.path.join(linkDir, 'mtef'))
+    sys.path.insert(0, linkDir)
+    atexit.register(shutil.rmtree, linkDir, True)
+
+from mtef.logger import setLoggerFactory  # noqa: E402
+
+# 合成语料中的模板大多没有实现，屏蔽逐个公式的警告
+setLoggerFactory(lambda name: logging.getLogger('mtef.tests'))
+logging.getLogger('mtef.tests').disabled = True
+
+
+@pytest.fixture(scope='session')
+def corpus():
+    """
+    bench 的合成语料：v5、v3 各半的 OLE 公式对象
+    """
+    from mtef.bench import loadCorpus
+
+    return loadCorpus(None, 400, 1)
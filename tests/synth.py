@@ -0,0 +1,41 @@
+"""
+构造 MTEF 数据（已去掉 OLE 包装与 28 字节头）的小工具，与 bench.synthV5 / synthV3 的编码一致
+"""
+import struct
+
+
+def charV3(code, typeface=131):
+    return bytes([2, typeface]) + struct.pack('<H', code)
+
+
+def lineV3(*items):
+    return b'\x01' + b''.join(items) + b'\x00'
+
+
+def tmplV3(selector, variation, *lines):
+    return bytes([3, selector, variation, 0]) + b''.join(lines) + b'\x00'
+
+
+def bodyV3(*items):
+    return b'\x03\x01\x00\x03\x00' + lineV3(*items) + b'\x00'
+
+
+def charV5(code, typeface=131):
+    return bytes([2, 0, typeface]) + struct.pack('<H', code)
+
+
+def lineV5(*items):
+    return b'\x01\x00' + b''.join(items) + b'\x00'
+
+
+def tmplV5(selector, variation, *lines):
+    return bytes([3, 0, selector, variation, 0]) + b''.join(lines) + b'\x00'
+
+
+def bodyV5(*items):
+    return b'\x05\x01\x00\x06\x09DSMT4\x00\x00' + lineV5(*items) + b'\x00'
+
+
+def text(string, typeface=131, v3=False):
+    char = charV3 if v3 else charV5
+    return [char(ord(c), typeface) for c in string]
@@ -0,0 +1,21 @@
+import asyncio
+
+from mtef.aio import AsyncTranslator, translateManyAsync
+from mtef.batch import translateOne
+
+
+def testReuseAcrossLoops(corpus):
+    items = corpus[:16]
+    expected = [translateOne(bts)[0] for bts in items]
+    # 模块级的 translator 在多次 asyncio.run 之间复用
+    for _ in range(2):
+        results = asyncio.run(translateManyAsync(items))
+        assert [r.latex for r in results] == expected
+
+    translator = AsyncTranslator(concurrency=2)
+    try:
+        for _ in range(2):
+            results = asyncio.run(translator.translateMany(items))
+            assert [r.latex for r in results] == expected
+    finally:
+        translator.close()
@@ -0,0 +1,98 @@
+import struct
+
+from mtef.bench import packOle
+from mtef.cache import AliasOverhead, Failure, FailureCache, FailureKind, TranslationCache, bodyDigest
+from mtef.mtef import MTEF
+from synth import bodyV5, charV5, text
+
+
+def checkAccounting(cache):
+    # 别名都指向现存的条目，字节数与条目、别名一致
+    assert all(key in cache.entries for key in cache.aliases.values())
+    assert sorted(cache.aliases) == sorted(alias for aliases in cache.linked.values() for alias in aliases)
+    size = sum(cache.entrySize(latex) for latex in cache.entries.values()) + AliasOverhead * len(cache.aliases)
+    assert cache.size == size <= cache.maxBytes
+
+
+def testSingleCopy():
+    cache = TranslationCache()
+    bts = packOle(bodyV5(*text('abc')))
+    latex, err = cache.translate(bts)
+    assert err is None
+    assert cache.translate(bts) == (latex, None)
+    stats = cache.stats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+    # 结果只保存在 fingerprint 条目中，数据摘要与整个输入的摘要都是别名
+    assert list(cache.entries.values()) == [latex]
+    assert stats['aliases'] == 2
+    checkAccounting(cache)
+
+
+def testFingerprintShared():
+    cache = TranslationCache()
+    plain = bodyV5(charV5(0x78))
+    # 字号记录（SIZE = 9）不影响输出
+    sized = bodyV5(bytes([9, 101, 2]), charV5(0x78))
+    a, _ = MTEF.OpenBody(plain)
+    b, _ = MTEF.OpenBody(sized)
+    assert a.fingerprint() == b.fingerprint()
+
+    latex, err = cache.translateBody(plain)
+    assert err is None
+    assert cache.translateBody(sized) == (latex, None)
+    assert cache.stats()['fingerprintHits'] == 1
+    assert len(cache.entries) == 1
+    checkAccounting(cache)
+
+
+def testFingerprintIgnoresNudge():
+    # options 带 MtefOptNudge 的 CHAR，readNudge 读取两个 16 位的 dx、dy
+    plain = bodyV5(charV5(0x78), charV5(0x79))
+    nudged = bodyV5(bytes([2, 0x08]) + struct.pack('<HHBH', 5, 3, 131, 0x78), charV5(0x79))
+    a, err = MTEF.OpenBody(plain)
+    assert err is None
+    b, err = MTEF.OpenBody(nudged)
+    assert err is None
+    assert a.Translate() == b.Translate()
+    assert a.fingerprint() == b.fingerprint()
+
+
+def testEvictionDropsAliases(corpus):
+    cache = TranslationCache(maxBytes=16 << 10)
+    for bts in corpus:
+        cache.translate(bts)
+        checkAccounting(cache)
+    assert cache.stats()['evictions'] > 0
+    cache.clear()
+    assert cache.size == 0 and not cache.aliases and not cache.linked
+
+
+def testFailureQuarantine():
+    failures = FailureCache(maxEntries=4)
+    failures.record(b'blowup', FailureKind.BLOWUP, 'RecursionError')
+    failures.record(b'timeout', FailureKind.TIMEOUT, '5s')
+    for i in range(10):
+        failures.record(b'invalid/%d' % i, FailureKind.INVALID)
+    # 普通失败按条数淘汰，隔离的条目保留
+    assert failures.stats() == {'hits': 0, 'entries': 4, 'quarantined': 2}
+    assert failures.get(b'invalid/0') is None
+    assert failures.get(b'blowup').error() == 'blowup: RecursionError'
+    assert failures.isQuarantined(b'timeout')
+    failures.clear()
+    assert failures.stats()['entries'] == 0 and failures.stats()['quarantined'] == 2
+    # 普通失败不会覆盖已隔离的条目
+    failures.put(b'blowup', Failure(FailureKind.ERROR, 'x'))
+    assert failures.isQuarantined(b'blowup')
+
+
+def testReportedFailure():
+    cache = TranslationCache(maxBodyBytes=64)
+    bts = packOle(bodyV5(*text('x')))
+    assert cache.recordFailure(bts, FailureKind.TIMEOUT, '5s') == 'timeout: 5s'
+    assert cache.translate(bts) == ('', 'timeout: 5s')
+    assert cache.failures.isQuarantined(bodyDigest(bts))
+
+    # 超过 maxBodyBytes 的数据不交给解析器，直接隔离
+    latex, err = cache.translate(packOle(bodyV5(*text('y' * 100))))
+    assert latex == '' and err.startswith('blowup: ')
+    assert cache.failures.stats()['quarantined'] == 2
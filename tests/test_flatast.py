@@ -0,0 +1,44 @@
+import struct
+
+import pytest
+
+from mtef.flatast import FlatAST, DumpHeaderFormat, DumpMagic, ParserVersion
+from mtef.mtef import MTEF
+
+
+def testDumpsRoundTrip(corpus):
+    for bts in corpus[:100]:
+        eqn, err = MTEF.OpenBytes(bts)
+        assert err is None
+        flat = eqn.flatten()
+        loaded, err = FlatAST.Loads(flat.dumps())
+        assert err is None
+        assert loaded.version == flat.version and loaded.valid == flat.valid
+        assert loaded.digest() == flat.digest()
+        try:
+            latex = eqn.Translate()
+        except IndexError:
+            # 缺少必需槽位的模板，重建后同样抛出
+            with pytest.raises(IndexError):
+                MTEF.FromFlat(loaded).Translate()
+            continue
+        assert MTEF.FromFlat(loaded).Translate() == latex
+
+
+def testLoadsRejectsParserVersion(corpus):
+    eqn, _ = MTEF.OpenBytes(corpus[0])
+    data = eqn.flatten().dumps()
+    _, _, version, valid = struct.unpack_from(DumpHeaderFormat, data)
+    stale = struct.pack(DumpHeaderFormat, DumpMagic, ParserVersion + 1, version, valid) + data[struct.calcsize(DumpHeaderFormat):]
+    flat, err = FlatAST.Loads(stale)
+    assert flat is None
+    assert 'parser version %d' % (ParserVersion + 1) in err
+
+
+def testLoadsRejectsBadData(corpus):
+    eqn, _ = MTEF.OpenBytes(corpus[0])
+    data = eqn.flatten().dumps()
+    assert FlatAST.Loads(data[:4]) == (None, 'FlatAST.Loads: data too short')
+    assert FlatAST.Loads(b'XXXX' + data[4:]) == (None, 'FlatAST.Loads: bad magic')
+    flat, err = FlatAST.Loads(data[:-8])
+    assert flat is None and err
@@ -0,0 +1,146 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mtef.microbatch import ExecutorBroken, Lane, LaneSpec, MicroBatcher, Overloaded, Policy
+
+
+class gate:
+    """
+    在线程池中执行的批处理函数，release 之前一直阻塞，模拟饱和的进程池
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        # batches [][]item //已经开始执行的批
+        self.batches = []
+
+    def __call__(self, items):
+        self.batches.append(items)
+        self.event.wait(5)
+        return [bts for _, bts, _ in items]
+
+    def release(self):
+        self.event.set()
+
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0.005)
+
+
+def lanes(maxQueue=2):
+    return {
+        Lane.INTERACTIVE: LaneSpec(8, 1, 0, maxQueue),
+        Lane.BULK: LaneSpec(1, 1, 0, maxQueue),
+    }
+
+
+async def withBatcher(executor, fn, test, **kwargs):
+    batcher = MicroBatcher(executor, fn=fn, **kwargs)
+    await batcher.start()
+    try:
+        await test(batcher)
+    finally:
+        fn.release()
+        await batcher.close()
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=2)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def testReject(executor):
+    fn = gate()
+
+    async def test(batcher):
+        first = asyncio.ensure_future(batcher.submit(('ole', b'1')))
+        await settle()
+        # 唯一的在途批占满 maxInflight，之后的请求在队列中等待
+        queued = [asyncio.ensure_future(batcher.submit(('ole', b'%d' % i))) for i in (2, 3)]
+        await settle()
+        with pytest.raises(Overloaded):
+            await batcher.submit(('ole', b'4'))
+        # 整批要么全部入队，要么全部拒绝
+        with pytest.raises(Overloaded):
+            await batcher.submitMany([('ole', b'5')], lane=Lane.INTERACTIVE)
+        assert batcher.stats()['rejected'] == 2
+        fn.release()
+        assert await first == b'1'
+        assert await asyncio.gather(*queued) == [b'2', b'3']
+
+    asyncio.run(withBatcher(executor, fn, test, maxInflight=1, policy=Policy.REJECT, lanes=lanes()))
+
+
+def testWait(executor):
+    fn = gate()
+
+    async def test(batcher):
+        futures = [asyncio.ensure_future(batcher.submit(('ole', b'%d' % i))) for i in range(4)]
+        await settle()
+        # 队列满后第 4 个请求等待空位，不会被拒绝
+        assert not any(future.done() for future in futures)
+        assert batcher.stats()['lanes'][Lane.INTERACTIVE]['queued'] == 2
+        fn.release()
+        assert await asyncio.gather(*futures) == [b'0', b'1', b'2', b'3']
+        assert batcher.stats()['rejected'] == 0
+
+    asyncio.run(withBatcher(executor, fn, test, maxInflight=1, policy=Policy.WAIT, lanes=lanes()))
+
+
+def testBatching(executor):
+    fn = gate()
+    fn.release()
+
+    async def test(batcher):
+        results = await batcher.submitMany([('ole', b'%d' % i) for i in range(20)], lane=Lane.BULK)
+        assert results == [b'%d' % i for i in range(20)]
+        stats = batcher.stats()['lanes'][Lane.BULK]
+        assert stats['items'] == 20 and stats['batches'] < 20
+
+    asyncio.run(withBatcher(executor, fn, test, maxBatch=8, maxDelay=0.01))
+
+
+def testReserved(executor):
+    fn = gate()
+
+    async def test(batcher):
+        bulk = asyncio.ensure_future(batcher.submitMany([('ole', b'%d' % i) for i in range(4)], lane=Lane.BULK))
+        await settle()
+        # 2 个 worker 中 1 个保留给交互通道，批量通道只能有 1 个在途批
+        assert batcher.stats()['lanes'][Lane.BULK]['inflight'] == 1
+        interactive = asyncio.ensure_future(batcher.submit(('ole', b'i')))
+        await settle()
+        assert batcher.stats()['lanes'][Lane.INTERACTIVE]['inflight'] == 1
+        assert [items[0][1] for items in fn.batches] == [b'0', b'i']
+        fn.release()
+        assert await interactive == b'i'
+        assert await bulk == [b'0', b'1', b'2', b'3']
+
+    asyncio.run(withBatcher(executor, fn, test, maxInflight=4, reserved=1, lanes=lanes(maxQueue=16)))
+
+
+def testExecutorBroken():
+    executor = ThreadPoolExecutor(max_workers=1)
+    fn = gate()
+    fn.release()
+
+    async def test(batcher):
+        assert await batcher.submit(('ole', b'1')) == b'1'
+        # 提交时 executor 已关闭，run_in_executor 同步抛出 RuntimeError
+        executor.shutdown()
+        with pytest.raises(ExecutorBroken):
+            await asyncio.wait_for(batcher.submit(('ole', b'2')), 5)
+        assert not batcher.dispatcher.done()
+        assert batcher.stats()['inflight'] == 0
+        assert 'cannot schedule new futures' in batcher.stats()['broken']
+        # 之后的请求直接失败
+        with pytest.raises(ExecutorBroken):
+            await batcher.submitMany([('ole', b'3'), ('ole', b'4')])
+
+    asyncio.run(withBatcher(executor, fn, test))
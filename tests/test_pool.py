@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from mtef.pool import RecycleReason, RecyclingPool, WorkerLost
+
+
+@pytest.fixture
+def pool(request):
+    pool = RecyclingPool(**request.param)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.mark.parametrize('pool', [{'workers': 1, 'maxTasks': 2}], indirect=True)
+def testRecycleOnMaxTasks(pool):
+    pids = [pool.submit(os.getpid).result(timeout=60) for _ in range(7)]
+    # 每个 worker 执行 2 个任务后退出，结果都已发回；第 7 个任务由第 4 个 worker 执行
+    assert [len(set(pids[i:i + 2])) for i in range(0, 7, 2)] == [1, 1, 1, 1]
+    assert len(set(pids)) == 4
+    stats = pool.stats()
+    assert stats['recycled'] == {RecycleReason.TASKS: 3}
+    assert stats['started'] == 4
+
+
+@pytest.mark.parametrize('pool', [{'workers': 1}], indirect=True)
+def testWorkerLost(pool):
+    before = pool.submit(os.getpid).result(timeout=60)
+    with pytest.raises(WorkerLost):
+        pool.submit(os._exit, 3).result(timeout=60)
+    # 补上新的 worker，之后的任务照常执行
+    after = pool.submit(os.getpid).result(timeout=60)
+    assert after != before
+    assert pool.stats()['recycled'] == {RecycleReason.LOST: 1}
+
+
+@pytest.mark.parametrize('pool', [{'workers': 1}], indirect=True)
+def testTaskError(pool):
+    with pytest.raises(ZeroDivisionError):
+        pool.submit(divmod, 1, 0).result(timeout=60)
+    # 无法 pickle 的函数只让这个任务失败
+    with pytest.raises(Exception):
+        pool.submit(lambda: 1).result(timeout=60)
+    assert pool.submit(divmod, 7, 2).result(timeout=60) == (3, 1)
+    assert pool.stats()['recycled'] == {}
+
+
+@pytest.mark.parametrize('pool', [{'workers': 1}], indirect=True)
+def testRequeueOnBrokenPipe(pool):
+    pid = pool.submit(os.getpid).result(timeout=60)
+    w = pool.pool[0]
+    send = w.conn.send
+
+    def broken(message):
+        # 模拟分配任务时 worker 已经退出
+        w.conn.send = send
+        raise BrokenPipeError(32, 'Broken pipe')
+
+    w.conn.send = broken
+    assert pool.submit(divmod, 7, 2).result(timeout=60) == (3, 1)
+    assert pool.submit(os.getpid).result(timeout=60) != pid
+    assert pool.stats()['recycled'] == {RecycleReason.LOST: 1}
+
+
+def testShutdownCancelsPending():
+    pool = RecyclingPool(1)
+    futures = [pool.submit(divmod, i, 1) for i in range(20)]
+    pool.shutdown(cancel_futures=True)
+    done = [future for future in futures if not future.cancelled()]
+    assert all(future.done() for future in futures)
+    assert [future.result() for future in done] == [(i, 0) for i in range(len(done))]
@@ -0,0 +1,96 @@
+import asyncio
+import http.client
+import io
+import json
+import socket
+import zipfile
+
+from mtef.docx import readEquations
+from mtef.serve import Server
+
+
+def testRejectedRequestsInMetrics(corpus):
+    async def main():
+        server = Server(workers=0, maxBody=1024)
+        await server.start('127.0.0.1', 0)
+
+        def client():
+            conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=30)
+            conn.request('POST', '/translate', corpus[0])
+            response = conn.getresponse()
+            assert response.status == 413
+            response.read()
+
+            sock = socket.create_connection(('127.0.0.1', server.port), timeout=30)
+            sock.sendall(b'GARBAGE\r\n\r\n')
+            assert sock.recv(64).startswith(b'HTTP/1.1 400')
+            sock.close()
+
+            conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=30)
+            conn.request('GET', '/metrics')
+            return json.loads(conn.getresponse().read())
+
+        try:
+            return await asyncio.to_thread(client)
+        finally:
+            await server.close()
+
+    metrics = asyncio.run(main())
+    # 路由之前就被拒绝的请求记在 '-' 下
+    assert metrics['requests'] == {'-': 2}
+    assert metrics['statuses'] == {'413': 1, '400': 1}
+
+
+def packDocx(objects, refs, extra=b''):
+    """
+    objects 为包内的公式对象，refs 为 document.xml 中按顺序引用的对象下标
+    """
+    rels = b''.join(b'<Relationship Id="rId%d" Type="http://x/oleObject" Target="embeddings/oleObject%d.bin"/>'
+                    % (i, i) for i in range(len(objects)))
+    document = b''.join(b'<o:OLEObject ProgID="Equation.DSMT4" r:id="rId%d"/>' % i for i in refs)
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('word/document.xml', document + extra)
+        archive.writestr('word/_rels/document.xml.rels', rels)
+        for i, obj in enumerate(objects):
+            archive.writestr('word/embeddings/oleObject%d.bin' % i, obj)
+    return buf.getvalue()
+
+
+def testDocxDecompressionBudget(corpus):
+    # 同一对象被引用多次时只解压一次，返回同一个 bytes
+    objects, err = readEquations(packDocx(corpus[:2], [0, 1, 0, 0, 1]))
+    assert err is None
+    assert [corpus.index(obj) for obj in objects] == [0, 1, 0, 0, 1]
+    assert objects[0] is objects[2]
+
+    # 每个对象只计一次：2000 次引用时预算恰好是包内文件的合计
+    bts = packDocx(corpus[:2], [0, 1] * 1000)
+    with zipfile.ZipFile(io.BytesIO(bts)) as archive:
+        size = sum(info.file_size for info in archive.infolist())
+    assert len(readEquations(bts, maxBytes=size)[0]) == 2000
+    assert readEquations(bts, maxBytes=size - 1) == (None, 'docx: more than %d bytes after decompression' % (size - 1))
+
+    async def main():
+        server = Server(workers=0, maxBody=64 << 10)
+        await server.start('127.0.0.1', 0)
+
+        def client(body):
+            conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=30)
+            conn.request('POST', '/translate', body)
+            response = conn.getresponse()
+            return response.status, json.loads(response.read())
+
+        try:
+            # 压缩后只有几 KB，解压后超过 maxBody
+            bomb = packDocx(corpus[:1], [0], extra=b' ' * (1 << 20))
+            assert len(bomb) < server.maxBody
+            status, result = await asyncio.to_thread(client, bomb)
+            assert status == 413 and 'after decompression' in result['error']
+
+            status, result = await asyncio.to_thread(client, packDocx(corpus[:2], [0, 1, 0]))
+            assert status == 200 and len(result['results']) == 3
+        finally:
+            await server.close()
+
+    asyncio.run(main())
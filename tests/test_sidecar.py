@@ -0,0 +1,140 @@
+import asyncio
+import socket
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mtef.bench import packOle
+from mtef.mtef import MTEF
+from mtef.sidecar import Frame, Sidecar, SidecarClient, SidecarError, Status, encodeFrame
+from synth import bodyV5, text
+
+
+def testEncodeFrame():
+    frame = encodeFrame(Status.OK, 'αβ'.encode('utf-8'))
+    assert frame == b'\x00\x00\x00\x05\x00' + 'αβ'.encode('utf-8')
+    assert Frame.unpack(frame[:Frame.size]) == (5, Status.OK)
+
+
+def serveWith(path, client, cls=Sidecar, **kwargs):
+    """
+    启动 sidecar，在线程中执行阻塞的 client(path)，返回其结果
+    """
+    async def main():
+        sidecar = cls(**kwargs)
+        await sidecar.start(path)
+        try:
+            return await asyncio.to_thread(client, path)
+        finally:
+            await sidecar.close()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'mtef.sock')
+
+
+@pytest.mark.parametrize('pooled', [False, True])
+def testPipelining(corpus, path, pooled):
+    expected = []
+    for bts in corpus[:80]:
+        eqn, _ = MTEF.OpenBytes(bts)
+        try:
+            expected.append((Status.OK, eqn.Translate()))
+        except IndexError:
+            # 缺少必需槽位的模板
+            expected.append((Status.ERROR, None))
+    # 中间夹一个无法识别的输入
+    items = corpus[:40] + [b'not an ole file'] + corpus[40:80]
+    expected.insert(40, (Status.INVALID, None))
+
+    def client(path):
+        with SidecarClient(path, timeout=30) as c:
+            results = c.translateMany(items, window=16)
+            with pytest.raises(SidecarError) as exc:
+                c.translate(b'')
+            assert exc.value.status == Status.INVALID
+            return results
+
+    # 使用线程池时经 MicroBatcher 并发翻译，回复仍按请求顺序
+    executor = ThreadPoolExecutor(max_workers=2) if pooled else None
+    try:
+        results = serveWith(path, client, executor=executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    assert [status for status, _ in results] == [status for status, _ in expected]
+    assert [latex for (_, latex), (status, _) in zip(results, expected) if status == Status.OK] == \
+        [latex for status, latex in expected if status == Status.OK]
+
+
+def testRejectOversizeFrame(path):
+    bts = packOle(bodyV5(*text('x' * 64)))
+
+    def client(path):
+        with SidecarClient(path, timeout=30) as c:
+            c.send(bts)
+            return c.receive(), c.file.read()
+
+    (status, message), rest = serveWith(path, client, maxFrame=256)
+    assert status == Status.REJECTED and message == 'frame larger than 256 bytes'
+    # 回复后关闭连接
+    assert rest == b''
+
+
+class failing(Sidecar):
+    """
+    payload 为 b'boom' 时翻译任务抛出异常
+    """
+
+    async def translate(self, flags, payload):
+        if payload == b'boom':
+            raise RuntimeError('boom')
+        return await super().translate(flags, payload)
+
+
+def testTaskError(corpus, path):
+    items = corpus[:3] + [b'boom'] + corpus[3:10]
+
+    def client(path):
+        with SidecarClient(path, timeout=10) as c:
+            return c.translateMany(items, window=4)
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        results = serveWith(path, client, failing, executor=executor, maxPending=2)
+    finally:
+        executor.shutdown()
+    # 出错的请求回复 ERROR，连接上其余的请求不受影响
+    assert [status for status, _ in results] == [Status.OK] * 3 + [Status.ERROR] + [Status.OK] * 7
+    assert results[3][1] == 'RuntimeError: boom'
+
+
+def testClientGone(corpus, path):
+    """
+    客户端发出请求后不读响应直接断开，处理函数不能因回复队列满而挂起
+    """
+    async def main():
+        sidecar = failing(maxPending=2, executor=ThreadPoolExecutor(max_workers=1))
+        await sidecar.start(path)
+
+        def client():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(path)
+            for bts in [b'boom'] + corpus[:50]:
+                sock.sendall(encodeFrame(0, bts))
+            sock.close()
+
+        try:
+            await asyncio.to_thread(client)
+            for _ in range(200):
+                if sidecar.connections == 0:
+                    break
+                await asyncio.sleep(0.01)
+            return sidecar.connections
+        finally:
+            await sidecar.close()
+            sidecar.executor.shutdown()
+
+    assert asyncio.run(main()) == 0
@@ -0,0 +1,57 @@
+import sqlite3
+
+from mtef.store import OutputVersion, TouchBatch, TranslationStore
+
+
+def testVersionsCoexist(tmp_path):
+    path = str(tmp_path / 'mtef.db')
+    old = TranslationStore(path, version=OutputVersion)
+    new = TranslationStore(path, version=OutputVersion + 1)
+    # 滚动发布：新旧 worker 写入同一个键，各自只读到自己版本的记录
+    old.put(b'k', 'old')
+    new.put(b'k', 'new')
+    for i in range(300):
+        old.put(b'old/%d' % i, 'x')
+    assert old.get(b'k') == 'old' and new.get(b'k') == 'new'
+    assert new.stats()['stale'] == 301 and old.stats()['newer'] == 1
+
+    # 旧版本的 prune 不删除新版本的记录
+    assert old.prune() == 0
+    assert new.get(b'k') == 'new'
+    # 新版本的 prune 只删除旧版本
+    assert new.prune() == 301
+    assert old.get(b'k') is None and new.get(b'k') == 'new'
+    old.close()
+    new.close()
+
+
+def testTouchBatched(tmp_path):
+    path = str(tmp_path / 'mtef.db')
+    store = TranslationStore(path)
+    store.put(b'k', 'latex')
+    conn = sqlite3.connect(path)
+    used = conn.execute('SELECT used FROM translations').fetchone()[0]
+
+    # 命中时只记在内存中，攒够 TouchBatch 条或关闭时写库
+    for _ in range(TouchBatch - 1):
+        assert store.get(b'k') == 'latex'
+    assert conn.execute('SELECT used FROM translations').fetchone()[0] == used
+    store.close()
+    assert conn.execute('SELECT used FROM translations').fetchone()[0] > used
+    conn.close()
+
+
+def testLegacySchemaDropped(tmp_path):
+    path = str(tmp_path / 'mtef.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE translations (key BLOB PRIMARY KEY, version TEXT NOT NULL, latex TEXT NOT NULL, '
+                 'size INTEGER NOT NULL, used REAL NOT NULL)')
+    conn.execute("INSERT INTO translations VALUES (x'00', 'abcdef', 'x', 1, 0)")
+    conn.commit()
+    conn.close()
+
+    store = TranslationStore(path)
+    assert store.stats()['entries'] == 0 and store.stats()['stale'] == 0
+    store.put(b'\x00', 'y')
+    assert store.get(b'\x00') == 'y'
+    store.close()
@@ -0,0 +1,189 @@
+"""
+翻译输出
+
+OutputDigest 为 bench 合成语料（400 个，种子 1）全部输出的 sha256。与最初的实现相比只有下面几处有意的改动，
+其余逐条一致：
+    v3 同一行内相邻的同类上下标在渲染时合并，不再用正则改写整个输出
+    v5 连续的 fnTEXT 字符只包一层 \\rm
+缺少必需子节点的模板与原实现一样抛出 IndexError（24 个），输出中记为 Missing。
+字符表、__slots__、FlatAST、缓存、记忆化、分片翻译等只改实现的提交都不应改变这个值。
+"""
+import hashlib
+
+import pytest
+
+from mtef.mtef import MTEF
+from synth import bodyV3, bodyV5, charV3, charV5, lineV3, lineV5, text, tmplV3, tmplV5
+
+OutputDigest = 'aa8884f1f3bfa2b054cddc56fbe36006a6f96f6b0cc5a6914c1e01ca4c06b1fe'
+
+Missing = '<IndexError>'
+
+
+def translateBody(body):
+    eqn, err = MTEF.OpenBody(body)
+    assert err is None
+    return eqn.Translate()
+
+
+def tryTranslate(translate):
+    try:
+        return translate()
+    except IndexError:
+        return Missing
+
+
+def translateAll(corpus):
+    out = []
+    for bts in corpus:
+        eqn, err = MTEF.OpenBytes(bts)
+        assert err is None
+        out.append(tryTranslate(eqn.Translate))
+    return out
+
+
+def drain(gen):
+    while True:
+        try:
+            next(gen)
+        except StopIteration as stop:
+            return stop.value
+
+
+@pytest.fixture(scope='module')
+def expected(corpus):
+    return translateAll(corpus)
+
+
+def testOutputDigest(expected):
+    assert expected.count(Missing) == 24
+    assert hashlib.sha256('\n'.join(expected).encode('utf-8')).hexdigest() == OutputDigest
+
+
+def testFlatParity(corpus, expected):
+    for bts, latex in zip(corpus, expected):
+        eqn, _ = MTEF.OpenBytes(bts)
+        assert tryTranslate(MTEF.FromFlat(eqn.flatten()).Translate) == latex
+
+
+def testTranslateIterParity(corpus, expected):
+    for bts, latex in zip(corpus, expected):
+        eqn, _ = MTEF.OpenBytes(bts)
+        assert tryTranslate(lambda: drain(eqn.TranslateIter(sliceNodes=8))) == latex
+
+
+def testRenderMemoParity(corpus, expected):
+    from mtef.memo import enableRenderMemo, disableRenderMemo
+
+    memo = enableRenderMemo(maxEntries=256)
+    try:
+        # 第二遍大部分子树命中
+        assert translateAll(corpus) == expected
+        assert translateAll(corpus) == expected
+        assert memo.stats()['hits'] > 0
+    finally:
+        disableRenderMemo()
+
+
+def testCacheParity(corpus, expected):
+    from mtef.cache import TranslationCache
+
+    cache = TranslationCache()
+    for _ in range(2):
+        results = [cache.translate(bts) for bts in corpus]
+        # 抛出 IndexError 的输入记入负缓存
+        assert [latex if err is None else Missing for latex, err in results] == expected
+        assert all(err.startswith('error: IndexError') for _, err in results if err is not None)
+    assert cache.stats()['hits'] >= len(corpus) - expected.count(Missing)
+    assert cache.failures.stats()['entries'] == expected.count(Missing)
+
+
+def testBatchThreadsParity(corpus, expected):
+    from mtef.batch import translateMany
+
+    results = translateMany(corpus, workers=4, chunksize=16, threads=True)
+    assert [r.latex if r.ok else Missing for r in results] == expected
+
+
+def testMissingSlot():
+    # 只有分子的分式输出 {Unknown}，与最初的实现一致
+    assert translateBody(bodyV5(tmplV5(11, 0, lineV5(charV5(0x31))))) == '$ \\frac { 1 } {Unknown} $'
+    # 缺少必需的槽位时抛出 IndexError，不输出带空洞的 latex
+    with pytest.raises(IndexError):
+        translateBody(bodyV5(tmplV5(10, 0, lineV5(charV5(0x31)))))
+    with pytest.raises(IndexError):
+        translateBody(bodyV5(tmplV5(11, 0)))
+
+
+def testCustomHandler():
+    from mtef.record import SelectorType
+    from mtef.templates import TmplHandlers
+
+    previous = TmplHandlers.get(SelectorType.tmBOX)
+
+    @TmplHandlers.register(SelectorType.tmBOX, slots=('main',))
+    def tmplBoxed(eqn, ast, slots):
+        return '\\boxed{ %s }' % slots['main'], None
+
+    try:
+        body = bodyV5(tmplV5(SelectorType.tmBOX, 0, lineV5(charV5(0x78))))
+        assert '\\boxed{ x }' in translateBody(body)
+    finally:
+        TmplHandlers.unregister(SelectorType.tmBOX)
+        if previous is not None:
+            TmplHandlers.handlers[SelectorType.tmBOX] = previous
+
+
+@pytest.mark.parametrize('items, latex', [
+    # 相邻的下标合并，X_{A}_{B} 是 Double subscript 错误
+    ([charV3(0x58), tmplV3(15, 1, lineV3(charV3(0x41))), tmplV3(15, 1, lineV3(charV3(0x42)))], '$X_{A B}$'),
+    # 上标与下标不合并
+    ([charV3(0x58), tmplV3(15, 0, lineV3(charV3(0x41))), tmplV3(15, 1, lineV3(charV3(0x42)))], '$X^{A}_{B}$'),
+    # 内容带花括号，原来的正则会截断
+    ([charV3(0x58), tmplV3(15, 1, lineV3(tmplV3(14, 0, lineV3(charV3(0x31)), lineV3(charV3(0x32))))),
+      tmplV3(15, 1, lineV3(charV3(0x42)))], '$X_{\\frac{1}{2} B}$'),
+    # 左下标后的下标并入左下标；下标后的左下标以 {} 开头，不合并
+    ([charV3(0x58), tmplV3(44, 1, lineV3(charV3(0x61))), tmplV3(15, 1, lineV3(charV3(0x62)))], '$X{}_{a b}$'),
+    ([charV3(0x58), tmplV3(15, 1, lineV3(charV3(0x61))), tmplV3(44, 1, lineV3(charV3(0x62)))], '$X_{a}{}_{b}$'),
+])
+def testMergeScriptsV3(items, latex):
+    assert translateBody(bodyV3(*items)) == latex
+
+
+def testTextRun():
+    # 连续的 fnTEXT 字符只包一层 \rm，其他字体的字符把它们隔开
+    assert translateBody(bodyV5(*text('a+b', 129))) == '$ { \\rm{ a+b } } $'
+    assert translateBody(bodyV5(*text('ab', 129), charV5(0x78), *text('cd', 129))) == '$ { \\rm{ ab } }x{ \\rm{ cd } } $'
+    # 反斜杠之后断开，不与下一个字符粘连成控制字
+    assert translateBody(bodyV5(*text('\\Q', 129))) == '$ { \\rm{ \\ } }{ \\rm{ Q } } $'
+    # v3 仍按普通文本输出
+    assert translateBody(bodyV3(*text('ab', 129, v3=True))) == '$ab$'
+
+
+def testRenderMemoInvalidation():
+    from mtef.memo import enableRenderMemo, disableRenderMemo
+    from mtef.record import SelectorType
+    from mtef.templates import TmplHandlers
+
+    body = bodyV5(tmplV5(SelectorType.tmFRACT, 0, lineV5(*text('ab')), lineV5(*text('c'))))
+    previous = TmplHandlers.get(SelectorType.tmFRACT)
+    memo = enableRenderMemo()
+    try:
+        assert translateBody(body) == '$ \\frac { ab } { c } $'
+
+        @TmplHandlers.register(SelectorType.tmFRACT, slots=('num', 'den'))
+        def tmplDfrac(eqn, ast, slots):
+            return '\\dfrac { %s } { %s }' % (slots['num'], slots['den']), None
+
+        # 注册新的处理器后不再返回记忆表中的旧片段
+        assert translateBody(body) == '$ \\dfrac { ab } { c } $'
+        TmplHandlers.unregister(SelectorType.tmFRACT)
+        assert translateBody(body) == '$ latex tmpl not implementabc $'
+        # 清空之前开始渲染的片段不写入
+        generation = memo.generation
+        memo.invalidate()
+        memo.put(('stale',), 'x', generation)
+        assert memo.get(('stale',)) is None
+    finally:
+        TmplHandlers.handlers[SelectorType.tmFRACT] = previous
+        disableRenderMemo()
@@ -0,0 +1,11 @@
+"""
+forkserver 预加载模块
+
+RecyclingPool 通过 set_forkserver_preload 让 forkserver 进程导入本模块：建好全部翻译表后 gc.freeze()，
+之后由 forkserver fork 出的 worker（包括回收后补上的 worker）共享这些页面，启动时不再建表。
+不要在其他地方导入。
+"""
+from .pool import prewarm
+from .serve import warmWorker
+
+prewarm(warmWorker)